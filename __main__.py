@@ -1,12 +1,84 @@
+import time
+# Before anything else, so that the startup breakdown includes how long the imports took.
+started = time.perf_counter()
 from telebot.asyncio_handler_backends import State, StatesGroup
 import asyncio
 import re
-from src import lta_api_processor, lta_api_interface, favorites_db, lta_api_utils
-from src.favorites_db import NoFavoriteStationsException, BusStationNotExistsException
-from src.setup_constants import bot
-from telebot.util import quick_markup, smart_split
+from src import lta_api_processor, lta_api_interface, favorites_db, lta_api_utils, metrics, static_network
+from src.favorites_db import NoFavoriteStationsException, BusStationNotExistsException, FavoriteNotFoundException
+from src.setup_constants import bot, shared_cache, sg_timezone, METRICS_ENABLED, METRICS_PORT, METRICS_LOG_INTERVAL
+from src.setup_constants import ARRIVAL_HISTORY_PATH, WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_WORKERS
+from src.webhook_server import WebhookServer
+from telebot.util import quick_markup, smart_split, extract_arguments
+from telebot.asyncio_helper import ApiTelegramException
+from telebot import types
+from src.refresh_tracker import RefreshTracker
+from src.arrival_alerts import AlertScheduler, AlertStore, TooManyAlertsException
+from src.arrival_history import ArrivalHistoryRecorder
 import datetime
 
+# Every handler goes through this, so that each user's updates are handled in order and nobody can hog the bot.
+executor = lta_api_processor.executor
+
+# Everything we say goes through these, so that we can see how long Telegram takes to take it.
+send_message = metrics.timed("telegram_send")(bot.send_message)
+reply_to = metrics.timed("telegram_send")(bot.reply_to)
+edit_message_text = metrics.timed("telegram_send")(bot.edit_message_text)
+
+# What we last sent for each message with a Refresh button, so that refreshing only touches what changed.
+refresh_tracker = RefreshTracker()
+
+async def reply_overloaded(update):
+    # For when the executor turns an update away.
+    if isinstance(update, types.CallbackQuery):
+        await bot.answer_callback_query(update.id, "I'm a little swamped right now, try again in a bit!")
+    else:
+        await reply_to(update, "I'm a little swamped right now, try again in a bit!")
+
+async def send_refreshable(chat_id: int, parts: list, markup):
+    # Sends a reply (split into parts if it's too long for one message) with the Refresh button on the last part.
+    sent = []
+    for i in range(len(parts)):
+        sent.append(await send_message(chat_id, parts[i],
+                                        parse_mode = "HTML",
+                                        reply_markup = markup if i == len(parts) - 1 else None))
+    refresh_tracker.remember(chat_id, [sent_message.message_id for sent_message in sent], parts)
+
+async def edit_refreshable(query, parts: list, markup):
+    # Updates a reply sent by send_refreshable in place, only editing the parts that actually changed.
+    # Returns what to tell the user when answering the callback (None for nothing), which is up to the caller.
+    chat_id, message_id = query.message.chat.id, query.message.id
+    message_ids = refresh_tracker.message_ids(chat_id, message_id)
+    if len(message_ids) != len(parts):
+        # The reply grew or shrank by a part (or we've forgotten the other parts), so there's no lining them up. Out with the old, in with the new.
+        for old_message_id in message_ids:
+            try:
+                await bot.delete_message(chat_id, old_message_id)
+            except ApiTelegramException as e:
+                # Already gone, or too old for us to delete. Either way, the new reply still goes out.
+                print(str(e))
+        refresh_tracker.forget(chat_id, message_id)
+        await send_refreshable(chat_id, parts, markup)
+        return None
+
+    changed = refresh_tracker.changed_parts(chat_id, message_id, parts)
+    if not changed: return "Already up to date!"
+    for i in changed:
+        try:
+            await edit_message_text(parts[i], chat_id, message_ids[i],
+                                    parse_mode = "HTML",
+                                    reply_markup = markup if i == len(parts) - 1 else None)
+        except ApiTelegramException as e:
+            # Telegram won't "edit" a message into exactly what it already says, which is fine by us.
+            if "message is not modified" in e.description: continue
+            # Anything else (the user deleted it, it's too old to edit...) and we just send the whole reply again instead.
+            print(str(e))
+            refresh_tracker.forget(chat_id, message_id)
+            await send_refreshable(chat_id, parts, markup)
+            return None
+    refresh_tracker.remember(chat_id, message_ids, parts)
+    return None
+
 async def parse_bus_station_code(message):
     # A bus stop code is definitely 5 digits. 
     # Unless the user is trying to mess with me.
@@ -17,7 +89,7 @@ async def parse_bus_station_code(message):
         return station
     except Exception as e:
         print(str(e))
-        await bot.reply_to(message, "I couldn't find a valid bus station :<")
+        await reply_to(message, "I couldn't find a valid bus station :<")
         await bot.delete_state(message.from_user.id, message.chat.id)
         return None
 
@@ -31,15 +103,20 @@ class FavoriteCommandStates(StatesGroup):
     add = State()
     delete = State()
 
+class NearestCommandStates(StatesGroup):
+    location = State()
+
 # start command
 
 @bot.message_handler(commands = ['start'])
+@executor.per_user(on_overload = reply_overloaded)
 async def say_hi(message):
     await bot.delete_state(message.from_user.id, message.chat.id)
     await bot.send_chat_action(message.chat.id, 'typing')
-    await bot.reply_to(message, f"Hello! I'm a bot that can help you get the latest bus timings!\nType /help for more information!")
+    await reply_to(message, f"Hello! I'm a bot that can help you get the latest bus timings!\nType /help for more information!")
 
 @bot.message_handler(commands = ['help'])
+@executor.per_user(on_overload = reply_overloaded)
 async def give_help(message):
 
     help_message = """<b>What are my commands?</b>
@@ -47,11 +124,14 @@ async def give_help(message):
                     /help - See this help message! :D
 
                     (The below commands may require a 5-digit bus station code you can find at the bus stops themselves or on Google.)
-                    /bus - Get the latest bus arrival information from me!
+                    /bus - Get the latest bus arrival information from me! You can also search by name, e.g. /bus bedok int
                     /fav_bus - Get the latest bus arrivals on your FAVORITE bus stops! :D
                     /see_fav - See all your favorite bus stops and their codes!
                     /add_fav - Add a bus station to your favorites!
                     /del_fav - Remove a bus station from your favorites!
+                    /nearest - Find the closest bus stations to you that a particular bus stops at, e.g. /nearest 12
+                    /alert - Get told when a bus is a few minutes away, e.g. /alert 01012 12 3
+                    /alerts - See (and cancel) the buses you're waiting on!
 
                     <b>What else can I do?</b>
                     If you send me your location, I will find the three (3) closest bus stations to you, and tell you their arrival information!
@@ -59,52 +139,100 @@ async def give_help(message):
 
     await bot.delete_state(message.from_user.id, message.chat.id)
     await bot.send_chat_action(message.chat.id, 'typing')
-    await bot.reply_to(message, help_message, 
+    await reply_to(message, help_message, 
                     parse_mode = "HTML")
 
 # Location was sent.
 
-@bot.message_handler(content_types = ['location'])
-async def arrival_get_nearest_bus_station_info(message):
+async def send_nearest_bus_station_info(message, bus: str = None):
     await bot.send_chat_action(message.chat.id, 'typing')
+    refresh_data = f"refresh_nearest_arrivals|{message.location.latitude}|{message.location.longitude}"
+    if bus is not None: refresh_data += f"|{bus}"
     refresh_markup = quick_markup({
-        "Refresh": {"callback_data": f"refresh_nearest_arrivals|{message.location.latitude}|{message.location.longitude}"}
+        "Refresh": {"callback_data": refresh_data}
     })
 
     # Because we CAN in fact exceed TG's message character limit, we are splitting the messages up...
-    result = lta_api_processor.display_nearest_bus_stations(message.location.latitude, message.location.longitude)
-    parts = smart_split(result)
-    for i in range(len(parts)):
-        await bot.send_message(message.chat.id,
-                        parts[i],
-                        parse_mode = "HTML",
-                        reply_markup = refresh_markup if i == len(parts) - 1 else None
-                        )
+    result = await lta_api_processor.display_nearest_bus_stations(message.location.latitude, message.location.longitude, bus)
+    await send_refreshable(message.chat.id, smart_split(result), refresh_markup)
+
+# nearest command, i.e. "which stops near me does bus 12 stop at?". The location comes in the next message.
+@bot.message_handler(commands = ['nearest'])
+@executor.per_user(on_overload = reply_overloaded)
+async def nearest_get_bus(message):
+    result = re.search(r"\d+[a-zA-Z]?", extract_arguments(message.text) or "")
+    if not result:
+        await reply_to(message, "Which bus are you looking for? e.g. /nearest 12")
+        return
+    await bot.set_state(message.from_user.id, NearestCommandStates.location, message.chat.id)
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data['nearest_bus'] = result.group(0)
+    await send_message(message.chat.id, f"Send me your location, and I'll find the closest stops that bus {result.group(0)} stops at!")
+
+# Registered before the plain location handler, so that it gets first dibs while we're waiting on a /nearest.
+@bot.message_handler(state = NearestCommandStates.location, content_types = ['location'])
+@executor.per_user(on_overload = reply_overloaded)
+async def nearest_retrieve_info(message):
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        bus = data['nearest_bus']
+    await bot.delete_state(message.from_user.id, message.chat.id)
+    await send_nearest_bus_station_info(message, bus)
+
+@bot.message_handler(content_types = ['location'])
+@executor.per_user(on_overload = reply_overloaded)
+async def arrival_get_nearest_bus_station_info(message):
+    await send_nearest_bus_station_info(message)
 
 # bus command
 
+async def search_bus_station(message, search_text: str):
+    # For when we get (part of) a station's name instead of its code. We give them the closest matches as buttons to pick from.
+    await bot.delete_state(message.from_user.id, message.chat.id)
+    matches = await lta_api_processor.search_stations(search_text)
+    if not matches:
+        await reply_to(message, "I couldn't find a valid bus station :<")
+        return
+    station_markup = quick_markup({f"{name} ({road}, {code})": {'callback_data': f"station|{code}"} for code, name, road, score in matches}, row_width = 1)
+    await send_message(message.chat.id, "Did you mean one of these?", reply_markup = station_markup)
+
 @bot.message_handler(commands='bus')
+@executor.per_user(on_overload = reply_overloaded)
 async def arrival_get_bus_station(message):
+    # "/bus 01012" skips straight to asking for the bus, and "/bus bedok int" searches straight away.
+    search_text = (extract_arguments(message.text) or "").strip()
+    if re.fullmatch(r"\d{5}", search_text):
+        await ask_for_bus(message, search_text)
+        return
+    if search_text:
+        await search_bus_station(message, search_text)
+        return
     await bot.set_state(message.from_user.id, ArrivalCommandStates.station, message.chat.id)
-    await bot.send_message(message.chat.id, "What is your bus stop code?")
+    await send_message(message.chat.id, "What is your bus stop code? (Or the name of the bus stop!)")
 
 @bot.message_handler(state = ArrivalCommandStates.station)
+@executor.per_user(on_overload = reply_overloaded)
 async def arrival_get_bus(message):
-    station = await parse_bus_station_code(message)
+    # No 5-digit code? Then they probably typed the station's name instead.
+    if not re.search(r"\d{5}", message.text or ""):
+        await search_bus_station(message, message.text or "")
+        return
+    await ask_for_bus(message, await parse_bus_station_code(message))
 
+async def ask_for_bus(message, station: str):
     if not lta_api_utils.get_station_name(station):
-        await bot.send_message(message.chat.id, "I couldn't find a valid bus station :<")
+        await send_message(message.chat.id, "I couldn't find a valid bus station :<")
         await bot.delete_state(message.from_user.id, message.chat.id)
         return
 
     await bot.set_state(message.from_user.id, ArrivalCommandStates.bus, message.chat.id)
     # Now we ask them for the bus number, which should be some sequence of digits and maybe a letter at the back. 
     # Unless the user is trying to mess with me.
-    await bot.send_message(message.chat.id, "Which bus number? ('A' for all)")
+    await send_message(message.chat.id, "Which bus number? ('A' for all)")
     async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
         data['arrival_station'] = station
 
 @bot.message_handler(state = ArrivalCommandStates.bus)
+@executor.per_user(on_overload = reply_overloaded)
 async def arrival_retrieve_info(message):
     msg_txt = message.text
     try:
@@ -115,7 +243,7 @@ async def arrival_retrieve_info(message):
             bus = msg_txt[result.start():result.end()]
     except Exception as e:
         print(str(e))
-        await bot.reply_to(message, "I couldn't find a valid bus number :<")
+        await reply_to(message, "I couldn't find a valid bus number :<")
         return
     
     # Now we can trigger the process to get arrival timings.
@@ -125,136 +253,250 @@ async def arrival_retrieve_info(message):
         refresh_markup = quick_markup({
             "Refresh": {"callback_data": f"refresh_display_arrivals|{data['arrival_station']}|{bus}"}
         })
-        text = lta_api_processor.display_arrivals(data['arrival_station'], bus)
+        text = await lta_api_processor.display_arrivals(data['arrival_station'], bus)
         if not text:
-            text = "I can't find this bus service. Please check that you have not entered the wrong bus station code."
-            refresh_markup = {}
-
-        # TODO: If it ever becomes apparent that there can be enough services 
-        # in a bus station to exceed Telegram's hard limit of 4096 characters per message,
-        # split the text up with smart_split.
-        # For now we will KIV in the case of *individual* stations.
-        await bot.send_message(message.chat.id, text,
-                            parse_mode = "HTML",
-                            reply_markup = refresh_markup
-                            )
+            await send_message(message.chat.id, "I can't find this bus service. Please check that you have not entered the wrong bus station code.")
+        else:
+            # TODO: If it ever becomes apparent that there can be enough services 
+            # in a bus station to exceed Telegram's hard limit of 4096 characters per message,
+            # split the text up with smart_split.
+            # For now we will KIV in the case of *individual* stations.
+            await send_refreshable(message.chat.id, [text], refresh_markup)
         await bot.delete_state(message.from_user.id, message.chat.id)
 
 # add_favorite command
 @bot.message_handler(commands = ['add_fav','add_favorite'])
+@executor.per_user(on_overload = reply_overloaded)
 async def add_favorite_get_bus_station(message):
     await bot.set_state(message.from_user.id, FavoriteCommandStates.add, message.chat.id)
-    await bot.send_message(message.chat.id, "Which bus stop code would you like to favorite?")
+    await send_message(message.chat.id, "Which bus stop code would you like to favorite?")
 
 @bot.message_handler(state = FavoriteCommandStates.add)
+@executor.per_user(on_overload = reply_overloaded)
 async def add_favorite_bus_station(message):
     await bot.delete_state(message.from_user.id, message.chat.id)
     await bot.send_chat_action(message.chat.id, 'typing')
     station = await parse_bus_station_code(message)
     try:
-        station_name = favorites_db.add_favorite(message.from_user.id, station)
-        await bot.send_message(message.chat.id, f"I've added {station_name} to your list of favorites!")
+        station_name = await favorites_db.add_favorite(message.from_user.id, station)
+        await send_message(message.chat.id, f"I've added {station_name} to your list of favorites!")
     except BusStationNotExistsException:
-        await bot.send_message(message.chat.id, f"I couldn't find that bus station :<.\nPlease check that you haven't entered the wrong code.")
+        await send_message(message.chat.id, f"I couldn't find that bus station :<.\nPlease check that you haven't entered the wrong code.")
     
     
 # del_favorite command
 @bot.message_handler(commands = ['del_fav', 'del_favorite', 'delete_fav', 'delete_favorite'])
+@executor.per_user(on_overload = reply_overloaded)
 async def delete_favorite_get_bus_station(message):
     await bot.set_state(message.from_user.id, FavoriteCommandStates.delete, message.chat.id)
     try:
-        favorites_db.check_favorites(message.from_user.id)
+        await favorites_db.check_favorites(message.from_user.id)
     except NoFavoriteStationsException:
-        await bot.send_message(message.chat.id, "Hmm, you don't seem to have any favorite bus stations. Use /add_fav to add some!")
+        await send_message(message.chat.id, "Hmm, you don't seem to have any favorite bus stations. Use /add_fav to add some!")
     else:
-        await bot.send_message(message.chat.id, f"Which bus stop code would you like to remove from your favorites?")
+        await send_message(message.chat.id, f"Which bus stop code would you like to remove from your favorites?")
 
 @bot.message_handler(state = FavoriteCommandStates.delete)
+@executor.per_user(on_overload = reply_overloaded)
 async def delete_favorite_bus_station(message):
     await bot.delete_state(message.from_user.id, message.chat.id)
     await bot.send_chat_action(message.chat.id, 'typing')
     station = await parse_bus_station_code(message)
+    # parse_bus_station_code has already told them off.
+    if station is None: return
     try:
-        station_name = favorites_db.delete_favorite(message.from_user.id, station)
-        await bot.send_message(message.chat.id, f"I've removed {station_name} from your list of favorites!")
+        station_name = await favorites_db.delete_favorite(message.from_user.id, station)
+        await send_message(message.chat.id, f"I've removed {station_name} from your list of favorites!")
     except NoFavoriteStationsException:
-        await bot.send_message(message.chat.id, "Hmm, you don't seem to have any favorite bus stations. Use /add_fav to add some!")
+        await send_message(message.chat.id, "Hmm, you don't seem to have any favorite bus stations. Use /add_fav to add some!")
+    except BusStationNotExistsException:
+        await send_message(message.chat.id, f"I couldn't find that bus station :<.\nPlease check that you haven't entered the wrong code.")
+    except FavoriteNotFoundException:
+        await send_message(message.chat.id, "That bus station isn't one of your favorites! Use /favorites to see which ones are.")
 
 # see_favorites command
 @bot.message_handler(commands = ['favorites', 'see_fav', 'see_faves', 'show_favorites'])
+@executor.per_user(on_overload = reply_overloaded)
 async def show_favorite_bus_stations(message):
     await bot.send_chat_action(message.chat.id, 'typing')
     
     try:
-        station_list = favorites_db.get_favorites(message.from_user.id)
-        await bot.send_message(message.chat.id, lta_api_processor.display_multiple_station_names(station_list), 
+        station_list = await favorites_db.get_favorites(message.from_user.id)
+        await send_message(message.chat.id, await executor.run_blocking(lta_api_processor.display_multiple_station_names, station_list), 
                             parse_mode = "HTML"
                             )
     except NoFavoriteStationsException:
-        await bot.send_message(message.chat.id, "Hmm, you don't seem to have any favorite bus stations. Use /add_fav to add some!")
+        await send_message(message.chat.id, "Hmm, you don't seem to have any favorite bus stations. Use /add_fav to add some!")
 
 # show_favorites command
 @bot.message_handler(commands = ['favorite_arrivals', 'fav_arrivals', 'fav_bus'])
+@executor.per_user(on_overload = reply_overloaded)
 async def show_favorite_bus_station_arrivals(message):
     await bot.send_chat_action(message.chat.id, 'typing')
     try:
-        station_list = favorites_db.get_favorites(message.from_user.id)
+        station_list = await favorites_db.get_favorites(message.from_user.id)
+        station_names = await executor.run_blocking(lambda: [lta_api_utils.get_station_name(station_code) for station_code in station_list])
         button_dict = {}
-        for station_code in station_list:
-            button_dict[f"{lta_api_utils.get_station_name(station_code)}({station_code})"] = {'callback_data': f"station|{station_code}"}
+        for station_code, station_name in zip(station_list, station_names):
+            button_dict[f"{station_name}({station_code})"] = {'callback_data': f"station|{station_code}"}
         station_markup = quick_markup(button_dict, row_width = 1)
-        await bot.send_message(message.chat.id, "Tap on the buttons to get the arrival times for each station!", 
+        await send_message(message.chat.id, "Tap on the buttons to get the arrival times for each station!", 
                             parse_mode = "HTML",
                             reply_markup = station_markup)
     except NoFavoriteStationsException:
-        await bot.send_message(message.chat.id, "Hmm, you don't seem to have any favorite bus stations. Use /add_fav to add some!")
+        await send_message(message.chat.id, "Hmm, you don't seem to have any favorite bus stations. Use /add_fav to add some!")
 
-@bot.callback_query_handler(lambda query: "station" in query.data)
+@bot.callback_query_handler(lambda query: query.data.startswith("station|"))
+@executor.per_user(on_overload = reply_overloaded)
 async def print_station(query):
     message = query.message
-    data = query.data.split(',')
+    data = query.data.split('|')
     station_code = data[1]
     markup = quick_markup({
             'Refresh': {'callback_data': f"refresh_display_arrivals|{data[1]}|-1"}
     })
-    await bot.send_message(message.chat.id, lta_api_processor.display_arrivals(data[1], "-1"),
-                        parse_mode = 'HTML',
-                        reply_markup = markup)
+    await send_refreshable(message.chat.id, [await lta_api_processor.display_arrivals(data[1], "-1")], markup)
 
+# Arrival alerts, i.e. "tell me when bus 12 is 3 minutes away from 01012".
+
+async def send_alert(alert, bus):
+    station_name = lta_api_utils.get_station_name(alert.station)
+    if bus is None:
+        await send_message(alert.chat_id, f"I've stopped waiting for bus {alert.service} at {station_name} ({alert.station}), it's been a while :<")
+        return
+    status = bus.status(datetime.datetime.now(tz = sg_timezone))
+    await send_message(alert.chat_id, f"\U0001f68c Bus {alert.service} at {station_name} ({alert.station}): {status}!",
+                        reply_markup = quick_markup({
+                            "Refresh": {"callback_data": f"refresh_display_arrivals|{alert.station}|{alert.service}"}
+                        }))
+
+# Each station anyone is waiting at gets polled (through the arrival cache) once per round, however many people are waiting there.
+# With more than one worker, the shared cache makes sure each alert only goes out once.
+alerts = AlertScheduler(lta_api_processor.arrival_cache.get, send_alert, AlertStore(), shared = shared_cache if shared_cache.shared else None)
+
+@bot.message_handler(commands = ['alert'])
+@executor.per_user(on_overload = reply_overloaded)
+async def add_alert(message):
+    args = (extract_arguments(message.text) or "").split()
+    if len(args) < 2 or not re.fullmatch(r"\d{5}", args[0]) or (len(args) > 2 and not args[2].isdigit()):
+        await reply_to(message, "Tell me the bus stop, the bus, and how many minutes away it should be, e.g. /alert 01012 12 3")
+        return
+    station = args[0]
+    minutes = min(max(int(args[2]), 1), 30) if len(args) > 2 else 3
+    network = await static_network.ensure_network()
+    # Whichever way they typed it, e.g. "12E" for 12e.
+    bus = next((service for service in network.get_services(station) if service.lower() == args[1].lower()), None)
+    if bus is None:
+        await reply_to(message, f"Bus {args[1]} doesn't seem to stop at {station} :<")
+        return
+    try:
+        await alerts.add(message.from_user.id, message.chat.id, station, bus, minutes)
+    except TooManyAlertsException:
+        await reply_to(message, "You're already waiting on as many buses as I can keep track of! Cancel some with /alerts first.")
+        return
+    await reply_to(message, f"Okay! I'll tell you when bus {bus} is {minutes} min away from {network.get_station_name(station)} ({station}).")
+
+@bot.message_handler(commands = ['alerts'])
+@executor.per_user(on_overload = reply_overloaded)
+async def show_alerts(message):
+    user_alerts = await alerts.list_alerts(message.from_user.id)
+    if not user_alerts:
+        await send_message(message.chat.id, "You aren't waiting on any buses. Use /alert to get told when one's nearly here!")
+        return
+    markup = quick_markup({f"Stop waiting for bus {alert.service} at {alert.station}": {"callback_data": f"cancel_alert|{alert.station}|{alert.service}"}
+                            for alert in user_alerts}, row_width = 1)
+    lines = [f"- Bus {alert.service} at {lta_api_utils.get_station_name(alert.station)} ({alert.station}), {alert.minutes} min away"
+                for alert in user_alerts]
+    await send_message(message.chat.id, "Here are the buses you're waiting on:\n" + "\n".join(lines), reply_markup = markup)
+
+@bot.callback_query_handler(lambda query: query.data.startswith("cancel_alert|"))
+@executor.per_user(on_overload = reply_overloaded)
+async def cancel_alert(query):
+    data = query.data.split('|')
+    if await alerts.cancel(query.from_user.id, data[1], data[2]):
+        await bot.answer_callback_query(query.id, f"Okay, I've stopped waiting for bus {data[2]} at {data[1]}.")
+    else:
+        await bot.answer_callback_query(query.id, "That one's already done!")
+
+# Inline queries, i.e. "@<bot> bedok int" from any chat.
+# These skip the executor's queue: they come in on every keystroke, and Telegram only cares about the latest one anyway.
+@bot.inline_handler(lambda query: len(query.query.strip()) >= 2)
+async def inline_search_bus_station(query):
+    matches = await lta_api_processor.search_stations(query.query, k = 10)
+    results = [types.InlineQueryResultArticle(id = code,
+                                                title = f"{name} ({code})",
+                                                description = road,
+                                                input_message_content = types.InputTextMessageContent(f"{name} ({road}): bus stop code {code}"))
+                for code, name, road, score in matches]
+    await bot.answer_inline_query(query.id, results, cache_time = 60)
 
 @bot.callback_query_handler(lambda query: "refresh" in query.data)
+@executor.per_user(on_overload = reply_overloaded)
 async def refresh_message(query):
 
     # Unfortunately we have to work around the limitations of Telegram's InlineKeyboardButtons to provide the same querying ability.
     message = query.message
     data = query.data.split('|')
     chat_id = message.chat.id
-    await bot.delete_message(message.chat.id, message.id)
-    if data[0] == 'refresh_display_arrivals':
-        text = lta_api_processor.display_arrivals(data[1], data[2])
-        markup = quick_markup({
-            'Refresh': {'callback_data': f"refresh_display_arrivals|{data[1]}|{data[2]}"}
-        })
-        await bot.send_message(chat_id, text,
-                                parse_mode = "HTML", 
-                                reply_markup = markup)
-    elif data[0] == 'refresh_nearest_arrivals':
-        # Despite having nearly identical code to that of arrival_get_nearest_bus_station_info, the smart_split function returns a tuple instead of a string here.
-        # TODO: Get to the root of this issue.
-        text = lta_api_processor.display_nearest_bus_stations(float(data[1]), float(data[2])),
+    # Telegram keeps the button spinning until we answer, so every way out of here answers exactly once.
+    notice = None
+    try:
+        if not refresh_tracker.tap(chat_id, message.id):
+            notice = "Just refreshed! Give it a few seconds."
+            return
+        if data[0] == 'refresh_display_arrivals':
+            text = await lta_api_processor.display_arrivals(data[1], data[2])
+            if not text:
+                notice = "I can't find this bus service any more :<"
+                return
+            parts = [text]
+        elif data[0] == 'refresh_nearest_arrivals':
+            # Refresh buttons from /nearest have the bus number tacked on the end.
+            bus = data[3] if len(data) > 3 else None
+            parts = smart_split(await lta_api_processor.display_nearest_bus_stations(float(data[1]), float(data[2]), bus))
+        else:
+            return
         markup = quick_markup({
-            "Refresh": {"callback_data": f"refresh_nearest_arrivals|{data[1]}|{data[2]}"}
+            "Refresh": {"callback_data": query.data}
         })
-        parts = smart_split(text)
-        for i in range(len(parts)):
-            await bot.send_message(message.chat.id,
-                            parts[i][0],
-                            parse_mode = "HTML",
-                            reply_markup = markup if i == len(parts) - 1 else None
-                            )
+        notice = await edit_refreshable(query, parts, markup)
+    finally:
+        try:
+            await bot.answer_callback_query(query.id, notice)
+        except ApiTelegramException as e:
+            # Most likely the query's too old to answer by now.
+            print(str(e))
 
 async def bot_setup():
-    await asyncio.gather(lta_api_interface.query_static_data(),
-                            bot.infinity_polling())
-
-asyncio.run(bot_setup())
\ No newline at end of file
+    startup = metrics.StartupTimer(started)
+    startup.record("imports", time.perf_counter() - started)
+    if METRICS_ENABLED: metrics.enable()
+    # Whatever snapshot we've got, we serve from right away. query_static_data refreshes it in the background if it's out of date.
+    with startup.step("static_snapshot"): static_network.get_network()
+    with startup.step("arrival_cache"): lta_api_processor.arrival_cache.load_persisted()
+    with startup.step("alerts"): await alerts.load()
+    if ARRIVAL_HISTORY_PATH:
+        lta_api_interface.history_recorder = ArrivalHistoryRecorder(ARRIVAL_HISTORY_PATH)
+        lta_api_interface.history_recorder.start()
+    background = [lta_api_interface.query_static_data(), lta_api_processor.prefetcher.run(), executor.run(), alerts.run()]
+    if METRICS_ENABLED:
+        background.append(metrics.log_loop(METRICS_LOG_INTERVAL))
+        if METRICS_PORT: background.append(metrics.serve(int(METRICS_PORT)))
+    # Long polling unless we've been given somewhere for Telegram to send updates to.
+    if WEBHOOK_URL:
+        ingest = WebhookServer(bot, WEBHOOK_HOST, WEBHOOK_PORT, secret_token = WEBHOOK_SECRET, workers = WEBHOOK_WORKERS).serve(WEBHOOK_URL)
+    else:
+        ingest = bot.infinity_polling()
+    print(startup.summary())
+    try:
+        await asyncio.gather(*background, ingest)
+    finally:
+        await lta_api_interface.client.close()
+        executor.close()
+        favorites_db.close_db()
+        shared_cache.close()
+        if lta_api_interface.history_recorder is not None: lta_api_interface.history_recorder.close()
+
+# Only when run as the bot itself, so that the load test can import the handlers without starting everything up.
+if __name__ == "__main__":
+    asyncio.run(bot_setup())
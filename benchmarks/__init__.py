@@ -0,0 +1,5 @@
+# To run a benchmark, do `python3 -m benchmarks.<benchmark name>` from the project root, e.g. `python3 -m benchmarks.bench_spatial_index`.
+import os
+
+# Importing src builds the Telegram bot object, which wants a well-formed token even though the benchmarks never talk to Telegram.
+os.environ.setdefault("BOT_API_TOKEN", "0:offline-benchmarks")
@@ -0,0 +1,76 @@
+from benchmarks.synthetic_data import make_bus_stops, make_bus_routes, make_bus_arrivals, operation_times_from_routes
+from tests.stub_datamall import StubDataMall
+from src.setup_constants import sg_timezone, headers
+from src.datamall_client import DataMallClient
+from src.arrival_cache import ArrivalCache
+from src import static_network, favorites_db, lta_api_processor, lta_api_interface
+from unittest import mock
+import tempfile
+import datetime
+import asyncio
+import random
+import time
+import os
+
+# Favorites, end to end: reading them out of SQLite, fetching every station's arrivals (from a stub DataMall), and rendering the lot.
+# Also the favorite counts the prefetcher uses, which go over the whole table.
+
+async def run(n_stations: int, n_users: int, favorites_per_user: int, n_requests: int) -> dict:
+    bus_stops = make_bus_stops(n_stations)
+    network = static_network.StaticNetwork(bus_stops, operation_times_from_routes(bus_stops, make_bus_routes(bus_stops)))
+    now = datetime.datetime.now(tz = sg_timezone)
+
+    stub = StubDataMall()
+    stub.handlers["BusArrivalv2"] = lambda request: make_bus_arrivals(request.query["BusStopCode"], network.get_services(request.query["BusStopCode"]), now)
+    base_url = await stub.start()
+    # No LTA key needed for the stub, but aiohttp still wants a string there.
+    client = DataMallClient({**headers, "AccountKey": "offline-benchmarks"}, base_url = base_url, rate_limit = 10000.0, burst = 10000)
+
+    rng = random.Random(6)
+    codes = [stop["BusStopCode"] for stop in bus_stops]
+    previous = static_network.get_network()
+    static_network.swap_network(network)
+    tmpdir = tempfile.TemporaryDirectory()
+    favorites_db.close_db()
+    favorites_db.start_db(os.path.join(tmpdir.name, "favorites.db"))
+    try:
+        start = time.perf_counter()
+        for user_id in range(n_users):
+            for code in rng.sample(codes, favorites_per_user): await favorites_db.add_favorite(user_id, code)
+        add_us = (time.perf_counter() - start) / (n_users * favorites_per_user) * 1e6
+        print(f"Adding favorites: {add_us:.0f} us each")
+
+        count_latencies = []
+        for i in range(20):
+            start = time.perf_counter()
+            counts = await favorites_db.get_favorite_station_counts()
+            count_latencies.append(time.perf_counter() - start)
+        counts_ms = sorted(count_latencies)[len(count_latencies) // 2] * 1e3
+        print(f"Favorite counts over {n_users * favorites_per_user} favorites ({len(counts)} stations): {counts_ms:.1f} ms")
+
+        # A TTL of 0 means every request goes all the way to the (stub) DataMall, like it would on a cold cache.
+        cold_cache = ArrivalCache(lambda station: lta_api_interface.get_arrivals(station, "-1"), ttl = 0.0)
+        with mock.patch.object(lta_api_interface, "client", client), mock.patch.object(lta_api_processor, "arrival_cache", cold_cache):
+            latencies = []
+            for i in range(n_requests):
+                start = time.perf_counter()
+                await favorites_db.get_favorite_arrivals(rng.randrange(n_users))
+                latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        p50_ms = latencies[len(latencies) // 2] * 1e3
+        print(f"Favorite arrivals ({favorites_per_user} stations, cold cache): p50 {p50_ms:.1f} ms, "
+                f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.1f} ms, {len(stub.request_log)} DataMall calls")
+    finally:
+        favorites_db.close_db()
+        tmpdir.cleanup()
+        static_network.swap_network(previous)
+        await client.close()
+        await stub.stop()
+
+    return {"favorite_add_us": add_us, "favorite_counts_ms": counts_ms, "favorite_arrivals_p50_ms": p50_ms}
+
+def main(n_stations: int = 5000, n_users: int = 500, favorites_per_user: int = 5, n_requests: int = 200) -> dict:
+    return asyncio.run(run(n_stations, n_users, favorites_per_user, n_requests))
+
+if __name__ == "__main__":
+    main()
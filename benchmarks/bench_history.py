@@ -0,0 +1,51 @@
+from benchmarks.synthetic_data import make_arrival_history, make_bus_arrivals
+from src.arrival_history import ArrivalHistoryRecorder, encode_columns, read_history
+from src.setup_constants import sg_timezone
+from src import history_stats
+import contextlib
+import tempfile
+import datetime
+import time
+import io
+import os
+
+# The arrival history: what recording costs the event loop, and how long the batch statistics take over a couple of million rows.
+
+def main(n_stations: int = 100, services_per_station: int = 8, n_polls: int = 1000, n_records: int = 20000) -> dict:
+    columns, services = make_arrival_history(n_stations, services_per_station, n_polls)
+    n_rows = len(columns["fetched_at"])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # record() is all a reply ever waits on. The writer thread does the rest.
+        recorder = ArrivalHistoryRecorder(tmpdir, max_queue = n_records)
+        recorder.start()
+        response = make_bus_arrivals("10000", services, datetime.datetime.now(tz = sg_timezone))
+        start = time.perf_counter()
+        for i in range(n_records): recorder.record(response)
+        record_us = (time.perf_counter() - start) / n_records * 1e6
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            recorder.close()
+        written_per_s = recorder.stats()["rows_written"] / (time.perf_counter() - start)
+        print(f"record(): {record_us:.2f} us per response, writer thread: {written_per_s:.0f} rows/s")
+
+        path = os.path.join(tmpdir, "arrivals-2023-11-15.wmbh")
+        with open(path, "wb") as f:
+            # In blocks the size the recorder writes.
+            for block_start in range(0, n_rows, 8192):
+                f.write(encode_columns({name: values[block_start:block_start + 8192] for name, values in columns.items()}, services))
+        start = time.perf_counter()
+        history = read_history([path])
+        read_s = time.perf_counter() - start
+        print(f"Read {n_rows} rows ({os.path.getsize(path) / n_rows:.0f} bytes each) in {read_s:.2f}s")
+
+    start = time.perf_counter()
+    tracked = history_stats.track_buses(history)
+    drift = history_stats.eta_drift(history, "both", tracked)
+    gaps = history_stats.headways(history, "both", tracked)
+    stats_s = time.perf_counter() - start
+    print(f"Tracked {len(tracked.arrival)} buses, drift over {int(drift['count'].sum())} estimates and {int(gaps['count'].sum())} headways "
+            f"in {stats_s:.2f}s ({n_rows / stats_s:.0f} rows/s)")
+    return {"history_record_us": record_us, "history_read_rows_per_s": n_rows / read_s, "history_stats_rows_per_s": n_rows / stats_s}
+
+if __name__ == "__main__":
+    main()
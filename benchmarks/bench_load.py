@@ -0,0 +1,213 @@
+from benchmarks.synthetic_data import make_bus_stops, make_bus_routes, make_bus_arrivals, operation_times_from_routes
+from benchmarks.fake_telegram import FakeTelegram
+from tests.stub_datamall import StubDataMall
+from src.setup_constants import sg_timezone, headers, bot
+from src.datamall_client import DataMallClient
+from src.arrival_cache import ArrivalCache
+from src.webhook_server import WebhookServer, WEBHOOK_PATH
+from src import static_network, favorites_db, lta_api_processor, lta_api_interface
+from telebot import types
+from unittest import mock
+import importlib.util
+import contextlib
+import argparse
+import tempfile
+import datetime
+import asyncio
+import random
+import socket
+import time
+import io
+import os
+
+# Simulates a crowd of Telegram users hammering the bot, to see how many it can take before replies back up.
+# The real handlers in __main__.py run against a fake Telegram (benchmarks/fake_telegram.py) and a stub DataMall, all offline.
+# e.g. `python3 -m benchmarks.bench_load --users 200 --duration 30 --mix bus=3,location=3,fav_bus=2,refresh=2 --think-time 2`
+# --mode picks how updates get to the bot:
+# - direct hands them straight to the handlers, which leaves only the handlers themselves to measure.
+# - polling has the bot long poll the fake Telegram for them, like it does by default.
+# - webhook has the fake Telegram POST them to the bot's webhook server (src/webhook_server.py).
+# Either way, each update's latency runs from Telegram having it to the bot being done with it.
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = "bus=3,location=3,fav_bus=2,refresh=2"
+MODES = ("direct", "polling", "webhook")
+
+def load_handlers():
+    # __main__.py registers its handlers on setup_constants.bot when it's imported.
+    spec = importlib.util.spec_from_file_location("wheremybus_bot", os.path.join(PROJECT_ROOT, "__main__.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(SCENARIOS)
+    if unknown: raise ValueError(f"Unknown scenarios {unknown}, pick from {list(SCENARIOS)}")
+    return weights
+
+# What each kind of user request looks like, as the updates the user sends one after the other.
+
+def bus_scenario(telegram: FakeTelegram, user_id: int, rng: random.Random, stations: list, favorites: dict) -> list:
+    station = rng.choice(stations)
+    return [telegram.text_update(user_id, "/bus"), telegram.text_update(user_id, station["BusStopCode"]), telegram.text_update(user_id, "A")]
+
+def location_scenario(telegram: FakeTelegram, user_id: int, rng: random.Random, stations: list, favorites: dict) -> list:
+    station = rng.choice(stations)
+    return [telegram.location_update(user_id, station["Latitude"] + rng.uniform(-0.002, 0.002), station["Longitude"] + rng.uniform(-0.002, 0.002))]
+
+def fav_bus_scenario(telegram: FakeTelegram, user_id: int, rng: random.Random, stations: list, favorites: dict) -> list:
+    return [telegram.text_update(user_id, "/fav_bus"), telegram.callback_update(user_id, f"station|{rng.choice(favorites[user_id])}")]
+
+def refresh_scenario(telegram: FakeTelegram, user_id: int, rng: random.Random, stations: list, favorites: dict) -> list:
+    return [telegram.callback_update(user_id, f"refresh_display_arrivals|{rng.choice(favorites[user_id])}|-1")]
+
+SCENARIOS = {"bus": bus_scenario, "location": location_scenario, "fav_bus": fav_bus_scenario, "refresh": refresh_scenario}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(ordered: list, p: float) -> float:
+    return ordered[min(int(p * len(ordered)), len(ordered) - 1)] if ordered else float("nan")
+
+async def run(users: int, duration: float, mix: dict, think_time: float, telegram_latency: float, datamall_latency: float,
+                n_stations: int, seed: int, mode: str = "direct", webhook_workers: int = 16) -> dict:
+    bus_stops = make_bus_stops(n_stations)
+    network = static_network.StaticNetwork(bus_stops, operation_times_from_routes(bus_stops, make_bus_routes(bus_stops)))
+    # Only the stations that buses actually stop at, since those are the ones people ask about.
+    stations = [stop for stop in bus_stops if network.get_services(stop["BusStopCode"])]
+    rng = random.Random(seed)
+
+    stub = StubDataMall()
+    async def arrivals(request):
+        if datamall_latency: await asyncio.sleep(datamall_latency)
+        station = request.query["BusStopCode"]
+        return make_bus_arrivals(station, network.get_services(station), datetime.datetime.now(tz = sg_timezone))
+    stub.handlers["BusArrivalv2"] = arrivals
+    base_url = await stub.start()
+    client = DataMallClient({**headers, "AccountKey": "offline-benchmarks"}, base_url = base_url, rate_limit = 10000.0, burst = 10000)
+    cache = ArrivalCache(lambda station: lta_api_interface.get_arrivals(station, "-1"))
+
+    handlers = load_handlers()
+    previous = static_network.get_network()
+    static_network.swap_network(network)
+    tmpdir = tempfile.TemporaryDirectory()
+    favorites_db.close_db()
+    favorites_db.start_db(os.path.join(tmpdir.name, "favorites.db"))
+
+    # Update kind -> how long the bot took to deal with each one.
+    latencies = {}
+    requests = 0
+    names, weights = list(mix), list(mix.values())
+
+    # Update ID -> a future that's done once the bot is done with the update, however it got there.
+    done = {}
+    process_new_updates = bot.process_new_updates
+    async def tracked_process_new_updates(updates: list):
+        try:
+            await process_new_updates(updates)
+        finally:
+            for update in updates:
+                future = done.pop(update.update_id, None)
+                if future is not None and not future.done(): future.set_result(None)
+
+    server = WebhookServer(bot, "127.0.0.1", free_port(), workers = webhook_workers) if mode == "webhook" else None
+    webhook_url = f"http://127.0.0.1:{server.port}{WEBHOOK_PATH}" if server is not None else None
+    async def deliver(update: dict):
+        if mode == "direct":
+            await bot.process_new_updates([types.Update.de_json(update)])
+            return
+        future = done[update["update_id"]] = asyncio.get_running_loop().create_future()
+        if mode == "polling": telegram.push(update)
+        else: await telegram.post_webhook(webhook_url, update)
+        await future
+    try:
+        favorites = {}
+        for user_id in range(1, users + 1):
+            favorites[user_id] = [stop["BusStopCode"] for stop in rng.sample(stations, 3)]
+            for code in favorites[user_id]: await favorites_db.add_favorite(user_id, code)
+
+        async def simulate_user(user_id: int, deadline: float):
+            nonlocal requests
+            user_rng = random.Random(f"{seed}-{user_id}")
+            # Spread the users out a bit, instead of everyone arriving at once.
+            await asyncio.sleep(user_rng.uniform(0, think_time))
+            while time.perf_counter() < deadline:
+                scenario = user_rng.choices(names, weights)[0]
+                for step, update in enumerate(SCENARIOS[scenario](telegram, user_id, user_rng, stations, favorites)):
+                    start = time.perf_counter()
+                    await deliver(update)
+                    latencies.setdefault(f"{scenario}[{step}]", []).append(time.perf_counter() - start)
+                requests += 1
+                if think_time: await asyncio.sleep(max(min(user_rng.expovariate(1 / think_time), deadline - time.perf_counter()), 0))
+
+        with FakeTelegram(telegram_latency) as telegram, \
+                mock.patch.object(lta_api_interface, "client", client), \
+                mock.patch.object(lta_api_processor, "arrival_cache", cache), \
+                mock.patch.object(bot, "process_new_updates", tracked_process_new_updates), \
+                contextlib.redirect_stdout(io.StringIO()):
+            ingest = None
+            if mode == "polling": ingest = asyncio.create_task(bot.polling(timeout = 1))
+            if mode == "webhook": ingest = asyncio.create_task(server.serve())
+            # Give the webhook server a moment to start listening.
+            await asyncio.sleep(0.1 if ingest is not None else 0)
+            try:
+                start = time.perf_counter()
+                await asyncio.gather(*(simulate_user(user_id, start + duration) for user_id in range(1, users + 1)))
+                elapsed = time.perf_counter() - start
+            finally:
+                if ingest is not None:
+                    ingest.cancel()
+                    await asyncio.gather(ingest, return_exceptions = True)
+                await telegram.close()
+    finally:
+        favorites_db.close_db()
+        tmpdir.cleanup()
+        static_network.swap_network(previous)
+        await client.close()
+        await stub.stop()
+
+    every_update = sorted(latency for samples in latencies.values() for latency in samples)
+    print(f"{users} users for {elapsed:.1f}s ({mode}), think time {think_time}s, Telegram latency {telegram_latency * 1e3:.0f}ms, "
+            f"DataMall latency {datamall_latency * 1e3:.0f}ms")
+    print(f"{'update':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, samples in sorted(latencies.items()) + [("all", every_update)]:
+        samples = sorted(samples)
+        print(f"{kind:<16}{len(samples):>8}{percentile(samples, 0.5) * 1e3:>10.1f}{percentile(samples, 0.95) * 1e3:>10.1f}"
+                f"{percentile(samples, 0.99) * 1e3:>10.1f}")
+    executor_stats = handlers.executor.stats()
+    upstream = len(stub.request_log)
+    print(f"Throughput: {requests / elapsed:.1f} user requests/s ({len(every_update) / elapsed:.1f} updates/s), "
+            f"{telegram.replies()} replies sent, {executor_stats['rejected']} updates turned away")
+    if server is not None:
+        print(f"Webhook server: {server.stats()}, {telegram.webhook_retries} deliveries retried")
+    print(f"DataMall calls: {upstream} ({upstream / max(requests, 1):.2f} per user request), cache: {cache.stats()}")
+    return {"users": users, "requests": requests, "seconds": elapsed, "updates": len(every_update),
+            "p50_ms": percentile(every_update, 0.5) * 1e3, "p95_ms": percentile(every_update, 0.95) * 1e3,
+            "p99_ms": percentile(every_update, 0.99) * 1e3, "requests_per_s": requests / elapsed,
+            "datamall_calls_per_request": upstream / max(requests, 1), "rejected": executor_stats["rejected"],
+            "shed": server.shed if server is not None else 0}
+
+def main(argv: list = None) -> dict:
+    parser = argparse.ArgumentParser(description = "Load test the bot's handlers with simulated users, fully offline.")
+    parser.add_argument("--users", type = int, default = 50)
+    parser.add_argument("--duration", type = float, default = 10.0, help = "seconds to run for")
+    parser.add_argument("--mix", default = DEFAULT_MIX, help = f"relative weights of {', '.join(SCENARIOS)}")
+    parser.add_argument("--think-time", type = float, default = 1.0, help = "mean seconds each user waits between requests")
+    parser.add_argument("--telegram-latency", type = float, default = 0.03, help = "seconds per (fake) Bot API call")
+    parser.add_argument("--datamall-latency", type = float, default = 0.05, help = "seconds per (stub) DataMall call")
+    parser.add_argument("--stations", type = int, default = 5000)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--mode", choices = MODES, default = "direct", help = "how updates get to the bot")
+    parser.add_argument("--webhook-workers", type = int, default = 16)
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args.users, args.duration, parse_mix(args.mix), args.think_time, args.telegram_latency,
+                            args.datamall_latency, args.stations, args.seed, args.mode, args.webhook_workers))
+
+if __name__ == "__main__":
+    main()
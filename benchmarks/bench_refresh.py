@@ -0,0 +1,73 @@
+from benchmarks.synthetic_data import make_bus_stops, make_bus_routes
+from tests.stub_datamall import StubDataMall
+from src.setup_constants import headers
+from src.datamall_client import DataMallClient
+from src import static_network, static_snapshot, lta_api_interface
+from unittest import mock
+import contextlib
+import tempfile
+import asyncio
+import time
+import io
+import os
+
+# The whole static data refresh against a stub DataMall: paging through BusStops and BusRoutes, building the network, and saving the snapshot.
+# Three flavours: from scratch, nothing changed, and a handful of stops renamed.
+
+def paged(rows: list):
+    def handler(request):
+        skip = int(request.query.get("$skip", 0))
+        return {"value": rows[skip:skip + 500]}
+    return handler
+
+async def timed_refresh(label: str, n_rows: int) -> float:
+    start = time.perf_counter()
+    # The refresh is chatty (one line per page), and we only care about the timing here.
+    with contextlib.redirect_stdout(io.StringIO()):
+        await lta_api_interface.refresh_static_data()
+    elapsed = time.perf_counter() - start
+    print(f"Refresh ({label}): {elapsed:.2f}s, {n_rows / elapsed:.0f} rows/s")
+    return elapsed
+
+async def run(n_stations: int, n_services: int) -> dict:
+    bus_stops = make_bus_stops(n_stations)
+    bus_routes = make_bus_routes(bus_stops, n_services)
+    n_rows = len(bus_stops) + len(bus_routes)
+
+    stub = StubDataMall()
+    stub.handlers["BusStops"] = paged(bus_stops)
+    stub.handlers["BusRoutes"] = paged(bus_routes)
+    base_url = await stub.start()
+    client = DataMallClient({**headers, "AccountKey": "offline-benchmarks"}, base_url = base_url, rate_limit = 10000.0, burst = 10000)
+
+    tmpdir = tempfile.TemporaryDirectory()
+    snapshot_path = os.path.join(tmpdir.name, "static_network.snap")
+    def save_to_storage(network: static_network.StaticNetwork):
+        static_snapshot.write_snapshot(network.stations.values(), network.operation_times, network.last_updated, snapshot_path,
+                                        route_columns = network.route_index.to_columns())
+
+    previous = static_network.get_network()
+    try:
+        with mock.patch.object(lta_api_interface, "client", client), \
+                mock.patch.object(lta_api_interface, "last_page_digests", None), \
+                mock.patch.object(static_network, "save_to_storage", save_to_storage):
+            static_network.swap_network(static_network.EMPTY_NETWORK)
+            full = await timed_refresh("from scratch", n_rows)
+            unchanged = await timed_refresh("nothing changed", n_rows)
+            for stop in bus_stops[::500]: stop["Description"] += " (Renamed)"
+            changed = await timed_refresh(f"{len(bus_stops[::500])} stops renamed", n_rows)
+            assert static_network.get_network().get_station_name(bus_stops[0]["BusStopCode"]).endswith("(Renamed)")
+    finally:
+        static_network.swap_network(previous)
+        tmpdir.cleanup()
+        await client.close()
+        await stub.stop()
+
+    return {"refresh_full_rows_per_s": n_rows / full, "refresh_unchanged_rows_per_s": n_rows / unchanged,
+            "refresh_diff_rows_per_s": n_rows / changed}
+
+def main(n_stations: int = 5000, n_services: int = 400) -> dict:
+    return asyncio.run(run(n_stations, n_services))
+
+if __name__ == "__main__":
+    main()
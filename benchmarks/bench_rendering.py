@@ -0,0 +1,51 @@
+from benchmarks.synthetic_data import make_bus_stops, make_bus_routes, make_bus_arrivals, operation_times_from_routes
+from src.setup_constants import sg_timezone
+from src import static_network, lta_api_processor, lta_api_utils
+from src.route_index import RouteIndexBuilder
+import datetime
+import random
+import time
+
+# How long does it take to build the network, look up station names, and turn an arrival response into a reply?
+
+def main(n_stations: int = 5000, n_services: int = 400, n_renders: int = 2000, n_lookups: int = 100000) -> dict:
+    bus_stops = make_bus_stops(n_stations)
+    bus_routes = make_bus_routes(bus_stops, n_services)
+    operation_times = operation_times_from_routes(bus_stops, bus_routes)
+
+    start = time.perf_counter()
+    route_builder = RouteIndexBuilder()
+    route_builder.add_rows(bus_routes)
+    network = static_network.StaticNetwork(bus_stops, operation_times, route_index = route_builder.build())
+    build_ms = (time.perf_counter() - start) * 1e3
+    print(f"Network build over {n_stations} stations and {len(bus_routes)} routes: {build_ms:.1f} ms")
+    previous = static_network.get_network()
+    static_network.swap_network(network)
+
+    try:
+        rng = random.Random(5)
+        codes = [stop["BusStopCode"] for stop in bus_stops]
+        lookups = [rng.choice(codes) for i in range(n_lookups)]
+        start = time.perf_counter()
+        for code in lookups: lta_api_utils.get_station_name(code)
+        name_ns = (time.perf_counter() - start) / n_lookups * 1e9
+        print(f"Station name lookup: {name_ns:.0f} ns")
+
+        # The busiest stations, since those are the slowest to render.
+        busiest = sorted(codes, key = lambda code: len(network.get_services(code)), reverse = True)[:n_renders // 4]
+        now = datetime.datetime.now(tz = sg_timezone)
+        payloads = [make_bus_arrivals(code, network.get_services(code), now) for code in busiest]
+        start = time.perf_counter()
+        for i in range(n_renders):
+            payload = payloads[i % len(payloads)]
+            lta_api_processor.parse_arrival_data(payload, network.get_services(payload["BusStopCode"]), "-1")
+        render_us = (time.perf_counter() - start) / n_renders * 1e6
+        average_services = sum(len(payload["Services"]) for payload in payloads) / len(payloads)
+        print(f"Arrival rendering: {render_us:.1f} us/station ({average_services:.1f} services each)")
+    finally:
+        static_network.swap_network(previous)
+
+    return {"network_build_ms": build_ms, "station_name_lookup_ns": name_ns, "render_station_us": render_us}
+
+if __name__ == "__main__":
+    main()
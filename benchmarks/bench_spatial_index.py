@@ -0,0 +1,37 @@
+from benchmarks.synthetic_data import make_bus_stops, random_locations
+from src.spatial_index import StationSpatialIndex
+from src.lta_api_processor import get_closest_bus_stations
+import time
+
+# Compares the spatial index against the old "haversine everything and sort" scan.
+
+def bench(label: str, fn, locations: list):
+    start = time.perf_counter()
+    for lat, long in locations: fn(lat, long)
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed / len(locations) * 1e6:.1f} us/query")
+    return elapsed / len(locations) * 1e6
+
+def main(n_stations: int = 5000, n_queries: int = 1000, k: int = 3) -> dict:
+    # Returns the timings (in microseconds per query) for run_all to keep track of.
+    bus_stops = make_bus_stops(n_stations)
+    locations = random_locations(n_queries)
+
+    start = time.perf_counter()
+    index = StationSpatialIndex(bus_stops)
+    print(f"Index build over {n_stations} stations: {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    # Sanity check first. There's no point being fast if we're wrong.
+    for lat, long in locations[:100]:
+        expected = [code for code, name, dist in get_closest_bus_stations(lat, long, bus_stops, k)]
+        actual = [code for code, name, dist in index.nearest(lat, long, k)]
+        assert expected == actual, (lat, long, expected, actual)
+
+    scan = bench(f"Linear scan (k = {k})", lambda lat, long: get_closest_bus_stations(lat, long, bus_stops, k), locations)
+    indexed = bench(f"Spatial index (k = {k})", lambda lat, long: index.nearest(lat, long, k), locations)
+    within = bench("Spatial index (within 500m)", lambda lat, long: index.within(lat, long, 500), locations)
+    print(f"Speedup: {scan / indexed:.1f}x")
+    return {"nearest_stop_us": indexed, "nearest_stop_scan_us": scan, "stops_within_500m_us": within}
+
+if __name__ == "__main__":
+    main()
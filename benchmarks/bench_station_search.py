@@ -0,0 +1,40 @@
+from benchmarks.synthetic_data import make_bus_stops
+from src.station_search import StationSearchIndex
+import random
+import time
+
+# How fast can we find a station by name? Queries are prefixes of real names, some with a typo thrown in.
+
+def make_queries(bus_stops: list, n: int, seed: int = 2) -> list:
+    rng = random.Random(seed)
+    queries = []
+    for i in range(n):
+        stop = rng.choice(bus_stops)
+        query = f"{stop['Description']} {stop['RoadName']}"[:rng.randint(4, 20)]
+        if rng.random() < 0.3 and len(query) > 4:
+            # Fat-finger a letter.
+            j = rng.randrange(len(query))
+            query = query[:j] + rng.choice("abcdefghijklmnopqrstuvwxyz") + query[j + 1:]
+        queries.append(query)
+    return queries
+
+def main(n_stations: int = 5000, n_queries: int = 2000) -> dict:
+    bus_stops = make_bus_stops(n_stations)
+    start = time.perf_counter()
+    index = StationSearchIndex(bus_stops)
+    print(f"Index build over {n_stations} stations: {(time.perf_counter() - start) * 1e3:.1f} ms, {len(index.postings)} trigrams")
+
+    queries = make_queries(bus_stops, n_queries)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"Search: p50 {latencies[len(latencies) // 2] * 1e6:.0f} us, p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.0f} us, "
+            f"max {latencies[-1] * 1e6:.0f} us over {n_queries} queries")
+    # Only the median gets tracked: the tail is too noisy to compare from one run to the next.
+    return {"station_search_p50_us": latencies[len(latencies) // 2] * 1e6}
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+from telebot import asyncio_helper
+from unittest import mock
+import aiohttp
+import itertools
+import asyncio
+import time
+
+# Stands in for the Telegram Bot API, so that we can drive the bot's handlers offline.
+# Every Bot API call the bot makes lands in `calls` instead of going over the network, after a pretend round trip of `latency` seconds.
+# Also makes the updates that Telegram would send us, and sends them the way Telegram would:
+# - push() queues one up for the bot's next getUpdates (long polling), and
+# - post_webhook() POSTs one to the bot's webhook server, retrying if it gets turned away.
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "WhereMyBus", "username": "wheremybus_bot"}
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        # (Bot API method, params, when it was called)
+        self.calls = []
+        # Chat ID -> when we last sent that chat something.
+        self.last_reply = {}
+        self.message_ids = itertools.count(1000)
+        self.update_ids = itertools.count(1)
+        self.patcher = mock.patch.object(asyncio_helper, "_process_request", self._process_request)
+        # Updates waiting for the bot to poll for them. Made on first use, so that it belongs to the right event loop.
+        self.polled_updates = None
+        self.session = None
+        self.webhook_retries = 0
+
+    def __enter__(self):
+        self.patcher.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.patcher.stop()
+        return False
+
+    async def close(self):
+        if self.session is not None: await self.session.close()
+
+    async def _process_request(self, token, url, method = "get", params = None, files = None, **kwargs):
+        if self.latency: await asyncio.sleep(self.latency)
+        params = params or {}
+        if url == "getUpdates": return await self._get_updates(params)
+        now = time.perf_counter()
+        self.calls.append((url, params, now))
+        if url in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            self.last_reply[chat_id] = now
+            return {"message_id": params.get("message_id") or next(self.message_ids), "date": int(time.time()), "from": BOT_USER,
+                    "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+        if url == "getMe": return BOT_USER
+        return True
+
+    def _updates(self) -> asyncio.Queue:
+        if self.polled_updates is None: self.polled_updates = asyncio.Queue()
+        return self.polled_updates
+
+    async def _get_updates(self, params: dict) -> list:
+        # Long polling: wait up to `timeout` seconds for something to come in, then hand over everything that has.
+        updates = self._updates()
+        try:
+            batch = [await asyncio.wait_for(updates.get(), float(params.get("timeout", 0)) or None)]
+        except asyncio.TimeoutError:
+            return []
+        while not updates.empty() and len(batch) < int(params.get("limit", 100)): batch.append(updates.get_nowait())
+        return batch
+
+    def push(self, update: dict):
+        self._updates().put_nowait(update)
+
+    async def post_webhook(self, url: str, update: dict, secret_token: str = None, retry_delay: float = 0.5):
+        # Telegram keeps trying until the bot takes the update.
+        if self.session is None: self.session = aiohttp.ClientSession()
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret_token} if secret_token else {}
+        while True:
+            if self.latency: await asyncio.sleep(self.latency)
+            async with self.session.post(url, json = update, headers = headers) as response:
+                if response.status == 200: return
+            self.webhook_retries += 1
+            await asyncio.sleep(retry_delay)
+
+    def replies(self) -> int:
+        return sum(1 for url, params, when in self.calls if url in ("sendMessage", "editMessageText"))
+
+    # Updates, as the JSON Telegram would send them. Users chat with the bot privately, so their chat ID is their user ID.
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+    def _message(self, user_id: int, **content) -> dict:
+        return {"message_id": next(self.message_ids), "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id), **content}
+
+    def text_update(self, user_id: int, text: str) -> dict:
+        return {"update_id": next(self.update_ids), "message": self._message(user_id, text = text)}
+
+    def location_update(self, user_id: int, lat: float, long: float) -> dict:
+        return {"update_id": next(self.update_ids), "message": self._message(user_id, location = {"latitude": lat, "longitude": long})}
+
+    def callback_update(self, user_id: int, data: str) -> dict:
+        # A tap on one of the buttons under a message we sent earlier.
+        message = self._message(user_id, text = "...")
+        message["from"] = BOT_USER
+        return {"update_id": next(self.update_ids), "callback_query": {
+            "id": str(next(self.update_ids)), "from": self._user(user_id), "chat_instance": str(user_id), "data": data, "message": message}}
@@ -0,0 +1,79 @@
+from benchmarks import bench_spatial_index, bench_station_search, bench_rendering, bench_favorites, bench_refresh, bench_history
+import subprocess
+import datetime
+import json
+import sys
+import os
+
+# Runs every benchmark (all offline, on synthetic data) and compares the results against the last few runs, so that regressions stand out.
+# `python3 -m benchmarks.run_all` from the project root. Results pile up in benchmarks/results.json, which git ignores.
+# Exits with 1 if anything got more than REGRESSION_THRESHOLD worse than the median of the last BASELINE_RUNS runs, unless --no-fail is given.
+# Run-to-run noise on a busy laptop is easily 30%, hence the generous threshold.
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results.json")
+REGRESSION_THRESHOLD = 0.5
+BASELINE_RUNS = 3
+# Everything is a timing (lower is better), except throughputs.
+HIGHER_IS_BETTER_SUFFIXES = ("_per_s",)
+BENCHMARKS = (bench_spatial_index, bench_station_search, bench_rendering, bench_favorites, bench_refresh, bench_history)
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_history(path: str = RESULTS_PATH) -> list:
+    try:
+        with open(path, "r") as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return []
+
+def baseline(history: list, runs: int = BASELINE_RUNS) -> dict:
+    # The median of each metric over the last few runs.
+    values = {}
+    for run in history[-runs:]:
+        for metric, value in run["results"].items(): values.setdefault(metric, []).append(value)
+    return {metric: sorted(samples)[len(samples) // 2] for metric, samples in values.items()}
+
+def compare(previous: dict, current: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    # Returns (metric, previous, current, change) for every metric that got worse by more than threshold.
+    # change is how much worse it got, e.g. 0.3 is 30% worse.
+    regressions = []
+    for metric, value in current.items():
+        old = previous.get(metric)
+        if not old: continue
+        if metric.endswith(HIGHER_IS_BETTER_SUFFIXES):
+            change = (old - value) / old
+        else:
+            change = (value - old) / old
+        if change > threshold: regressions.append((metric, old, value, change))
+    return regressions
+
+def main(argv: list) -> int:
+    results = {}
+    for benchmark in BENCHMARKS:
+        print(f"== {benchmark.__name__.split('.')[-1]} ==")
+        results.update(benchmark.main())
+
+    history = load_history()
+    run = {"timestamp": datetime.datetime.now().isoformat(), "revision": git_revision(), "results": results}
+    print(f"\n{'metric':<32}{'baseline':>14}{'this run':>14}")
+    previous = baseline(history)
+    for metric, value in results.items():
+        old = previous.get(metric)
+        print(f"{metric:<32}{'-' if old is None else f'{old:.2f}':>14}{value:>14.2f}")
+
+    regressions = compare(previous, results)
+    for metric, old, value, change in regressions:
+        print(f"REGRESSION: {metric} went from {old:.2f} to {value:.2f} ({change:.0%} worse)")
+
+    history.append(run)
+    with open(f"{RESULTS_PATH}.tmp", "w") as f:
+        f.write(json.dumps(history, indent = 2))
+    os.replace(f"{RESULTS_PATH}.tmp", RESULTS_PATH)
+    return 1 if regressions and "--no-fail" not in argv else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
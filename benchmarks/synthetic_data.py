@@ -0,0 +1,119 @@
+import numpy as np
+import datetime
+import random
+
+# Fake-but-realistic-ish DataMall data, so that we can benchmark without an LTA token (or an internet connection).
+
+# Roughly the bounding box of mainland Singapore.
+SG_LAT_RANGE = (1.24, 1.47)
+SG_LONG_RANGE = (103.62, 104.03)
+
+def make_bus_stops(n: int = 5000, seed: int = 0) -> list:
+    # BusStops rows, scattered uniformly over Singapore.
+    rng = random.Random(seed)
+    bus_stops = []
+    for i in range(n):
+        bus_stops.append({
+            "BusStopCode": f"{10000 + i:05d}",
+            "RoadName": f"{rng.choice(['Ang Mo Kio', 'Bedok', 'Clementi', 'Jurong West', 'Tampines', 'Woodlands', 'Yishun'])} Ave {rng.randint(1, 10)}",
+            "Description": f"{rng.choice(['Blk', 'Opp Blk', 'Bef', 'Aft'])} {rng.randint(1, 999)}",
+            "Latitude": rng.uniform(*SG_LAT_RANGE),
+            "Longitude": rng.uniform(*SG_LONG_RANGE)
+        })
+    return bus_stops
+
+def random_locations(n: int = 1000, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    return [(rng.uniform(*SG_LAT_RANGE), rng.uniform(*SG_LONG_RANGE)) for i in range(n)]
+
+def time_string(minutes: int) -> str:
+    minutes %= 24 * 60
+    return f"{minutes // 60:02d}{minutes % 60:02d}"
+
+def make_bus_routes(bus_stops: list, n_services: int = 400, stops_per_route: int = 33, seed: int = 3) -> list:
+    # BusRoutes rows: n_services services, each going there and back again over stops_per_route nearby-ish stops.
+    # The defaults come out at ~26k rows, about what DataMall has.
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_services):
+        service_no = f"{i + 1}{rng.choice(['', '', '', 'A', 'e'])}"
+        stops = sorted(rng.sample(bus_stops, stops_per_route), key = lambda stop: stop["Latitude"])
+        first_bus, last_bus = rng.randint(5 * 60, 7 * 60), rng.randint(23 * 60, 25 * 60)
+        for direction, route in ((1, stops), (2, stops[::-1])):
+            distance = 0.0
+            for sequence, stop in enumerate(route, 1):
+                rows.append({
+                    "ServiceNo": service_no,
+                    "Operator": rng.choice(["SBST", "SMRT", "TTS", "GAS"]),
+                    "Direction": direction,
+                    "StopSequence": sequence,
+                    "BusStopCode": stop["BusStopCode"],
+                    "Distance": round(distance, 1),
+                    "WD_FirstBus": time_string(first_bus + sequence), "WD_LastBus": time_string(last_bus + sequence),
+                    "SAT_FirstBus": time_string(first_bus + sequence), "SAT_LastBus": time_string(last_bus + sequence),
+                    "SUN_FirstBus": time_string(first_bus + 30 + sequence), "SUN_LastBus": time_string(last_bus - 30 + sequence)
+                })
+                distance += rng.uniform(0.3, 1.2)
+    return rows
+
+def make_bus_arrivals(station: str, services: list, now: datetime.datetime, seed: int = 4) -> dict:
+    # A BusArrivalv2 response for one station, with up to 3 buses coming for each service.
+    rng = random.Random(f"{seed}-{station}")
+    def next_bus(seconds: int) -> dict:
+        return {
+            "OriginCode": "10009", "DestinationCode": "10009",
+            "EstimatedArrival": (now + datetime.timedelta(seconds = seconds)).isoformat(),
+            "Latitude": "0.0", "Longitude": "0.0", "VisitNumber": "1", "Monitored": 1,
+            "Load": rng.choice(["SEA", "SDA", "LSD"]), "Feature": rng.choice(["WAB", ""]), "Type": rng.choice(["SD", "DD", "BD"])
+        }
+    empty = {"OriginCode": "", "DestinationCode": "", "EstimatedArrival": "", "Latitude": "", "Longitude": "",
+                "VisitNumber": "", "Load": "", "Feature": "", "Type": ""}
+    result = []
+    for service_no in services:
+        first = rng.randint(-30, 600)
+        buses = [next_bus(first + j * rng.randint(300, 900)) for j in range(rng.randint(0, 3))]
+        buses += [empty] * (3 - len(buses))
+        result.append({"ServiceNo": service_no, "Operator": "SBST", "NextBus": buses[0], "NextBus2": buses[1], "NextBus3": buses[2]})
+    return {"odata.metadata": "http://datamall2.mytransport.sg/ltaodataservice/$metadata#BusArrivalv2/@Element",
+            "BusStopCode": station, "Services": result}
+
+def operation_times_from_routes(bus_stops: list, bus_routes: list) -> dict:
+    # BusStopCode -> ServiceNo -> BusRoutes row, the way lta_api_interface.get_all_bus_operation_times builds it.
+    operation_times = {stop["BusStopCode"]: {} for stop in bus_stops}
+    for row in bus_routes: operation_times[row["BusStopCode"]][row["ServiceNo"]] = row
+    return operation_times
+
+def make_arrival_history(n_stations: int = 100, services_per_station: int = 8, n_polls: int = 1000, poll_interval: float = 20.0,
+                            seed: int = 5) -> tuple:
+    # What arrival_history would have recorded from polling every station every poll_interval seconds, as
+    # (column name -> numpy array, service numbers). n_stations * services_per_station * n_polls * 3 rows.
+    # Every service runs on its own headway, each bus is up to a couple of minutes off schedule, and the estimates
+    # overshoot by a few percent of how far away the bus is.
+    rng = np.random.default_rng(seed)
+    n_pairs = n_stations * services_per_station
+    station = np.repeat(np.arange(10000, 10000 + n_stations, dtype = np.uint32), services_per_station)
+    service = np.tile(np.arange(services_per_station, dtype = np.uint16), n_stations)
+    headway = rng.uniform(300, 900, n_pairs)
+    offset = rng.uniform(0, headway)
+    overshoot = rng.uniform(0.0, 0.1, n_pairs)
+
+    start = 1_700_000_000.0
+    fetched_at = start + poll_interval * np.arange(n_polls)[:, None, None] + rng.uniform(0, 2, (n_polls, n_pairs, 1))
+    # The next three buses after each poll.
+    k = np.floor((fetched_at - start - offset[None, :, None]) / headway[None, :, None]) + 1 + np.arange(3)[None, None, :]
+    delay = 120 * np.sin(k * 12.9898 + np.arange(n_pairs)[None, :, None] * 78.233)
+    arrival = start + offset[None, :, None] + k * headway[None, :, None] + delay
+    arrival = np.maximum(arrival, fetched_at + 1)
+    eta = arrival + overshoot[None, :, None] * (arrival - fetched_at)
+
+    shape = (n_polls, n_pairs, 3)
+    columns = {
+        "fetched_at": np.broadcast_to(fetched_at, shape).ravel(),
+        "eta_offset": np.round(eta - fetched_at).astype(np.int32).ravel(),
+        "station": np.broadcast_to(station[None, :, None], shape).ravel(),
+        "service": np.broadcast_to(service[None, :, None], shape).ravel(),
+        "slot": np.broadcast_to(np.arange(3, dtype = np.uint8), shape).ravel(),
+        "load": rng.integers(0, 3, n_polls * n_pairs * 3).astype(np.uint8),
+        "type": rng.integers(0, 3, n_polls * n_pairs * 3).astype(np.uint8)
+    }
+    return columns, [str(10 + i) for i in range(services_per_station)]
@@ -0,0 +1,307 @@
+from src.setup_constants import sg_timezone
+from src.shared_cache import WORKER_ID
+from src import arrival_model, favorites_db
+import sqlite3
+import datetime
+import asyncio
+import heapq
+import time
+
+# "Tell me when bus 12 is 3 minutes away from 01012", so that nobody has to keep tapping Refresh to watch a bus come in.
+# - Alerts are grouped by station, and each station is polled once per round no matter how many people are watching it.
+#   Polls go through the arrival cache, so a station someone just asked about doesn't cost anything extra either.
+# - A heap keeps track of when each station is next due. The further away the buses are, the longer we leave it:
+#   we poll again after half of the time left before the nearest alert should fire, within [min_interval, max_interval].
+# - Alerts go away once they fire, or after `ttl` seconds if the bus never comes. They're kept in the database, so they survive restarts.
+# - With more than one worker (i.e. a shared cache, see shared_cache.py), every worker sees every alert in the database, so:
+#   whoever is about to fire an alert has to claim it with a lease first, and check it hasn't been cancelled (or replaced) in the meantime.
+#   Everyone else just lets it go. Each worker also re-reads the database every so often (and before listing or cancelling anything),
+#   to pick up alerts added or cancelled through other workers.
+# Times are wall-clock (time.time()), since expiry times have to mean the same thing after a restart.
+
+class TooManyAlertsException(Exception):
+    "You're already watching as many buses as you can!"
+    pass
+
+class ArrivalAlert:
+    __slots__ = ("user_id", "chat_id", "station", "service", "minutes", "expires_at")
+
+    def __init__(self, user_id: int, chat_id: int, station: str, service: str, minutes: int, expires_at: float):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.station = station
+        self.service = service
+        # Fire once the next bus is this many minutes away (or closer).
+        self.minutes = minutes
+        self.expires_at = expires_at
+
+    @property
+    def key(self) -> tuple:
+        # One alert per user per bus per station. Asking again just replaces it.
+        return (self.user_id, self.station, self.service)
+
+# Persistence, in the favorites database (so that it shares its connection and thread).
+
+CREATE_ALERTS = '''CREATE TABLE IF NOT EXISTS arrival_alert (
+                    user_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    station_code TEXT NOT NULL,
+                    service_no TEXT NOT NULL,
+                    minutes INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, station_code, service_no)
+                ) WITHOUT ROWID'''
+SELECT_ALERTS = "SELECT user_id, chat_id, station_code, service_no, minutes, expires_at FROM arrival_alert"
+UPSERT_ALERT = "INSERT OR REPLACE INTO arrival_alert (user_id, chat_id, station_code, service_no, minutes, expires_at) VALUES (?, ?, ?, ?, ?, ?)"
+DELETE_ALERT = "DELETE FROM arrival_alert WHERE user_id = ? AND station_code = ? AND service_no = ?"
+# The very same alert, not just one for the same bus.
+HAS_ALERT = "SELECT 1 FROM arrival_alert WHERE user_id = ? AND station_code = ? AND service_no = ? AND minutes = ? AND expires_at = ?"
+
+def _create_alerts(db: sqlite3.Connection):
+    with db:
+        db.execute(CREATE_ALERTS)
+
+def _load_alerts(db: sqlite3.Connection) -> list:
+    return [ArrivalAlert(*row) for row in db.execute(SELECT_ALERTS)]
+
+def _save_alert(db: sqlite3.Connection, alert: ArrivalAlert):
+    with db:
+        db.execute(UPSERT_ALERT, (alert.user_id, alert.chat_id, alert.station, alert.service, alert.minutes, alert.expires_at))
+
+def _delete_alert(db: sqlite3.Connection, key: tuple):
+    with db:
+        db.execute(DELETE_ALERT, key)
+
+def _has_alert(db: sqlite3.Connection, alert: ArrivalAlert) -> bool:
+    return db.execute(HAS_ALERT, (alert.user_id, alert.station, alert.service, alert.minutes, alert.expires_at)).fetchone() is not None
+
+class AlertStore:
+    def __init__(self):
+        self.created = False
+
+    async def _ensure_table(self):
+        if self.created: return
+        await favorites_db.run_db(_create_alerts)
+        self.created = True
+
+    async def load(self) -> list:
+        await self._ensure_table()
+        return await favorites_db.run_db(_load_alerts)
+
+    async def save(self, alert: ArrivalAlert):
+        await self._ensure_table()
+        await favorites_db.run_db(_save_alert, alert)
+
+    async def delete(self, alert: ArrivalAlert):
+        await self._ensure_table()
+        await favorites_db.run_db(_delete_alert, alert.key)
+
+    async def exists(self, alert: ArrivalAlert) -> bool:
+        await self._ensure_table()
+        return await favorites_db.run_db(_has_alert, alert)
+
+class AlertScheduler:
+    def __init__(self, fetch, notify, store = None, min_interval: float = 15.0, max_interval: float = 120.0, ttl: float = 3600.0,
+                    max_per_user: int = 5, max_concurrency: int = 8, clock = time.time, log_interval: float = 600.0,
+                    shared = None, worker_id: str = WORKER_ID, claim_ttl: float = 600.0, sync_interval: float = 30.0):
+        # fetch(station) is a coroutine returning the station's BusArrivalv2 response (e.g. ArrivalCache.get).
+        # notify(alert, bus) is a coroutine called when an alert fires, with the arrival_model.NextBus that set it off,
+        # or with None if the alert expired first.
+        self.fetch = fetch
+        self.notify = notify
+        self.store = store
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.ttl = ttl
+        self.max_per_user = max_per_user
+        self.clock = clock
+        self.log_interval = log_interval
+        # Only set with more than one worker. See the top of the file.
+        self.shared = shared
+        self.worker_id = worker_id
+        self.claim_ttl = claim_ttl
+        self.sync_interval = sync_interval
+        self.poll_slots = asyncio.Semaphore(max_concurrency)
+
+        # Station -> {alert key -> ArrivalAlert}
+        self.alerts = {}
+        self.alerts_by_user = {}
+        # (when, station) pairs. Rescheduling a station pushes a new pair, and the old one gets skipped when it comes up,
+        # since it no longer matches next_poll.
+        self.heap = []
+        self.next_poll = {}
+        # Set whenever a station gets scheduled earlier than whatever run() is currently waiting for.
+        self.wakeup = asyncio.Event()
+
+        self.polls = 0
+        self.poll_failures = 0
+        self.fired = 0
+        self.expired = 0
+        # Alerts another worker fired (or someone cancelled) before we could.
+        self.claims_lost = 0
+
+    def schedule(self, station: str, when: float):
+        # Makes sure the station gets polled by `when`. Never pushes an earlier poll back.
+        if self.next_poll.get(station, float("inf")) <= when: return
+        self.next_poll[station] = when
+        heapq.heappush(self.heap, (when, station))
+        self.wakeup.set()
+
+    def poll_delay(self, slack: float = None) -> float:
+        # How long to leave a station for, given how many seconds are left before its nearest alert should fire (None if no bus is coming).
+        if slack is None: return self.max_interval
+        return min(max(slack / 2, self.min_interval), self.max_interval)
+
+    def _insert(self, alert: ArrivalAlert):
+        self.alerts.setdefault(alert.station, {})[alert.key] = alert
+        self.alerts_by_user.setdefault(alert.user_id, {})[alert.key] = alert
+
+    async def _remove(self, alert: ArrivalAlert, delete: bool = True):
+        station_alerts = self.alerts.get(alert.station, {})
+        if station_alerts.pop(alert.key, None) is None: return
+        if not station_alerts:
+            del self.alerts[alert.station]
+            self.next_poll.pop(alert.station, None)
+        user_alerts = self.alerts_by_user[alert.user_id]
+        del user_alerts[alert.key]
+        if not user_alerts: del self.alerts_by_user[alert.user_id]
+        if delete and self.store is not None: await self.store.delete(alert)
+
+    async def add(self, user_id: int, chat_id: int, station: str, service: str, minutes: int) -> ArrivalAlert:
+        # So that alerts added through other workers count towards the limit too.
+        if self.shared is not None: await self.sync()
+        alert = ArrivalAlert(user_id, chat_id, station, service, minutes, self.clock() + self.ttl)
+        user_alerts = self.alerts_by_user.get(user_id, {})
+        if alert.key not in user_alerts and len(user_alerts) >= self.max_per_user:
+            raise TooManyAlertsException
+        # Saved first, so that a sync() that's running meanwhile can't mistake it for one cancelled elsewhere.
+        if self.store is not None: await self.store.save(alert)
+        self._insert(alert)
+        # Right away, in case the bus is already close enough.
+        self.schedule(station, self.clock())
+        return alert
+
+    async def cancel(self, user_id: int, station: str, service: str) -> bool:
+        # It might have been added through another worker.
+        if self.shared is not None: await self.sync()
+        alert = self.alerts_by_user.get(user_id, {}).get((user_id, station, service))
+        if alert is None: return False
+        await self._remove(alert)
+        return True
+
+    def alerts_for(self, user_id: int) -> list:
+        return sorted(self.alerts_by_user.get(user_id, {}).values(), key = lambda alert: alert.expires_at)
+
+    async def list_alerts(self, user_id: int) -> list:
+        # Like alerts_for, but up to date with what the other workers have been up to.
+        if self.shared is not None: await self.sync()
+        return self.alerts_for(user_id)
+
+    async def load(self):
+        # Picks up where we left off before a restart.
+        if self.store is None: return
+        for alert in await self.store.load():
+            self._insert(alert)
+            self.schedule(alert.station, self.clock())
+
+    async def sync(self):
+        # Makes what we have match the database: picks up alerts added through other workers,
+        # and drops the ones they've fired or cancelled (or replaced).
+        if self.store is None: return
+        stored = {alert.key: alert for alert in await self.store.load()}
+        for station_alerts in list(self.alerts.values()):
+            for key, alert in list(station_alerts.items()):
+                current = stored.get(key)
+                if current is None or (current.minutes, current.expires_at) != (alert.minutes, alert.expires_at):
+                    await self._remove(alert, delete = False)
+        for key, alert in stored.items():
+            if key in self.alerts.get(alert.station, {}): continue
+            self._insert(alert)
+            self.schedule(alert.station, self.clock())
+
+    async def _claim(self, alert: ArrivalAlert) -> bool:
+        # Whether it's up to us to fire the alert. Always, with only the one worker.
+        if self.shared is None: return True
+        # We never give the lease back, so nobody else can fire it later either. By the time it expires, the alert is long gone.
+        lease = f"alert:{alert.user_id}:{alert.station}:{alert.service}:{alert.expires_at}"
+        if not await self.shared.acquire_lease(lease, self.worker_id, self.claim_ttl): return False
+        # Cancelled or replaced through another worker since we last synced?
+        return self.store is None or await self.store.exists(alert)
+
+    async def poll_station(self, station: str):
+        async with self.poll_slots:
+            now = self.clock()
+            try:
+                bus_arrival_data = await self.fetch(station)
+            except Exception as e:
+                print(str(e))
+                self.poll_failures += 1
+                if station in self.alerts: self.schedule(station, now + self.min_interval)
+                return
+            self.polls += 1
+            arrivals = arrival_model.StationArrivals.from_datamall(bus_arrival_data)
+            now_datetime = datetime.datetime.fromtimestamp(now, tz = sg_timezone)
+
+            next_due = float("inf")
+            for alert in list(self.alerts.get(station, {}).values()):
+                service = arrivals.services.get(alert.service)
+                bus = service.next_buses[0] if service is not None and service.next_buses else None
+                slack = None if bus is None else (bus.estimated_arrival - now_datetime).total_seconds() - alert.minutes * 60
+                if slack is not None and slack <= 0:
+                    if await self._fire(alert, bus): self.fired += 1
+                elif alert.expires_at <= now:
+                    if await self._fire(alert, None): self.expired += 1
+                else:
+                    next_due = min(next_due, now + self.poll_delay(slack), alert.expires_at)
+            if station in self.alerts: self.schedule(station, next_due)
+
+    async def _fire(self, alert: ArrivalAlert, bus) -> bool:
+        # Returns False if someone else got to it first.
+        if not await self._claim(alert):
+            self.claims_lost += 1
+            await self._remove(alert, delete = False)
+            return False
+        await self._remove(alert)
+        try:
+            await self.notify(alert, bus)
+        except Exception as e:
+            print(str(e))
+        return True
+
+    async def poll_due(self) -> int:
+        # Polls every station that's due. Returns how many there were.
+        now = self.clock()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            when, station = heapq.heappop(self.heap)
+            if self.next_poll.get(station) != when: continue
+            del self.next_poll[station]
+            due.append(station)
+        await asyncio.gather(*(self.poll_station(station) for station in due))
+        return len(due)
+
+    def stats(self) -> dict:
+        return {"alerts": sum(len(alerts) for alerts in self.alerts.values()), "stations": len(self.alerts), "polls": self.polls,
+                "poll_failures": self.poll_failures, "fired": self.fired, "expired": self.expired, "claims_lost": self.claims_lost}
+
+    async def run(self):
+        last_log = last_sync = time.monotonic()
+        while True:
+            try:
+                if self.shared is not None and time.monotonic() - last_sync >= self.sync_interval:
+                    await self.sync()
+                    last_sync = time.monotonic()
+                await self.poll_due()
+            except Exception as e:
+                print(str(e))
+            if time.monotonic() - last_log >= self.log_interval:
+                print(f"Arrival alerts: {self.stats()}")
+                last_log = time.monotonic()
+            # Sleep until the next station is due, or until someone adds an alert that's due sooner.
+            self.wakeup.clear()
+            longest = min(self.log_interval, self.sync_interval) if self.shared is not None else self.log_interval
+            timeout = min(max(self.heap[0][0] - self.clock(), 0), longest) if self.heap else longest
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,229 @@
+from collections import OrderedDict
+from src.setup_constants import sg_timezone
+from src.shared_cache import WORKER_ID
+import datetime
+import asyncio
+import json
+import time
+import os
+
+# An in-memory cache of the latest BusArrivalv2 response for each bus station.
+# - Entries are good for `ttl` seconds, after which the next caller fetches a fresh copy.
+# - If lots of people ask for the same station at the same time, only ONE of them actually calls DataMall. Everyone else waits for that answer.
+# - We only keep so many stations around (least recently used ones get kicked out first).
+# - Optionally, entries get written to disk in the background (on another thread), so a restart doesn't start completely cold.
+#   Anything written in the last `warm_window` seconds gets picked up again after a restart, as old as it really is.
+#   So it's only served as fresh for what's left of its ttl, and after that it's just the fallback for when DataMall is down.
+# - Optionally, misses go through a shared cache (see shared_cache.py) first, so that several workers share one DataMall call per station:
+#   whoever gets the station's "fetching" lease calls DataMall and shares the answer, and everyone else waits for it.
+
+class CacheEntry:
+    __slots__ = ("data", "fetched_at", "size", "prefetched")
+
+    def __init__(self, data: dict, fetched_at: float, size: int, prefetched: bool = False):
+        self.data = data
+        self.fetched_at = fetched_at
+        self.size = size
+        # Whether this entry was fetched in the background, before anyone asked for it.
+        self.prefetched = prefetched
+
+def estimate_size(bus_arrival_data: dict) -> int:
+    # A rough guess of how much memory an arrival response takes up. Measuring it properly costs more than it's worth.
+    return 512 + 1536 * len(bus_arrival_data.get("Services", []))
+
+class ArrivalCache:
+    def __init__(self, fetch, ttl: float = 10.0, max_entries: int = 2000, max_bytes: int = 32 * 1024 * 1024,
+                    persist_path: str = None, persist_interval: float = 5.0, warm_window: float = 60.0,
+                    shared = None, worker_id: str = WORKER_ID, lease_ttl: float = 5.0, lease_poll_interval: float = 0.05):
+        # fetch(station) is a coroutine that returns a fresh BusArrivalv2 response for the station.
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.persist_path = persist_path
+        self.persist_interval = persist_interval
+        self.warm_window = warm_window
+        self.shared = shared
+        self.worker_id = worker_id
+        # A worker that dies mid-fetch only holds everyone else up for this long.
+        self.lease_ttl = lease_ttl
+        self.lease_poll_interval = lease_poll_interval
+
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.total_bytes = 0
+        self.dirty = set()
+        self.persist_task = None
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.stale_served = 0
+        self.prefetch_hits = 0
+        self.shared_hits = 0
+        self.shared_waits = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "stale_served": self.stale_served,
+            "prefetch_hits": self.prefetch_hits,
+            "shared_hits": self.shared_hits,
+            "shared_waits": self.shared_waits,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes
+        }
+
+    def peek(self, station: str):
+        # The cached response for the station if it's still fresh, otherwise None. Never fetches.
+        entry = self.entries.get(station)
+        if entry is not None and time.monotonic() - entry.fetched_at < self.ttl: return entry.data
+        return None
+
+    def time_to_live(self, station: str) -> float:
+        # How many more seconds the cached response for the station stays fresh. 0 if it's already stale (or not there at all).
+        entry = self.entries.get(station)
+        if entry is None: return 0.0
+        return max(self.ttl - (time.monotonic() - entry.fetched_at), 0.0)
+
+    async def get(self, station: str) -> dict:
+        # NOTE: The returned dict is shared with everyone else who asks for this station. Don't modify it!
+        entry = self.entries.get(station)
+        if entry is not None and time.monotonic() - entry.fetched_at < self.ttl:
+            self.hits += 1
+            if entry.prefetched: self.prefetch_hits += 1
+            self.entries.move_to_end(station)
+            return entry.data
+
+        if station in self.in_flight:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+        return await self.refresh(station)
+
+    async def refresh(self, station: str, prefetched: bool = False) -> dict:
+        # Fetches a fresh copy of the station's arrivals, whether or not the cached one is still fresh.
+        # If a fetch for the station is already on its way, we just wait for that one instead.
+        future = self.in_flight.get(station)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(station, prefetched))
+            self.in_flight[station] = future
+        # Shielded, so that one impatient caller getting cancelled doesn't cancel the fetch for everyone else.
+        return await asyncio.shield(future)
+
+    async def _fetch(self, station: str, prefetched: bool = False) -> dict:
+        try:
+            if self.shared is None:
+                data, age = await self.fetch(station), 0.0
+            else:
+                data, age = await self._fetch_shared(station)
+        except Exception:
+            # If DataMall is having a bad day, an old answer beats no answer.
+            entry = self.entries.get(station)
+            if entry is None: raise
+            self.stale_served += 1
+            return entry.data
+        finally:
+            del self.in_flight[station]
+        self.put(station, data, time.monotonic() - age, prefetched = prefetched)
+        return data
+
+    async def _fetch_shared(self, station: str) -> tuple:
+        # Returns the station's arrivals and how many seconds old they are, from the shared cache if another worker got them recently.
+        key, lease = f"arrivals:{station}", f"fetching:{station}"
+        shared = await self._read_shared(key)
+        if shared is not None:
+            self.shared_hits += 1
+            return shared
+        # The lease frees up once its holder is done (or dead), so this can't wait forever.
+        while not await self.shared.acquire_lease(lease, self.worker_id, self.lease_ttl):
+            await asyncio.sleep(self.lease_poll_interval)
+            shared = await self._read_shared(key)
+            if shared is not None:
+                self.shared_waits += 1
+                return shared
+        try:
+            data = await self.fetch(station)
+            await self.shared.set(key, json.dumps({"fetched_at": time.time(), "data": data}), self.ttl)
+        finally:
+            await self.shared.release_lease(lease, self.worker_id)
+        return data, 0.0
+
+    async def _read_shared(self, key: str):
+        value = await self.shared.get(key)
+        if value is None: return None
+        entry = json.loads(value)
+        return entry["data"], max(time.time() - entry["fetched_at"], 0.0)
+
+    def put(self, station: str, data: dict, fetched_at: float = None, persist: bool = True, prefetched: bool = False):
+        old = self.entries.pop(station, None)
+        if old is not None: self.total_bytes -= old.size
+        entry = CacheEntry(data, time.monotonic() if fetched_at is None else fetched_at, estimate_size(data), prefetched)
+        self.entries[station] = entry
+        self.total_bytes += entry.size
+        self._evict()
+
+        if persist and self.persist_path is not None:
+            self.dirty.add(station)
+            self._ensure_persist_task()
+
+    def _evict(self):
+        # Always keep the newest entry, even if it alone is over the limit.
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            station, entry = self.entries.popitem(last = False)
+            self.total_bytes -= entry.size
+            self.dirty.discard(station)
+            self.evictions += 1
+
+    # Write-behind persistence.
+
+    def _ensure_persist_task(self):
+        if self.persist_task is None or self.persist_task.done():
+            self.persist_task = asyncio.get_running_loop().create_task(self._persist_loop())
+
+    async def _persist_loop(self):
+        while self.dirty:
+            await asyncio.sleep(self.persist_interval)
+            try:
+                # Picked out here, but written on another thread, so that the event loop never waits on the disk.
+                await asyncio.get_running_loop().run_in_executor(None, self.write_entries, self.take_dirty())
+            except OSError as e:
+                print(str(e))
+
+    def take_dirty(self) -> list:
+        # (station, data) for everything that changed since the last write. The data dicts never change, so they're safe to hand off.
+        dirty, self.dirty = self.dirty, set()
+        return [(station, self.entries[station].data) for station in dirty if station in self.entries]
+
+    def flush(self):
+        # Writes out everything that changed right away, on this thread.
+        self.write_entries(self.take_dirty())
+
+    def write_entries(self, entries: list):
+        os.makedirs(self.persist_path, exist_ok = True)
+        for station, data in entries:
+            # Write to a temporary file and then swap it in, so that nobody ever reads a half-written file.
+            path = os.path.join(self.persist_path, f"{station}.json")
+            with open(f"{path}.tmp", "w") as f:
+                f.write(json.dumps(data))
+            os.replace(f"{path}.tmp", path)
+
+    def load_persisted(self):
+        # Warms the cache up with whatever on disk is from the last warm_window seconds, e.g. after a quick restart.
+        if self.persist_path is None or not os.path.isdir(self.persist_path): return
+        now = datetime.datetime.now(tz = sg_timezone)
+        for filename in os.listdir(self.persist_path):
+            if not filename.endswith(".json"): continue
+            try:
+                with open(os.path.join(self.persist_path, filename), "r") as f:
+                    data = json.loads(f.read())
+                age = (now - datetime.datetime.fromisoformat(data["last_updated"])).total_seconds()
+            except (OSError, ValueError, KeyError) as e:
+                print(str(e))
+                continue
+            if 0 <= age < self.warm_window:
+                self.put(filename[:-len(".json")], data, time.monotonic() - age, persist = False)
@@ -0,0 +1,226 @@
+from src.setup_constants import sg_timezone
+import numpy as np
+import threading
+import datetime
+import struct
+import queue
+import time
+import os
+
+# An optional, append-only log of every BusArrivalv2 response we fetch, so that we can look back at how good LTA's estimates were.
+# See history_stats.py for what we do with it.
+#
+# There's one file per day (Singapore time), e.g. arrivals-2024-01-31.wmbh, made up of blocks. Each block is:
+#   16 bytes    header: magic (b"WMBH"), format version (uint16), padding (uint16), row count (uint32), service table length (uint32)
+#   columns     one row per upcoming bus: fetched_at (f8, unix seconds), eta_offset (i4, seconds after fetched_at), station (u4),
+#               service (u2, index into the block's service table), slot (u1, 0-2 for NextBus-NextBus3), load (u1), type (u1)
+#   services    the block's service numbers, NUL-separated UTF-8
+# All little-endian. That's 21 bytes a row. A block that got cut off halfway (say, we crashed) gets ignored when reading,
+# and cut off the end of the file before we next append to it, so the new blocks don't end up behind half a block.
+#
+# record() only ever puts the response on a queue. Turning it into rows and writing them happens on a thread of our own,
+# so recording never holds up a reply. If that thread falls too far behind, responses get dropped (and counted) instead of piling up.
+
+BLOCK_MAGIC = b"WMBH"
+HISTORY_VERSION = 1
+BLOCK_HEADER = struct.Struct("<4sHHII")
+# Column name -> dtype, in the order they're written.
+COLUMNS = (("fetched_at", "<f8"), ("eta_offset", "<i4"), ("station", "<u4"), ("service", "<u2"), ("slot", "u1"), ("load", "u1"), ("type", "u1"))
+NEXT_BUS_KEYS = ("NextBus", "NextBus2", "NextBus3")
+# Loads and bus types are stored as their index in these. Anything else (including blanks) is UNKNOWN.
+LOADS = ("SEA", "SDA", "LSD")
+TYPES = ("SD", "DD", "BD")
+UNKNOWN = 255
+ROW_SIZE = sum(np.dtype(dtype).itemsize for name, dtype in COLUMNS)
+
+class HistoryFormatException(Exception):
+    "The history file is not one we know how to read."
+    pass
+
+def history_path(directory: str, day: datetime.date) -> str:
+    return os.path.join(directory, f"arrivals-{day.isoformat()}.wmbh")
+
+def block_size(n_rows: int, blob_length: int) -> int:
+    return BLOCK_HEADER.size + n_rows * ROW_SIZE + blob_length
+
+def trim_history_file(path: str) -> int:
+    # Cuts a half-written block off the end of the file, if there is one. Returns how many bytes went.
+    # Only reads the block headers, so it's cheap even on a big file. Anything we can't make sense of is left alone.
+    try:
+        f = open(path, "r+b")
+    except FileNotFoundError:
+        return 0
+    with f:
+        length = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset < length:
+            f.seek(offset)
+            header = f.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size: break
+            magic, version, padding, n_rows, blob_length = BLOCK_HEADER.unpack(header)
+            if magic != BLOCK_MAGIC or version != HISTORY_VERSION: return 0
+            size = block_size(n_rows, blob_length)
+            if offset + size > length: break
+            offset += size
+        if offset == length: return 0
+        f.truncate(offset)
+        return length - offset
+
+def to_rows(fetched_at: float, bus_arrival_data: dict) -> list:
+    # One (fetched_at, eta_offset, station, service, slot, load, type) tuple per upcoming bus in the response.
+    rows = []
+    station = int(bus_arrival_data["BusStopCode"])
+    for service in bus_arrival_data.get("Services", []):
+        for slot, key in enumerate(NEXT_BUS_KEYS):
+            next_bus = service.get(key)
+            if not next_bus or not next_bus.get("EstimatedArrival"): continue
+            eta = datetime.datetime.fromisoformat(next_bus["EstimatedArrival"]).timestamp()
+            load = next_bus.get("Load", "")
+            bus_type = next_bus.get("Type", "")
+            rows.append((fetched_at, round(eta - fetched_at), station, service["ServiceNo"], slot,
+                            LOADS.index(load) if load in LOADS else UNKNOWN, TYPES.index(bus_type) if bus_type in TYPES else UNKNOWN))
+    return rows
+
+def encode_block(rows: list) -> bytes:
+    services = {}
+    columns = list(zip(*rows))
+    columns[3] = [services.setdefault(service, len(services)) for service in columns[3]]
+    return encode_columns(dict(zip((name for name, dtype in COLUMNS), columns)), list(services))
+
+def encode_columns(columns: dict, services: list) -> bytes:
+    # columns is column name -> values (anything numpy can make an array of). Their service values index into services.
+    blob = "\0".join(services).encode("utf-8")
+    n_rows = len(columns["fetched_at"])
+    parts = [BLOCK_HEADER.pack(BLOCK_MAGIC, HISTORY_VERSION, 0, n_rows, len(blob))]
+    parts.extend(np.asarray(columns[name], dtype = dtype).tobytes() for name, dtype in COLUMNS)
+    parts.append(blob)
+    return b"".join(parts)
+
+class ArrivalHistoryRecorder:
+    def __init__(self, directory: str, flush_rows: int = 8192, flush_interval: float = 5.0, max_queue: int = 10000):
+        self.directory = directory
+        # Rows get written once there are this many, or every flush_interval seconds, whichever comes first.
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize = max_queue)
+        self.thread = None
+        self.recorded = 0
+        self.dropped = 0
+        self.rows_written = 0
+        self.write_errors = 0
+        self.trimmed_bytes = 0
+        # The days whose files we've checked for a cut off block since starting.
+        self.checked_days = set()
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok = True)
+        self.thread = threading.Thread(target = self._run, name = "arrival_history", daemon = True)
+        self.thread.start()
+
+    def record(self, bus_arrival_data: dict, fetched_at: float = None):
+        # Called with every response we get from DataMall, as soon as we get it. Never blocks.
+        try:
+            self.queue.put_nowait((time.time() if fetched_at is None else fetched_at, bus_arrival_data))
+            self.recorded += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Writes out whatever's still queued up, then stops the thread.
+        if self.thread is None: return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        rows = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self.queue.get(timeout = max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = False
+            if item:
+                fetched_at, bus_arrival_data = item
+                try:
+                    rows.extend(to_rows(fetched_at, bus_arrival_data))
+                except (KeyError, ValueError) as e:
+                    print(str(e))
+            if item is None or len(rows) >= self.flush_rows or time.monotonic() >= deadline:
+                self._write(rows)
+                rows = []
+                deadline = time.monotonic() + self.flush_interval
+            if item is None: return
+
+    def _write(self, rows: list):
+        if not rows: return
+        # Each row goes in the file for the day it was fetched on. Nearly always all the same day, apart from around midnight.
+        days = {}
+        for row in rows:
+            days.setdefault(datetime.datetime.fromtimestamp(row[0], tz = sg_timezone).date(), []).append(row)
+        for day, day_rows in days.items():
+            path = history_path(self.directory, day)
+            try:
+                if day not in self.checked_days:
+                    self.trimmed_bytes += trim_history_file(path)
+                    self.checked_days.add(day)
+                with open(path, "ab") as f:
+                    f.write(encode_block(day_rows))
+                self.rows_written += len(day_rows)
+            except OSError as e:
+                self.write_errors += 1
+                print(str(e))
+
+    def stats(self) -> dict:
+        return {"recorded": self.recorded, "dropped": self.dropped, "queued": self.queue.qsize(), "rows_written": self.rows_written,
+                "write_errors": self.write_errors, "trimmed_bytes": self.trimmed_bytes}
+
+class ArrivalHistory:
+    # Every row from one or more history files, as column arrays. service is an index into `services`.
+    # eta is worked out from fetched_at + eta_offset, since that's what everyone wants.
+    __slots__ = ("fetched_at", "eta", "station", "service", "slot", "load", "type", "services")
+
+    def __init__(self, columns: dict, services: list):
+        self.fetched_at = columns["fetched_at"]
+        self.eta = self.fetched_at + columns["eta_offset"]
+        self.station = columns["station"]
+        self.service = columns["service"]
+        self.slot = columns["slot"]
+        self.load = columns["load"]
+        self.type = columns["type"]
+        self.services = services
+
+    def __len__(self) -> int:
+        return len(self.fetched_at)
+
+def history_files(directory: str) -> list:
+    return sorted(os.path.join(directory, filename) for filename in os.listdir(directory)
+                    if filename.startswith("arrivals-") and filename.endswith(".wmbh"))
+
+def read_history(paths: list) -> ArrivalHistory:
+    # Reads every complete block from the files, in order. Service numbers get renumbered into one table across all of them.
+    services = {}
+    chunks = {name: [] for name, dtype in COLUMNS}
+    for path in paths:
+        with open(path, "rb") as f:
+            buffer = f.read()
+        offset = 0
+        while offset + BLOCK_HEADER.size <= len(buffer):
+            magic, version, padding, n_rows, blob_length = BLOCK_HEADER.unpack_from(buffer, offset)
+            if magic != BLOCK_MAGIC: raise HistoryFormatException(f"{path} has a bad block at byte {offset}")
+            if version != HISTORY_VERSION: raise HistoryFormatException(f"{path} has a version {version} block, but we only read {HISTORY_VERSION}")
+            size = block_size(n_rows, blob_length)
+            if offset + size > len(buffer): break
+            position = offset + BLOCK_HEADER.size
+            block = {}
+            for name, dtype in COLUMNS:
+                block[name] = np.frombuffer(buffer, dtype = dtype, count = n_rows, offset = position)
+                position += n_rows * np.dtype(dtype).itemsize
+            block_services = buffer[position:position + blob_length].decode("utf-8").split("\0")
+            renumber = np.array([services.setdefault(service, len(services)) for service in block_services], dtype = "<u2")
+            block["service"] = renumber[block["service"]]
+            for name, values in block.items(): chunks[name].append(values)
+            offset += size
+    columns = {name: np.concatenate(values) if values else np.empty(0, dtype = dtype)
+                for (name, dtype), values in zip(COLUMNS, chunks.values())}
+    return ArrivalHistory(columns, list(services))
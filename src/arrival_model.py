@@ -0,0 +1,117 @@
+from src.setup_constants import bus_types, bus_load
+import src.lta_api_utils as utils
+import datetime
+
+# A typed model of a BusArrivalv2 response, plus the different ways we can show it to people.
+# We build the model in one pass over the DataMall payload, and then every renderer formats off the same "now",
+# so that the buses in one message don't disagree about what time it is.
+
+class NextBus:
+    __slots__ = ("estimated_arrival", "type", "load", "feature")
+
+    def __init__(self, estimated_arrival: datetime.datetime, bus_type: str, load: str, feature: str):
+        self.estimated_arrival = estimated_arrival
+        self.type = bus_type
+        self.load = load
+        self.feature = feature
+
+    @classmethod
+    def from_datamall(cls, next_bus: dict):
+        # DataMall sends an empty EstimatedArrival when there's no bus coming, in which case there's nothing to model.
+        if not next_bus or not next_bus.get("EstimatedArrival"): return None
+        return cls(datetime.datetime.fromisoformat(next_bus["EstimatedArrival"]),
+                    next_bus.get("Type", ""), next_bus.get("Load", ""), next_bus.get("Feature", ""))
+
+    def minutes_away(self, now: datetime.datetime) -> int:
+        return round((self.estimated_arrival - now).total_seconds() / 60)
+
+    def status(self, now: datetime.datetime) -> str:
+        # Strangely enough, the bus can be estimated to be gone when you query the API.
+        # This is probably because:
+        # - The bus actually left
+        # - L + ratio + infrequent updates + bad bus timing
+        # Due to negative experiences with bus timings I am now assuming the latter.
+        est = self.minutes_away(now)
+        if est <= 0: return "Arriving Soon"
+        return f"{est} min"
+
+class Service:
+    __slots__ = ("service_no", "operator", "next_buses")
+
+    def __init__(self, service_no: str, operator: str, next_buses: tuple):
+        self.service_no = service_no
+        self.operator = operator
+        self.next_buses = next_buses
+
+    @classmethod
+    def from_datamall(cls, service: dict):
+        next_buses = (NextBus.from_datamall(service.get(key)) for key in ("NextBus", "NextBus2", "NextBus3"))
+        return cls(service["ServiceNo"], service.get("Operator", ""), tuple(bus for bus in next_buses if bus is not None))
+
+class StationArrivals:
+    __slots__ = ("station", "services", "last_updated")
+
+    def __init__(self, station: str, services: dict, last_updated: str = None):
+        self.station = station
+        # ServiceNo -> Service
+        self.services = services
+        self.last_updated = last_updated
+
+    @classmethod
+    def from_datamall(cls, bus_arrival_data: dict):
+        services = {}
+        for service in bus_arrival_data.get("Services", []):
+            services[service["ServiceNo"]] = Service.from_datamall(service)
+        return cls(bus_arrival_data["BusStopCode"], services, bus_arrival_data.get("last_updated"))
+
+# Renderers. They all take the services to show (in any order, we sort them), and the services that are running right now.
+
+def render_html(arrivals: StationArrivals, station_name: str, service_list, running_services, now: datetime.datetime) -> str:
+    parts = [f"<b>{station_name} ({arrivals.station})</b>\n"]
+    for service_no in sorted(service_list, key = utils.bus_ordering):
+        parts.append(f"<b>Bus {service_no}</b>\n")
+        service = arrivals.services.get(service_no)
+        if service is None or service_no not in running_services:
+            parts.append("Currently not operational.\n\n")
+            continue
+        for bus in service.next_buses:
+            parts.append(f"{bus_types.get(bus.type, bus.type)} -- {bus.status(now)} {bus_load.get(bus.load, '')}")
+            if bus.feature == 'WAB': parts.append('\u267f')
+            parts.append("\n")
+        parts.append("\n")
+    return "".join(parts)
+
+def render_text(arrivals: StationArrivals, station_name: str, service_list, running_services, now: datetime.datetime) -> str:
+    # One line per service, for when HTML and emojis are overkill. e.g. "12: 3, 10, 18 min"
+    lines = [f"{station_name} ({arrivals.station})"]
+    for service_no in sorted(service_list, key = utils.bus_ordering):
+        service = arrivals.services.get(service_no)
+        if service is None or service_no not in running_services or not service.next_buses:
+            lines.append(f"{service_no}: -")
+            continue
+        lines.append(f"{service_no}: {', '.join(str(max(bus.minutes_away(now), 0)) for bus in service.next_buses)} min")
+    return "\n".join(lines) + "\n"
+
+def to_json_dict(arrivals: StationArrivals, station_name: str, service_list, running_services, now: datetime.datetime) -> dict:
+    # Plain dicts and lists, ready for json.dumps.
+    services = []
+    for service_no in sorted(service_list, key = utils.bus_ordering):
+        service = arrivals.services.get(service_no)
+        running = service is not None and service_no in running_services
+        services.append({
+            "service_no": service_no,
+            "operational": running,
+            "next_buses": [{
+                "estimated_arrival": bus.estimated_arrival.isoformat(),
+                "minutes_away": max(bus.minutes_away(now), 0),
+                "type": bus.type,
+                "load": bus.load,
+                "wheelchair_accessible": bus.feature == "WAB"
+            } for bus in service.next_buses] if running else []
+        })
+    return {
+        "station": arrivals.station,
+        "station_name": station_name,
+        "last_updated": arrivals.last_updated,
+        "services": services
+    }
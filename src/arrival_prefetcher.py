@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+# Keeps the arrival info of the most popular stations warm in the background,
+# so that the first person to ask after the cache expires doesn't have to wait on DataMall.
+# "Popular" means a mix of:
+# - How often a station has been asked about lately (a counter that decays over time, so yesterday's rush doesn't count forever.)
+# - How many people have the station as a favorite.
+# We never make more than budget_per_minute calls to DataMall for this, no matter how popular things get.
+
+class ArrivalPrefetcher:
+    def __init__(self, cache, favorite_counts = None, top_n: int = 50, interval: float = 8.0,
+                    budget_per_minute: float = 120.0, half_life: float = 1800.0, favorite_weight: float = 2.0,
+                    favorites_refresh_interval: float = 300.0, log_interval: float = 600.0):
+        # cache is an ArrivalCache. favorite_counts is a coroutine returning station code -> number of users who favorited it.
+        self.cache = cache
+        self.favorite_counts = favorite_counts
+        self.top_n = top_n
+        self.interval = interval
+        self.budget_per_minute = budget_per_minute
+        self.half_life = half_life
+        self.favorite_weight = favorite_weight
+        self.favorites_refresh_interval = favorites_refresh_interval
+        self.log_interval = log_interval
+
+        # Station code -> (score, when the score was last updated)
+        self.scores = {}
+        self.favorites = {}
+        self.favorites_updated = None
+
+        self.prefetches = 0
+        self.prefetch_failures = 0
+        self.over_budget = 0
+
+    def _decayed(self, score: float, updated: float, now: float) -> float:
+        return score * 0.5 ** ((now - updated) / self.half_life)
+
+    def record_request(self, station: str):
+        # Call this whenever someone asks about a station.
+        now = time.monotonic()
+        score, updated = self.scores.get(station, (0.0, now))
+        self.scores[station] = (self._decayed(score, updated, now) + 1.0, now)
+
+    def hot_stations(self) -> list:
+        # The top_n stations by popularity, most popular first.
+        now = time.monotonic()
+        totals = {station: self.favorite_weight * count for station, count in self.favorites.items()}
+        for station, (score, updated) in list(self.scores.items()):
+            decayed = self._decayed(score, updated, now)
+            # Forget about stations nobody has cared about in a long while.
+            if decayed < 0.01 and station not in self.favorites:
+                del self.scores[station]
+                continue
+            totals[station] = totals.get(station, 0.0) + decayed
+        return sorted(totals, key = totals.get, reverse = True)[:self.top_n]
+
+    async def _refresh_favorites(self):
+        if self.favorite_counts is None: return
+        now = time.monotonic()
+        if self.favorites_updated is not None and now - self.favorites_updated < self.favorites_refresh_interval: return
+        self.favorites = await self.favorite_counts()
+        self.favorites_updated = now
+
+    async def prefetch_once(self) -> int:
+        # Refreshes every hot station that would go stale before the next round. Returns how many we refreshed.
+        await self._refresh_favorites()
+        budget = int(self.budget_per_minute * self.interval / 60)
+        due = [station for station in self.hot_stations() if self.cache.time_to_live(station) < self.interval]
+        if len(due) > budget:
+            self.over_budget += len(due) - budget
+            due = due[:budget]
+
+        results = await asyncio.gather(*(self.cache.refresh(station, prefetched = True) for station in due), return_exceptions = True)
+        for result in results:
+            if isinstance(result, Exception):
+                self.prefetch_failures += 1
+                print(str(result))
+        self.prefetches += len(due)
+        return len(due)
+
+    def stats(self) -> dict:
+        cache_stats = self.cache.stats()
+        requests = cache_stats["hits"] + cache_stats["misses"] + cache_stats["coalesced"]
+        return {
+            "prefetches": self.prefetches,
+            "prefetch_failures": self.prefetch_failures,
+            "over_budget": self.over_budget,
+            "tracked_stations": len(self.scores),
+            # How many user requests were answered by something we prefetched.
+            "prefetch_hit_rate": cache_stats["prefetch_hits"] / requests if requests else 0.0,
+            "cache_hit_rate": cache_stats["hits"] / requests if requests else 0.0
+        }
+
+    async def run(self):
+        last_log = time.monotonic()
+        while True:
+            try:
+                await self.prefetch_once()
+            except Exception as e:
+                print(str(e))
+            if time.monotonic() - last_log >= self.log_interval:
+                print(f"Prefetcher: {self.stats()}")
+                last_log = time.monotonic()
+            await asyncio.sleep(self.interval)
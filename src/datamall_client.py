@@ -0,0 +1,93 @@
+import aiohttp
+import asyncio
+import random
+import time
+
+# An asyncio-native HTTP client for LTA DataMall.
+# requests.get blocks the whole event loop (and therefore EVERY user of the bot) while it waits on DataMall,
+# so instead we keep a pool of keep-alive connections around and await our responses like civilised people.
+
+DATAMALL_BASE_URL = "http://datamall2.mytransport.sg/ltaodataservice/"
+
+class DataMallException(Exception):
+    "DataMall did not give us a usable response, even after retrying."
+    pass
+
+class TokenBucket:
+    # A plain old token bucket: `rate` tokens trickle in per second, and we can save up to `capacity` of them for bursts.
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self):
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+class DataMallClient:
+    # Any response with one of these statuses is worth another shot. Everything else 4xx is our fault, so don't bother.
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, headers: dict, base_url: str = DATAMALL_BASE_URL,
+                    max_connections: int = 20, max_concurrency: int = 10,
+                    timeout: float = 10.0, max_retries: int = 3, backoff: float = 0.5,
+                    rate_limit: float = 20.0, burst: int = 20):
+        self.headers = headers
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.timeout = aiohttp.ClientTimeout(total = timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.session = None
+        self.semaphore = None
+        self.bucket = None
+
+    def _ensure_session(self) -> aiohttp.ClientSession:
+        # The session has to be created inside a running event loop, so we do it lazily on first use.
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit = self.max_connections, keepalive_timeout = 60)
+            self.session = aiohttp.ClientSession(connector = connector, headers = self.headers, timeout = self.timeout)
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.bucket = TokenBucket(self.rate_limit, self.burst)
+        return self.session
+
+    async def get(self, endpoint: str, params: dict = None) -> dict:
+        session = self._ensure_session()
+        url = f"{self.base_url}{endpoint}"
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                # Exponential backoff, with some jitter so that retries don't all land at the same time.
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * (0.5 + random.random()))
+            await self.bucket.acquire()
+            try:
+                async with self.semaphore:
+                    async with session.get(url, params = params) as r:
+                        if r.status in self.RETRY_STATUSES:
+                            last_error = DataMallException(f"DataMall returned HTTP {r.status} for {endpoint}")
+                            continue
+                        if r.status >= 400:
+                            raise DataMallException(f"DataMall returned HTTP {r.status} for {endpoint}")
+                        # DataMall doesn't always bother with the right content type.
+                        return await r.json(content_type = None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+        raise DataMallException(f"Gave up on {endpoint} after {self.max_retries + 1} attempts: {last_error}")
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
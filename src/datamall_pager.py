@@ -0,0 +1,100 @@
+from src.datamall_client import DataMallException
+import hashlib
+import asyncio
+import json
+import time
+
+# DataMall hands out its datasets 500 rows at a time, and the only way to find the end is to ask for a page and get nothing back.
+# Walking the pages one after the other means dozens of round trips back to back (BusRoutes alone is ~26k rows),
+# so instead we speculatively keep a window of pages in flight and stop once we hit the first empty one.
+
+DATAMALL_PAGE_SIZE = 500
+
+class PageTiming:
+    __slots__ = ("skip", "rows", "seconds", "digest")
+
+    def __init__(self, skip: int, rows: int, seconds: float, digest: str = None):
+        self.skip = skip
+        self.rows = rows
+        self.seconds = seconds
+        # A hash of the page's contents, so we can tell if anything changed since the last time we fetched it.
+        self.digest = digest
+
+def page_digest(rows: list) -> str:
+    return hashlib.blake2b(json.dumps(rows, sort_keys = True).encode("utf-8"), digest_size = 16).hexdigest()
+
+class PagedFetchReport:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.pages = []
+        self.rows = 0
+        self.seconds = 0.0
+
+    def summary(self, per_page: bool = False) -> str:
+        # The pages that came back empty are the ones we fired off past the end of the data. The price of speculation.
+        wasted = sum(1 for page in self.pages if not page.rows)
+        slowest = max((page.seconds for page in self.pages), default = 0.0)
+        result = f"{self.endpoint}: {self.rows} rows in {len(self.pages)} pages ({wasted} empty), " \
+                    f"{self.seconds:.2f}s total, slowest page {slowest:.2f}s"
+        if per_page:
+            result += "".join(f"\n  $skip={page.skip}: {page.rows} rows in {page.seconds:.3f}s" for page in self.pages)
+        return result
+
+    def digests(self) -> tuple:
+        # The digests of every non-empty page, in order. If these match last time's, so does the whole dataset.
+        return tuple(page.digest for page in self.pages if page.rows)
+
+async def fetch_pages(endpoint: str, fetch_page, on_rows, page_size: int = DATAMALL_PAGE_SIZE, window: int = 8) -> PagedFetchReport:
+    # fetch_page(skip) is a coroutine returning the DataMall response for that offset.
+    # on_rows(rows) gets called with each page's rows as soon as it (and every page before it) has arrived, in order,
+    # so callers can build whatever they want without us holding onto the whole dataset.
+    report = PagedFetchReport(endpoint)
+    start = time.perf_counter()
+
+    async def timed_fetch(skip: int):
+        page_start = time.perf_counter()
+        resp = await fetch_page(skip)
+        if "value" not in resp:
+            raise DataMallException(f"{endpoint} page at $skip={skip} came back without any rows: {resp}")
+        return resp["value"], time.perf_counter() - page_start
+
+    in_flight = {}
+    arrived = {}
+    next_skip = 0
+    next_to_deliver = 0
+    # The $skip of the first page that came back empty. Nothing past it is worth waiting for.
+    end_skip = None
+    try:
+        while True:
+            while end_skip is None and len(in_flight) < window:
+                in_flight[asyncio.ensure_future(timed_fetch(next_skip))] = next_skip
+                next_skip += page_size
+            if not in_flight: break
+
+            done, pending = await asyncio.wait(in_flight.keys(), return_when = asyncio.FIRST_COMPLETED)
+            for task in done:
+                skip = in_flight.pop(task)
+                rows, seconds = task.result()
+                report.pages.append(PageTiming(skip, len(rows), seconds, page_digest(rows) if rows else None))
+                if rows:
+                    arrived[skip] = rows
+                elif end_skip is None or skip < end_skip:
+                    end_skip = skip
+
+            if end_skip is not None:
+                for task, skip in list(in_flight.items()):
+                    if skip > end_skip:
+                        task.cancel()
+                        del in_flight[task]
+
+            while next_to_deliver in arrived:
+                rows = arrived.pop(next_to_deliver)
+                on_rows(rows)
+                report.rows += len(rows)
+                next_to_deliver += page_size
+    finally:
+        for task in in_flight: task.cancel()
+
+    report.pages.sort(key = lambda page: page.skip)
+    report.seconds = time.perf_counter() - start
+    return report
@@ -1,6 +1,8 @@
 import sqlite3
+import asyncio
+import concurrent.futures
 from src.setup_constants import storage_path
-from src import lta_api_processor, lta_api_utils
+from src import lta_api_processor, lta_api_utils, metrics
 
 class NoFavoriteStationsException(Exception):
     "You don't seem to have any favorites!"
@@ -10,85 +12,115 @@ class BusStationNotExistsException(Exception):
     "The requested bus station does not exist!"
     pass
 
-# This file handles the database work behind the favorites command.
-
-def start_db():
-    db = sqlite3.connect(f"{storage_path}favorites.db")
-    cur = db.cursor()
-    db_list = [i[0] for i in cur.execute('''SELECT name FROM sqlite_master''').fetchall()]
+class FavoriteNotFoundException(Exception):
+    "That bus station isn't one of your favorites!"
+    pass
 
-    if "favorite" not in db_list:
-        cur.execute("CREATE TABLE favorite (id, station_list)")
-    
+# This file handles the database work behind the favorites command.
+# We keep ONE connection open for the lifetime of the bot (in WAL mode, so reads don't get stuck behind writes),
+# and every bit of SQLite work happens on a single dedicated thread, so that the event loop never waits on the disk.
+# Each favorite is its own (user_id, station_code) row, so adding or removing one doesn't rewrite the whole list.
+
+# sqlite3 caches the compiled statements for us, as long as we keep using the exact same SQL strings.
+SELECT_FAVORITES = "SELECT station_code FROM favorite_station WHERE user_id = ? ORDER BY station_code"
+HAS_FAVORITES = "SELECT 1 FROM favorite_station WHERE user_id = ? LIMIT 1"
+INSERT_FAVORITE = "INSERT OR IGNORE INTO favorite_station (user_id, station_code) VALUES (?, ?)"
+DELETE_FAVORITE = "DELETE FROM favorite_station WHERE user_id = ? AND station_code = ?"
+COUNT_FAVORITES_BY_STATION = "SELECT station_code, COUNT(*) FROM favorite_station GROUP BY station_code"
+
+_db = None
+# One thread owns the connection. SQLite only lets one writer in at a time anyway.
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "favorites_db")
+
+def start_db(db_path: str = f"{storage_path}favorites.db") -> sqlite3.Connection:
+    global _db
+    if _db is not None: return _db
+
+    db = sqlite3.connect(db_path, check_same_thread = False, cached_statements = 32)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = NORMAL")
+    db.execute('''CREATE TABLE IF NOT EXISTS favorite_station (
+                    user_id INTEGER NOT NULL,
+                    station_code TEXT NOT NULL,
+                    PRIMARY KEY (user_id, station_code)
+                ) WITHOUT ROWID''')
+    migrate_legacy_favorites(db)
     db.commit()
-
-    return db, cur
-
-def add_favorite(user_id: str, station: str):
-
-    db, cur = start_db()
-
-    user = cur.execute("SELECT * FROM favorite WHERE id = ?", (user_id,)).fetchone()
-
+    _db = db
+    return _db
+
+def migrate_legacy_favorites(db: sqlite3.Connection):
+    # The old schema was one row per user with a comma-separated station_list. Move everyone over, then drop it.
+    if not db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'favorite'").fetchone(): return
+    for user_id, station_csv in db.execute("SELECT id, station_list FROM favorite").fetchall():
+        stations = [station for station in (station_csv or "").split(",") if station]
+        db.executemany(INSERT_FAVORITE, [(user_id, station) for station in stations])
+    db.execute("DROP TABLE favorite")
+
+def close_db():
+    global _db
+    if _db is not None:
+        _db.close()
+        _db = None
+
+async def run_db(fn, *args):
+    # Runs fn(db, *args) on the database thread.
+    def run():
+        # Timed on the database thread, so this is just the SQLite work, not the wait for the thread.
+        with metrics.timer(f"sqlite{fn.__name__}"):
+            return fn(start_db(), *args)
+    return await asyncio.get_running_loop().run_in_executor(_executor, run)
+
+def _get_favorites(db: sqlite3.Connection, user_id: int) -> list:
+    return [row[0] for row in db.execute(SELECT_FAVORITES, (user_id,))]
+
+def _add_favorite(db: sqlite3.Connection, user_id: int, station: str):
+    with db:
+        db.execute(INSERT_FAVORITE, (user_id, station))
+
+def _delete_favorite(db: sqlite3.Connection, user_id: int, station: str):
+    # Returns how many favorites were removed (0 or 1), or None if the user didn't have any favorites to begin with.
+    with db:
+        if not db.execute(HAS_FAVORITES, (user_id,)).fetchone(): return None
+        return db.execute(DELETE_FAVORITE, (user_id, station)).rowcount
+
+def _get_favorite_station_counts(db: sqlite3.Connection) -> dict:
+    return dict(db.execute(COUNT_FAVORITES_BY_STATION).fetchall())
+
+def _has_favorites(db: sqlite3.Connection, user_id: int) -> bool:
+    return db.execute(HAS_FAVORITES, (user_id,)).fetchone() is not None
+
+async def add_favorite(user_id: int, station: str):
     if not lta_api_utils.get_station_name(station):
         raise BusStationNotExistsException
 
-    if not user:
-        cur.execute("INSERT INTO favorite (id, station_list) VALUES (?,?)", (user_id, station))
-    elif station in user[1]:
-        pass
-    else:
-        # Sorting the station IDs as a QoL feature...
-        stations = user[1].split(',')
-        stations.append(station)
-        # Better than sorted(). I think. I am NOT writing list(sorted(stations)).
-        stations.sort()
-        station_csv = ','.join(stations)
-        cur.execute("UPDATE favorite SET station_list = ? WHERE id = ?", (station_csv, user_id))
-    
-    db.commit()
-    db.close()
-
+    await run_db(_add_favorite, user_id, station)
     return lta_api_utils.get_station_name(station)
 
-def delete_favorite(user_id: str, station: str):
-    db, cur = start_db()
-    user = cur.execute("SELECT * FROM favorite WHERE id = ?", (user_id,)).fetchone()
-    if not(user and len(user[1])):
+async def delete_favorite(user_id: int, station: str):
+    deleted = await run_db(_delete_favorite, user_id, station)
+    if deleted is None:
+        raise NoFavoriteStationsException
+    # Checked after deleting, so that a favorite LTA has since done away with can still be removed.
+    station_name = lta_api_utils.get_station_name(station)
+    if not deleted:
+        if not station_name: raise BusStationNotExistsException
+        raise FavoriteNotFoundException
+    return station_name or station
+
+async def check_favorites(user_id: int):
+    if not await run_db(_has_favorites, user_id):
         raise NoFavoriteStationsException
-    else:
-        # Sorting the station IDs as a QoL feature...
-        stations = user[1].split(',')
-        stations.remove(station)
-        # Better than sorted(). I think. I am NOT writing list(sorted(stations)).
-        stations.sort()
-        station_csv = ','.join(stations)
-        cur.execute("UPDATE favorite SET station_list = ? WHERE id = ?", (station_csv, user_id))
-    db.commit()
-    db.close()
 
-    return lta_api_utils.get_station_name(station)
+async def get_favorite_arrivals(user_id: int):
+    return await lta_api_processor.display_arrivals_multiple_stations(await get_favorites(user_id))
 
-def check_favorites(user_id: str):
-    db, cur = start_db()
-    user = cur.execute("SELECT * FROM favorite WHERE id = ?", (user_id,)).fetchone()
-    if not(user and len(user[1])):
+async def get_favorites(user_id: int):
+    stations = await run_db(_get_favorites, user_id)
+    if not stations:
         raise NoFavoriteStationsException
+    return stations
 
-def get_favorite_arrivals(user_id: str):
-    db, cur = start_db()
-    user = cur.execute("SELECT * FROM favorite WHERE id = ?", (user_id,)).fetchone()
-    if not(user and len(user[1])):
-        raise NoFavoriteStationsException
-    else:
-        station_csv = user[1]
-        return lta_api_processor.display_arrivals_multiple_stations(station_csv.split(","))
-    
-def get_favorites(user_id: str):
-    db, cur = start_db()
-    user = cur.execute("SELECT * FROM favorite WHERE id = ?", (user_id,)).fetchone()
-    if not(user and len(user[1])):
-        raise NoFavoriteStationsException
-    else:
-        station_csv = user[1]
-        return station_csv.split(',')
\ No newline at end of file
+async def get_favorite_station_counts() -> dict:
+    # Station code -> how many users have it as a favorite.
+    return await run_db(_get_favorite_station_counts)
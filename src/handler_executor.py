@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import functools
+import asyncio
+import time
+
+# Runs the bot's handlers so that one slow user can't hold everyone else up.
+# - Each user's updates are handled one at a time, in the order they came in, so replies never come out jumbled.
+#   Different users don't wait on each other at all.
+# - Anything that blocks (rendering, disk, the odd bit of number crunching) goes to a small thread pool instead of the event loop.
+# - If too much is queued up (overall, or from one user mashing buttons), new updates get turned away straight away
+#   instead of piling up behind everything else.
+
+class ExecutorOverloadedException(Exception):
+    "There's too much work queued up already."
+    pass
+
+class LatencyWindow:
+    # The last few hundred timings of something, for percentiles. Old ones fall off the end.
+    def __init__(self, size: int = 1024):
+        self.samples = collections.deque(maxlen = size)
+        self.count = 0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self) -> dict:
+        if not self.samples: return {"count": self.count}
+        ordered = sorted(self.samples)
+        def percentile(p: float) -> float:
+            return round(ordered[min(int(p * len(ordered)), len(ordered) - 1)] * 1000, 2)
+        return {"count": self.count, "p50_ms": percentile(0.5), "p95_ms": percentile(0.95), "p99_ms": percentile(0.99),
+                "max_ms": round(ordered[-1] * 1000, 2)}
+
+class HandlerExecutor:
+    def __init__(self, max_workers: int = 4, max_pending: int = 256, max_pending_per_user: int = 4, log_interval: float = 600.0):
+        self.pool = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = "handler")
+        # Keeps the pool's own (unbounded) queue empty, so that anyone waiting shows up in our numbers instead.
+        self.pool_slots = asyncio.Semaphore(max_workers)
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self.log_interval = log_interval
+
+        # User ID -> the lock their updates queue up on. asyncio.Lock wakes its waiters first come first served.
+        self.user_locks = {}
+        self.pending_by_user = collections.Counter()
+        self.pending = 0
+        self.waiting_for_pool = 0
+        self.rejected = 0
+
+        # How long updates waited behind the same user's earlier ones, and how long they took overall.
+        self.queue_latency = LatencyWindow()
+        self.handler_latency = LatencyWindow()
+        # How long blocking calls waited for a thread, and how long they ran on it.
+        self.pool_wait_latency = LatencyWindow()
+        self.pool_run_latency = LatencyWindow()
+
+    async def run_blocking(self, fn, *args):
+        # Runs fn(*args) on the thread pool, waiting for a free thread if need be.
+        queued = time.perf_counter()
+        self.waiting_for_pool += 1
+        try:
+            await self.pool_slots.acquire()
+        finally:
+            self.waiting_for_pool -= 1
+        try:
+            start = time.perf_counter()
+            self.pool_wait_latency.record(start - queued)
+            return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+        finally:
+            self.pool_run_latency.record(time.perf_counter() - start)
+            self.pool_slots.release()
+
+    async def run_for_user(self, user_id: int, handler, *args):
+        # Runs handler(*args) once all of this user's earlier updates are done.
+        # Raises ExecutorOverloadedException without running anything if there's too much queued up already.
+        if self.pending >= self.max_pending or self.pending_by_user[user_id] >= self.max_pending_per_user:
+            self.rejected += 1
+            raise ExecutorOverloadedException(f"Too much queued up to take on more work for user {user_id}")
+
+        queued = time.perf_counter()
+        self.pending += 1
+        self.pending_by_user[user_id] += 1
+        lock = self.user_locks.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock:
+                self.queue_latency.record(time.perf_counter() - queued)
+                return await handler(*args)
+        finally:
+            self.handler_latency.record(time.perf_counter() - queued)
+            self.pending -= 1
+            self.pending_by_user[user_id] -= 1
+            # Nobody else is queued up behind us, so there's no point remembering this user.
+            if not self.pending_by_user[user_id]:
+                del self.pending_by_user[user_id]
+                del self.user_locks[user_id]
+
+    def per_user(self, on_overload = None):
+        # Decorator for telebot handlers (messages, callback queries and inline queries all have a from_user).
+        # on_overload(update) is awaited instead of the handler when we turn an update away.
+        def decorator(handler):
+            @functools.wraps(handler)
+            async def wrapper(update):
+                try:
+                    return await self.run_for_user(update.from_user.id, handler, update)
+                except ExecutorOverloadedException as e:
+                    print(str(e))
+                    if on_overload is not None: await on_overload(update)
+            return wrapper
+        return decorator
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "pending_users": len(self.pending_by_user),
+            "waiting_for_pool": self.waiting_for_pool,
+            "rejected": self.rejected,
+            "queue_latency": self.queue_latency.summary(),
+            "handler_latency": self.handler_latency.summary(),
+            "pool_wait_latency": self.pool_wait_latency.summary(),
+            "pool_run_latency": self.pool_run_latency.summary()
+        }
+
+    async def run(self):
+        # Logs the stats every so often. Runs alongside everything else in bot_setup.
+        while True:
+            await asyncio.sleep(self.log_interval)
+            print(f"Handler executor: {self.stats()}")
+
+    def close(self):
+        self.pool.shutdown(wait = False)
@@ -0,0 +1,141 @@
+from src.arrival_history import ArrivalHistory, read_history, history_files
+import numpy as np
+import argparse
+import os
+
+# How reliable are LTA's arrival estimates? Batch statistics over the arrival history (see arrival_history.py), all vectorized,
+# so millions of rows take seconds rather than minutes.
+# e.g. `python3 -m src.history_stats storage/arrival_history --by service`
+#
+# We never see a bus actually arrive, so we follow each bus through the NextBus slot of successive fetches at its stop:
+# the estimate keeps getting revised until the bus passes and the slot jumps ahead to the next bus.
+# The last estimate we saw (if we saw one close enough to the end) stands in for when it actually arrived.
+# - ETA drift is how far each earlier estimate was off from that, by how far ahead it was made.
+#   Positive means LTA said the bus would come later than it did.
+# - Headways are the gaps between consecutive buses of a service at a stop. A high coefficient of variation means bunching.
+
+# Horizon buckets, in minutes ahead of the bus arriving: [0, 2), [2, 5), [5, 10), [10, 20), [20, inf)
+HORIZON_EDGES = (2, 5, 10, 20)
+
+class TrackedBuses:
+    # The NextBus rows of an ArrivalHistory, sorted by stop, service and time, with each row tagged by which bus it was about.
+    __slots__ = ("station", "service", "fetched_at", "eta", "bus", "arrival", "observed")
+
+    def __init__(self, station, service, fetched_at, eta, bus, arrival, observed):
+        self.station = station
+        self.service = service
+        self.fetched_at = fetched_at
+        self.eta = eta
+        # Per row: which bus it's about (0, 1, 2, ... in sorted order).
+        self.bus = bus
+        # Per bus: the last estimate we saw for it, and whether that was close enough to the end to count as when it arrived.
+        self.arrival = arrival
+        self.observed = observed
+
+def track_buses(history: ArrivalHistory, new_bus_jump: float = 120.0, max_fetch_gap: float = 600.0, close_enough: float = 90.0) -> TrackedBuses:
+    # A new bus starts whenever the estimate jumps forward by more than new_bus_jump seconds (the last one passed),
+    # or we went more than max_fetch_gap seconds without looking (we can't tell what happened in between).
+    first = history.slot == 0
+    station, service, fetched_at, eta = history.station[first], history.service[first], history.fetched_at[first], history.eta[first]
+    order = np.lexsort((fetched_at, service, station))
+    station, service, fetched_at, eta = station[order], service[order], fetched_at[order], eta[order]
+
+    same_bus = np.zeros(len(station), dtype = bool)
+    same_bus[1:] = ((station[1:] == station[:-1]) & (service[1:] == service[:-1])
+                    & (fetched_at[1:] - fetched_at[:-1] <= max_fetch_gap) & (eta[1:] - eta[:-1] <= new_bus_jump))
+    bus = np.cumsum(~same_bus) - 1
+    last = np.ones(len(station), dtype = bool)
+    last[:-1] = bus[1:] != bus[:-1]
+    arrival = eta[last]
+    observed = arrival - fetched_at[last] <= close_enough
+    return TrackedBuses(station, service, fetched_at, eta, bus, arrival, observed)
+
+def group_key(station: np.ndarray, service: np.ndarray, by: str) -> np.ndarray:
+    if by == "service": return service.astype(np.int64)
+    if by == "station": return station.astype(np.int64)
+    return station.astype(np.int64) << 16 | service
+
+def describe_key(key: int, by: str, services: list) -> str:
+    if by == "service": return services[key]
+    if by == "station": return f"{key:05d}"
+    return f"{key >> 16:05d} {services[key & 0xFFFF]}"
+
+def grouped_stats(keys: np.ndarray, values: np.ndarray, quantiles: tuple = (0.5, 0.9)) -> dict:
+    # Count, mean, standard deviation and quantiles of values for each distinct key, without a Python loop over the groups.
+    if not len(keys): return {"key": keys, "count": keys, "mean": values, "std": values, **{f"q{q}": values for q in quantiles}}
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    unique, start, count = np.unique(keys, return_index = True, return_counts = True)
+    mean = np.add.reduceat(values, start) / count
+    std = np.sqrt(np.maximum(np.add.reduceat(values * values, start) / count - mean * mean, 0))
+    stats = {"key": unique, "count": count, "mean": mean, "std": std}
+    for q in quantiles:
+        # Each group's values are sorted, so its q-th quantile is just a matter of indexing.
+        stats[f"q{q}"] = values[start + np.floor(q * (count - 1)).astype(np.int64)]
+    return stats
+
+def eta_drift(history: ArrivalHistory, by: str = "service", tracked: TrackedBuses = None) -> dict:
+    # Per group and horizon bucket: how many estimates, their mean error (bias), and the mean and 90th percentile of the absolute error.
+    # Errors in seconds. Also returns the key and horizon bucket for each group.
+    tracked = tracked or track_buses(history)
+    usable = tracked.observed[tracked.bus]
+    arrival = tracked.arrival[tracked.bus][usable]
+    error = tracked.eta[usable] - arrival
+    horizon = np.digitize((arrival - tracked.fetched_at[usable]) / 60, HORIZON_EDGES)
+    keys = group_key(tracked.station[usable], tracked.service[usable], by) * (len(HORIZON_EDGES) + 1) + horizon
+    bias = grouped_stats(keys, error, ())
+    absolute = grouped_stats(keys, np.abs(error), (0.9,))
+    return {"key": bias["key"] // (len(HORIZON_EDGES) + 1), "horizon": bias["key"] % (len(HORIZON_EDGES) + 1), "count": bias["count"],
+            "bias": bias["mean"], "mae": absolute["mean"], "p90_abs": absolute["q0.9"]}
+
+def headways(history: ArrivalHistory, by: str = "service", tracked: TrackedBuses = None) -> dict:
+    # Per group: how many gaps between consecutive (observed) buses, and their mean, standard deviation, 10th and 90th percentiles
+    # in seconds, plus the coefficient of variation.
+    tracked = tracked or track_buses(history)
+    first_row = np.ones(len(tracked.bus), dtype = bool)
+    first_row[1:] = tracked.bus[1:] != tracked.bus[:-1]
+    bus_station, bus_service = tracked.station[first_row], tracked.service[first_row]
+    # Consecutive buses of the same service at the same stop, both of which we saw arrive.
+    consecutive = ((bus_station[1:] == bus_station[:-1]) & (bus_service[1:] == bus_service[:-1])
+                    & tracked.observed[1:] & tracked.observed[:-1])
+    gaps = (tracked.arrival[1:] - tracked.arrival[:-1])[consecutive]
+    keys = group_key(bus_station[1:][consecutive], bus_service[1:][consecutive], by)
+    stats = grouped_stats(keys, gaps, (0.1, 0.9))
+    stats["cv"] = np.divide(stats["std"], stats["mean"], out = np.zeros_like(stats["std"]), where = stats["mean"] > 0)
+    return stats
+
+def horizon_label(bucket: int) -> str:
+    edges = (0,) + HORIZON_EDGES + (None,)
+    return f"{edges[bucket]}-{edges[bucket + 1]}m" if edges[bucket + 1] is not None else f"{edges[bucket]}m+"
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description = "ETA drift and headway statistics from the arrival history.")
+    parser.add_argument("paths", nargs = "+", help = "history files, or directories of them")
+    parser.add_argument("--by", choices = ("service", "station", "both"), default = "service", help = "what to group the statistics by")
+    parser.add_argument("--min-count", type = int, default = 20, help = "leave out groups with fewer samples than this")
+    parser.add_argument("--top", type = int, default = 50, help = "how many groups to show, least reliable first")
+    args = parser.parse_args(argv)
+
+    paths = [file for path in args.paths for file in (history_files(path) if os.path.isdir(path) else [path])]
+    history = read_history(paths)
+    tracked = track_buses(history)
+    print(f"{len(history)} rows from {len(paths)} files, {len(tracked.arrival)} buses ({int(tracked.observed.sum())} seen arriving)")
+
+    drift = eta_drift(history, args.by, tracked)
+    shown = np.flatnonzero(drift["count"] >= args.min_count)
+    shown = shown[np.argsort(-drift["mae"][shown], kind = "stable")][:args.top]
+    print(f"\nETA drift (seconds, + means LTA said later than it came)\n{args.by:<16}{'ahead':>8}{'count':>8}{'bias':>8}{'mae':>8}{'p90':>8}")
+    for i in shown:
+        print(f"{describe_key(int(drift['key'][i]), args.by, history.services):<16}{horizon_label(int(drift['horizon'][i])):>8}"
+                f"{drift['count'][i]:>8}{drift['bias'][i]:>8.0f}{drift['mae'][i]:>8.0f}{drift['p90_abs'][i]:>8.0f}")
+
+    gaps = headways(history, args.by, tracked)
+    shown = np.flatnonzero(gaps["count"] >= args.min_count)
+    shown = shown[np.argsort(-gaps["cv"][shown], kind = "stable")][:args.top]
+    print(f"\nHeadways (minutes)\n{args.by:<16}{'count':>8}{'mean':>8}{'p10':>8}{'p90':>8}{'cv':>8}")
+    for i in shown:
+        print(f"{describe_key(int(gaps['key'][i]), args.by, history.services):<16}{gaps['count'][i]:>8}{gaps['mean'][i] / 60:>8.1f}"
+                f"{gaps['q0.1'][i] / 60:>8.1f}{gaps['q0.9'][i] / 60:>8.1f}{gaps['cv'][i]:>8.2f}")
+
+if __name__ == "__main__":
+    main()
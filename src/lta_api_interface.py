@@ -1,95 +1,172 @@
-from src.setup_constants import headers, storage_path, sg_timezone
-import src.lta_api_utils as utils
-import requests
+from src.setup_constants import headers, sg_timezone
+from src.datamall_client import DataMallClient
+from src.datamall_pager import fetch_pages
+from src.route_index import RouteIndexBuilder
+from src import static_network, static_diff, metrics
 import datetime
 import asyncio
-import json
+import random
+import time
 
 # These functions directly interact or control scheduled interactions with the LTA API.
-def request_bus_routes(skip: int) -> dict:
-    url = f"http://datamall2.mytransport.sg/ltaodataservice/BusRoutes?$skip={skip}"
-    r = requests.get(url, headers = headers)
-    return r.json()
-
-def request_arrival_data(station: str, bus: str) -> dict:
-    url = f"http://datamall2.mytransport.sg/ltaodataservice/BusArrivalv2?BusStopCode={station}" + \
-            ("" if bus == "-1" else f"&ServiceNo={bus}")
-    r = requests.get(url, headers = headers)
-    return r.json()
-
-def request_bus_station_data(skip: int = 0) -> dict:
-    url = f"http://datamall2.mytransport.sg/ltaodataservice/BusStops?$skip={skip}"
-    r = requests.get(url, headers = headers)
-    return r.json()
-
-
-def get_arrivals(station: str, bus: str) -> str:
-    try:
-        bus_arrival_data = request_arrival_data(station, bus)
-        bus_arrival_data["last_updated"] = datetime.datetime.isoformat(datetime.datetime.now(tz = sg_timezone))
-        
-        # If many queries to the same bus station occur at the same time, (realistically, I'm going to be the only user, but let me dream, ok?)
-        # We can answer all of them with a single API call.
-        # This should hopefully keep us out of trouble.
-        with open(f"{storage_path}arrival_info/{station}.json", "w+") as f: 
-            f.write(json.dumps(bus_arrival_data))
-    except Exception as e:
-        print(str(e))
-
-def get_all_bus_stations():
+# Everything goes through the one shared client, so that we reuse connections and stay within DataMall's rate limits.
+client = DataMallClient(headers)
+# If set (an arrival_history.ArrivalHistoryRecorder), every arrival response we fetch gets logged for later analysis.
+history_recorder = None
+
+@metrics.timed("datamall_request")
+async def request_bus_routes(skip: int) -> dict:
+    return await client.get("BusRoutes", {"$skip": skip})
+
+@metrics.timed("datamall_request")
+async def request_arrival_data(station: str, bus: str) -> dict:
+    params = {"BusStopCode": station}
+    if bus != "-1": params["ServiceNo"] = bus
+    return await client.get("BusArrivalv2", params)
+
+@metrics.timed("datamall_request")
+async def request_bus_station_data(skip: int = 0) -> dict:
+    return await client.get("BusStops", {"$skip": skip})
+
+
+async def get_arrivals(station: str, bus: str) -> dict:
+    bus_arrival_data = await request_arrival_data(station, bus)
+    bus_arrival_data["last_updated"] = datetime.datetime.isoformat(datetime.datetime.now(tz = sg_timezone))
+    if history_recorder is not None: history_recorder.record(bus_arrival_data)
+    return bus_arrival_data
+
+async def get_all_bus_stations():
     # Retrieves all the bus stations from LTA.
     bus_station_dict = {
         "bus_stops": []
     }
     # Because each query only returns 500 stations when there are CLEARLY WAY MORE than 500 stations...
-    # We will have to uh. Spam the endpoint. (sorry not sorry)
-    resp = {}
-    query_count = 0
-    while("value" not in resp.keys() or len(resp["value"])):
-        resp = request_bus_station_data(query_count * 500)
-        for stop in resp["value"]: bus_station_dict["bus_stops"].append(stop)
-        query_count += 1
-    with open(f"{storage_path}bus_station_info.json", "w+") as f:
-        bus_station_dict["last_updated"] = datetime.datetime.isoformat(datetime.datetime.now(tz = sg_timezone))
-        f.write(json.dumps(bus_station_dict))
-
-def get_all_bus_operation_times():
+    # We will have to uh. Spam the endpoint. (sorry not sorry) At least we do it a few pages at a time now.
+    report = await fetch_pages("BusStops", request_bus_station_data, bus_station_dict["bus_stops"].extend)
+    print(report.summary(per_page = True))
+    bus_station_dict["page_digests"] = report.digests()
+    bus_station_dict["last_updated"] = datetime.datetime.isoformat(datetime.datetime.now(tz = sg_timezone))
+    return bus_station_dict
+
+async def get_all_bus_operation_times(bus_station_codes: list):
     # Retrieves all the bus operation times by station from LTA.
-    
-    # We only ever run this function after get_all_bus_stations, therefore we can skip the try except clause.
-    bus_station_codes = [station["BusStopCode"] for station in utils.load_from_storage_bus_stations()["bus_stops"]]
+    # We only ever run this function after get_all_bus_stations, so we just take the station codes it found.
     
     bus_operation_dict = {
         "operation_times" : {}
     }
     for station_code in bus_station_codes: bus_operation_dict["operation_times"][station_code] = {}
+    # The station -> service map above throws away the order of the stops, so we keep that separately.
+    route_builder = RouteIndexBuilder()
 
-    resp = {}
-    query_count = 0
-    while("value" not in resp.keys() or len(resp["value"])):
-        resp = request_bus_routes(query_count * 500)
-        for svc in resp["value"]:
+    def add_routes(rows: list):
+        for svc in rows:
             bus_operation_dict["operation_times"][svc["BusStopCode"]][svc["ServiceNo"]] = svc
-        query_count += 1
+        route_builder.add_rows(rows)
+
+    report = await fetch_pages("BusRoutes", request_bus_routes, add_routes)
+    print(report.summary(per_page = True))
+    bus_operation_dict["page_digests"] = report.digests()
+    bus_operation_dict["route_index"] = route_builder.build()
+
+    bus_operation_dict["last_updated"] = datetime.datetime.isoformat(datetime.datetime.now(tz = sg_timezone))
+    return bus_operation_dict
+
+# The page digests from the last refresh. If every page comes back the same, we don't even need to look for changes.
+last_page_digests = None
+
+def build_network(bus_station_dict: dict, bus_operation_dict: dict, page_digests: tuple, previous_digests: tuple) -> static_network.StaticNetwork:
+    # Builds (or diffs) and saves the new network. The slow, CPU-bound part of a refresh, so it runs off the event loop.
+    last_updated = bus_operation_dict["last_updated"]
+    current = static_network.get_network()
+    if current is static_network.EMPTY_NETWORK:
+        network = static_network.StaticNetwork(bus_station_dict["bus_stops"], bus_operation_dict["operation_times"], last_updated,
+                                                bus_operation_dict["route_index"])
+        print(f"Built the bus network from scratch: {len(network.stations)} bus stops, {len(network.operation_times)} routes.")
+    elif page_digests == previous_digests:
+        network = current.apply_diff(static_diff.StaticDiff(), {}, {}, last_updated)
+        print("No changes to the bus network (all pages identical).")
+    else:
+        # The network barely changes from day to day, so we only update what did.
+        new_stations = {stop["BusStopCode"]: stop for stop in bus_station_dict["bus_stops"]}
+        new_operation_times = {(station_code, service_no): tuple(svc[field] for field in static_network.OPERATION_FIELDS)
+                                for station_code, services in bus_operation_dict["operation_times"].items()
+                                for service_no, svc in services.items()}
+        diff = static_diff.diff_static_data(current.stations, current.operation_times, new_stations, new_operation_times)
+        network = current.apply_diff(diff, new_stations, new_operation_times, last_updated, bus_operation_dict["route_index"])
+        print(diff.summary())
+    static_network.save_to_storage(network)
+    return network
+
+@metrics.timed("static_refresh")
+async def refresh_static_data():
+    global last_page_digests
+    start = time.perf_counter()
+    bus_station_dict = await get_all_bus_stations()
+    bus_operation_dict = await get_all_bus_operation_times([station["BusStopCode"] for station in bus_station_dict["bus_stops"]])
+    page_digests = (bus_station_dict["page_digests"], bus_operation_dict["page_digests"])
+
+    # Build the new network fully before swapping it in, so nobody ever sees a half-built one.
+    network = await asyncio.get_running_loop().run_in_executor(None, build_network, bus_station_dict, bus_operation_dict,
+                                                                page_digests, last_page_digests)
+    static_network.swap_network(network)
+    last_page_digests = page_digests
+    print(f"Static data refresh took {time.perf_counter() - start:.2f}s")
+
+# The refresh that's running right now, if any. Anyone who needs one while it's going joins it instead of starting another.
+_refresh_task = None
 
-    with open(f"{storage_path}bus_operation_info.json", "w+") as f:
-        bus_operation_dict["last_updated"] = datetime.datetime.isoformat(datetime.datetime.now(tz = sg_timezone))
-        f.write(json.dumps(bus_operation_dict))
+async def coalesced_refresh():
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.ensure_future(refresh_static_data())
+    else:
+        metrics.count("static_refresh_joined")
+    # Shielded, so that one caller being cancelled doesn't cancel the refresh for everyone else waiting on it.
+    await asyncio.shield(_refresh_task)
 
-def refresh_static_data():
-    get_all_bus_stations()
-    get_all_bus_operation_times()
+def seconds_until_midnight(now: datetime.datetime = None) -> float:
+    # Until the next midnight in Singapore, wherever the server happens to be.
+    now = (now or datetime.datetime.now(tz = sg_timezone)).astimezone(sg_timezone)
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days = 1), datetime.time(), tzinfo = sg_timezone)
+    return (midnight - now).total_seconds()
 
+def is_stale(network: static_network.StaticNetwork, now: datetime.datetime = None) -> bool:
+    # Whether the network is from before today (Singapore time), or we've got nothing at all.
+    # One without a route index (from an older snapshot, or the JSON files) is missing the stop order, so it needs a refresh too.
+    if network is static_network.EMPTY_NETWORK or not network.last_updated or not len(network.route_index): return True
+    now = (now or datetime.datetime.now(tz = sg_timezone)).astimezone(sg_timezone)
+    return datetime.datetime.fromisoformat(network.last_updated).astimezone(sg_timezone).date() < now.date()
 
-async def query_static_data():
+async def query_static_data(jitter: float = 600.0, startup_jitter: float = 30.0, min_backoff: float = 60.0, max_backoff: float = 3600.0,
+                            sleep = asyncio.sleep):
     # In this function, we lazily query the "static" data inherent to the public bus system in SG.
     # As one can expect, this includes information like bus stops and bus operation timings.
+    # - We never hold up startup for it. The bot serves from whatever snapshot it has, and only refreshes (in the background) if that's
+    #   from before today. After that, it's once a day, just after midnight.
+    # - Every refresh waits a random bit first (up to `jitter` seconds), so that several workers started together don't all page through
+    #   DataMall at the same time.
+    # - A refresh that fails gets retried after min_backoff seconds, doubling each time up to max_backoff, instead of taking the bot down.
+    network = static_network.get_network()
+    if network is static_network.EMPTY_NETWORK:
+        # Nothing to serve at all, so there's no point waiting.
+        delay = 0
+    elif is_stale(network):
+        delay = random.uniform(0, startup_jitter)
+    else:
+        delay = seconds_until_midnight() + random.uniform(0, jitter)
+    backoff = min_backoff
     while True:
-        # TODO: Devise a way to integrate both get_all_bus_stations and get_all_bus_operation_times without too much clutter.
+        await sleep(delay)
         print("Refreshing bus network information...")
-        refresh_static_data()
+        try:
+            await coalesced_refresh()
+        except Exception as e:
+            print(f"Static data refresh failed, trying again in {backoff:.0f}s: {e}")
+            metrics.count("static_refresh_failures")
+            delay = backoff
+            backoff = min(backoff * 2, max_backoff)
+            continue
         print("Done!")
-        
-        tmwdatetime = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days = 1), datetime.time())
-        wait_sec = datetime.timedelta(seconds = (tmwdatetime - datetime.datetime.now()).seconds, microseconds = (tmwdatetime - datetime.datetime.now()).microseconds)
-        await asyncio.sleep(wait_sec.seconds + wait_sec.microseconds / 1000000)
\ No newline at end of file
+        backoff = min_backoff
+        delay = seconds_until_midnight() + random.uniform(0, jitter)
@@ -1,117 +1,122 @@
-from src.setup_constants import sg_timezone, bus_types, bus_load
+from src.setup_constants import sg_timezone, storage_path, shared_cache
+from src.arrival_cache import ArrivalCache
+from src.arrival_prefetcher import ArrivalPrefetcher
+from src.handler_executor import HandlerExecutor
+from src import arrival_model, metrics
 import src.lta_api_utils as utils 
 import src.lta_api_interface as interface
+from src import static_network
 import datetime
+import asyncio
 import telebot
 import json
 from haversine import haversine, Unit
 
 # Most of the computational heavy-lifting and dictionary processing is done here.
 
-def bus_in_operation(station: str, bus: str):
-    # Checks if a bus is in operation.
-    datetime_now = datetime.datetime.now(tz = sg_timezone)
-    weekday = datetime_now.isoweekday()
-    hhmm = int(datetime_now.strftime("%H%M"))
-    try:
-        bus_operation_dict = utils.load_from_storage_bus_operation_times()
-    except FileNotFoundError:
-        interface.refresh_static_data()
-        bus_operation_dict = utils.load_from_storage_bus_operation_times()
-    except Exception as e:
-        print(str(e))
-    finally:
-        arrival_data = bus_operation_dict["operation_times"][station][bus]
-        # So LTA didn't tell me they would just put dashes for bus timings instead of numbers whenever they pleased...
-        try:
-            first_bus = int(arrival_data[f"{utils.is_weekday(weekday)}_FirstBus"])
-            last_bus = int(arrival_data[f"{utils.is_weekday(weekday)}_LastBus"])
-        except ValueError:
-            return False
-
-        if last_bus < first_bus: last_bus += 2400
-        return first_bus < hhmm and hhmm < last_bus
-
-def get_bus_arrival_status(time1: datetime.datetime) -> str:
-    # Strangely enough, the bus can be estimated to be gone when you query the API.
-    # This is probably because:
-    # - The bus actually left
-    # - L + ratio + infrequent updates + bad bus timing
-    # Due to negative experiences with bus timings I am now assuming the latter.  
-    datetime_now = datetime.datetime.now(tz = sg_timezone)  
-    est = utils.bus_est_arrival_min(time1)
-
-    if est <= 0 or time1 < datetime_now: return "Arriving Soon"
-    
-    return f"{str(est)} min"
-
-def parse_arrival_data(bus_arrival_data: dict, bus_operation_data: dict, bus: str):
-    result = f"<b>{utils.get_station_name(bus_arrival_data['BusStopCode'])} ({(bus_arrival_data['BusStopCode'])})</b>\n"
+@metrics.timed("render")
+def parse_arrival_data(bus_arrival_data: dict, bus_operation_data: tuple, bus: str, renderer = arrival_model.render_html):
+    # Renders the arrival data with any of the renderers in arrival_model. HTML for Telegram by default.
+    # Returns None if we were asked about a bus that doesn't stop here.
     if bus != "-1" and not(bus in bus_operation_data):
         return None
-    services = bus_arrival_data['Services']
-    bus_list = bus_operation_data.keys() if bus == "-1" else [service['ServiceNo'] for service in services]
-    for service_no in sorted(bus_list, key = utils.bus_ordering):
-        service = {}
-        for i in services:
-            if i['ServiceNo'] == service_no: 
-                service = i
-                break
-        result += f"<b>Bus {service_no}</b>\n"
-        
-        if not bus_in_operation(bus_arrival_data['BusStopCode'], service_no) or service == {}:
-            result += "Currently not operational.\n\n"
-            continue
-        
-        for bus in [service['NextBus'], service['NextBus2'], service['NextBus3']]:
-            if not bus['EstimatedArrival']: continue 
-            arrival_status = get_bus_arrival_status(datetime.datetime.fromisoformat(bus['EstimatedArrival']))
-            result += f"{bus_types[bus['Type']]} -- {arrival_status} {bus_load[bus['Load']]}"
-            if bus['Feature'] == 'WAB': result += '\u267f'
-            result += "\n"
-        result += "\n"
-    return result
+    arrivals = arrival_model.StationArrivals.from_datamall(bus_arrival_data)
+    # One "now" for the whole station, so that all the buses agree on what time it is.
+    datetime_now = datetime.datetime.now(tz = sg_timezone)
+    # Work out which services are running once for the whole station, instead of once per service.
+    with metrics.timer("bus_in_operation"):
+        running_services = static_network.get_network().operating_hours.running_services(arrivals.station, datetime_now)
+    bus_list = bus_operation_data if bus == "-1" else arrivals.services.keys()
+    return renderer(arrivals, utils.get_station_name(arrivals.station), bus_list, running_services, datetime_now)
+
+# If many queries to the same bus station occur at the same time, (realistically, I'm going to be the only user, but let me dream, ok?)
+# We can answer all of them with a single API call.
+# This should hopefully keep us out of trouble.
+# We always fetch every service at the station, so that one cache entry can answer any question about it.
+# With more than one worker, misses check the shared cache before going to DataMall.
+arrival_cache = ArrivalCache(lambda station: interface.get_arrivals(station, "-1"),
+                                ttl = 10.0,
+                                persist_path = f"{storage_path}arrival_info/",
+                                shared = shared_cache if shared_cache.shared else None)
 
-def query_arrivals(station: str, bus: str) -> dict:
+async def favorite_station_counts() -> dict:
+    # Imported here because favorites_db depends on us.
+    from src import favorites_db
+    return await favorites_db.get_favorite_station_counts()
+
+# Keeps the popular stations in arrival_cache warm. Runs alongside lta_api_interface.query_static_data.
+prefetcher = ArrivalPrefetcher(arrival_cache, favorite_station_counts)
+
+# The bot's handlers run through this, and so does anything blocking they need done (mostly rendering).
+executor = HandlerExecutor()
+
+def only_service(bus_arrival_data: dict, bus: str) -> dict:
+    # Prune all unnecessary entries. On a copy, since the cached dict is shared.
+    if bus == "-1": return bus_arrival_data
+    return {**bus_arrival_data, "Services": [service for service in bus_arrival_data["Services"] if service["ServiceNo"] == bus]}
+
+async def query_arrivals(station: str, bus: str) -> dict:
     # Lazily retrieve the arrival information for each service.
-    bus_arrival_data = {}
-    bus_operation_data = {}
-    try:
-        bus_arrival_data = utils.load_from_storage_arrival_info(station)
-        # If it's been about 10 seconds since we last updated this list, then retrieve the new list.
-        if (datetime.datetime.now(tz = sg_timezone) - datetime.datetime.fromisoformat(bus_arrival_data["last_updated"])).seconds >= 10: 
-            interface.get_arrivals(station, bus)
-            bus_arrival_data = utils.load_from_storage_arrival_info(station)
-    except FileNotFoundError:
-        interface.get_arrivals(station, bus)
-        bus_arrival_data = utils.load_from_storage_arrival_info(station)
-    finally:
-        if bus == "-1": return bus_arrival_data
-        for i in range(len(bus_arrival_data['Services']) - 1, -1, -1):
-            # Prune all unnecessary entries.
-            if bus_arrival_data['Services'][i]['ServiceNo'] != bus:
-                bus_arrival_data['Services'].pop(i)
-
-        return bus_arrival_data
-
-def display_arrivals(station: str, bus: str) -> str:
-    bus_arrival_data = query_arrivals(station, bus)
-    bus_operation_data = utils.load_from_storage_bus_operation_times()["operation_times"][station]
-    return parse_arrival_data(bus_arrival_data, bus_operation_data, bus)
-
-def display_arrivals_multiple_stations(station_list) -> str:
-    
-    result = f"Here is the arrival info of your favorite stations: \n\n{'=' * 20}\n\n"
-    for station in station_list:
-        result = result + f"{utils.get_station_name(station)} Station:\n{display_arrivals(station, '-1')}{'=' * 20}\n\n"
-    return result
+    prefetcher.record_request(station)
+    with metrics.timer("cache_lookup"):
+        bus_arrival_data = await arrival_cache.get(station)
+    return only_service(bus_arrival_data, bus)
+
+async def query_arrivals_batch(station_list: list, max_concurrency: int = 8) -> list:
+    # Fetches the arrival info for a bunch of stations at once (at most max_concurrency at a time).
+    # Returns one result per station, in the same order as station_list.
+    # If a station couldn't be fetched, its result is the exception instead, so one bad station doesn't ruin everyone's day.
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch_one(station: str):
+        prefetcher.record_request(station)
+        async with semaphore:
+            with metrics.timer("cache_lookup"):
+                return await arrival_cache.get(station)
+
+    unique_stations = list(dict.fromkeys(station_list))
+    results = await asyncio.gather(*(fetch_one(station) for station in unique_stations), return_exceptions = True)
+    results_by_station = dict(zip(unique_stations, results))
+    return [results_by_station[station] for station in station_list]
+
+def render_station_arrivals(network: static_network.StaticNetwork, station: str, bus_arrival_data, bus: str = "-1") -> str:
+    # Renders one station's worth of query_arrivals_batch results, optionally just for one bus.
+    if isinstance(bus_arrival_data, Exception):
+        print(str(bus_arrival_data))
+        metrics.count("arrival_fetch_errors")
+        return "Sorry, I couldn't get the arrival info for this station right now :<\n\n"
+    return parse_arrival_data(only_service(bus_arrival_data, bus), network.get_services(station), bus)
+
+async def display_arrivals(station: str, bus: str) -> str:
+    network = await static_network.ensure_network()
+    bus_arrival_data = await query_arrivals(station, bus)
+    bus_operation_data = network.get_services(station)
+    return await executor.run_blocking(parse_arrival_data, bus_arrival_data, bus_operation_data, bus)
+
+async def display_arrivals_multiple_stations(station_list) -> str:
+    network = await static_network.ensure_network()
+    arrivals = await query_arrivals_batch(station_list)
+
+    def render() -> str:
+        result = f"Here is the arrival info of your favorite stations: \n\n{'=' * 20}\n\n"
+        for station, bus_arrival_data in zip(station_list, arrivals):
+            result = result + f"{network.get_station_name(station)} Station:\n{render_station_arrivals(network, station, bus_arrival_data)}{'=' * 20}\n\n"
+        return result
+    return await executor.run_blocking(render)
     
+async def search_stations(query: str, k: int = 5) -> list:
+    # Finds stations by (roughly) their name or road. Returns up to k (code, name, road name, score) tuples, best first.
+    network = await static_network.ensure_network()
+    return network.search_index.search(query, k)
+
 def display_multiple_station_names(station_list):
     result = f"Here are your favorite stations: \n\n{'=' * 20}\n\n"
     for station in station_list:
         result = result + f"- {utils.get_station_name(station)} Station (Code: {station})\n"
     return result
 
+# The brute force way of finding the nearest stations. query_nearest_bus_stations uses the spatial index instead,
+# but this is kept around as the reference to check (and benchmark) it against.
 def get_closest_bus_stations(lat: float, long: float, bus_station_list: dict, k: int = 3):
     tups = []
     caller_location = (lat, long)
@@ -124,21 +129,29 @@ def get_closest_bus_stations(lat: float, long: float, bus_station_list: dict, k:
     # Sorts the tuples by the distance and returns the k nearest neighbors.
     return sorted(tups, key = lambda x: x[2])[0:k]
 
-def query_nearest_bus_stations(lat: float, long: float) -> dict:
-    bus_station_dict = {}
-    try:
-        bus_station_dict = utils.load_from_storage_bus_stations()
-    except FileNotFoundError as e:
-        interface.refresh_static_data()
-        bus_station_dict = utils.load_from_storage_bus_stations()
-    finally:
-        closest_neighbors = get_closest_bus_stations(lat, long, bus_station_dict["bus_stops"])
-        return closest_neighbors
-
-def display_nearest_bus_stations(lat: float, long: float):
-    closest_neighbors = query_nearest_bus_stations(lat, long)
-    result = f"Here is the arrival info of the nearest bus stations to you: \n\n{'=' * 20}\n\n"
-    for neighbor_code, neighbor_name, dist in closest_neighbors:
-        result = result + f"{neighbor_name} Station ({round(dist)}m away):\n{display_arrivals(neighbor_code, '-1')}{'=' * 20}\n\n"
+async def query_nearest_bus_stations(lat: float, long: float, k: int = 3, radius: float = None, bus: str = None) -> list:
+    # Returns up to k (code, name, distance) tuples, nearest first. If radius (in metres) is given, we don't look any further than that.
+    # If bus is given, we only look at the stations that bus actually stops at.
+    network = await static_network.ensure_network()
+    if bus is not None: return network.nearest_served_by(bus, lat, long, k, radius)
+    return network.spatial_index.nearest(lat, long, k, radius)
 
-    return result
+async def display_nearest_bus_stations(lat: float, long: float, bus: str = None):
+    network = await static_network.ensure_network()
+    closest_neighbors = await query_nearest_bus_stations(lat, long, bus = bus)
+    if not closest_neighbors:
+        if bus is None: return "Sorry, I couldn't find any bus stations near you :<"
+        return f"Sorry, I couldn't find any bus stations that bus {bus} stops at :<"
+    # Only the stations we're actually going to show get fetched, all at once.
+    arrivals = await query_arrivals_batch([neighbor_code for neighbor_code, neighbor_name, dist in closest_neighbors])
+
+    def render() -> str:
+        if bus is None:
+            result = f"Here is the arrival info of the nearest bus stations to you: \n\n{'=' * 20}\n\n"
+        else:
+            result = f"Here is the arrival info of bus {bus} at the nearest bus stations it stops at: \n\n{'=' * 20}\n\n"
+        for (neighbor_code, neighbor_name, dist), bus_arrival_data in zip(closest_neighbors, arrivals):
+            rendered = render_station_arrivals(network, neighbor_code, bus_arrival_data, bus or "-1")
+            result = result + f"{neighbor_name} Station ({round(dist)}m away):\n{rendered}{'=' * 20}\n\n"
+        return result
+    return await executor.run_blocking(render)
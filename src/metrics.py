@@ -0,0 +1,194 @@
+from aiohttp import web
+import contextlib
+import functools
+import threading
+import inspect
+import asyncio
+import bisect
+import time
+
+# Latency histograms and counters for each stage of answering a request (DataMall calls, cache lookups, rendering, SQLite, Telegram...)
+# Usage:
+#     @metrics.timed("render")                      on a function (sync or async), or
+#     with metrics.timer("cache_lookup"): ...       around a block, and
+#     metrics.count("arrival_fetch_errors")         for anything worth counting.
+# Everything is off until enable() is called, and while it's off all of the above cost one boolean check.
+# The numbers can be scraped Prometheus-style (serve()) or printed every so often (log_loop()).
+
+# Upper bounds of the histogram buckets, in seconds. Everything slower ends up in the last (+Inf) bucket.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = "wheremybus"
+
+enabled = False
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        # Stages like SQLite get timed from other threads.
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # An estimate: the upper bound of the bucket the q-th observation falls in.
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= target: return bound
+        return float("inf")
+
+histograms = {}
+counters = {}
+_registry_lock = threading.Lock()
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with _registry_lock:
+        histograms.clear()
+        counters.clear()
+
+def observe(stage: str, seconds: float):
+    if not enabled: return
+    histogram = histograms.get(stage)
+    if histogram is None:
+        with _registry_lock:
+            histogram = histograms.setdefault(stage, Histogram())
+    histogram.observe(seconds)
+
+def count(name: str, n: int = 1):
+    if not enabled: return
+    with _registry_lock:
+        counters[name] = counters.get(name, 0) + n
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.stage, time.perf_counter() - self.start)
+        if exc_type is not None: count(f"{self.stage}_errors")
+        return False
+
+class _NullTimer:
+    # What timer() hands out while metrics are off, so that we don't even allocate anything.
+    __slots__ = ()
+
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb): return False
+
+NULL_TIMER = _NullTimer()
+
+def timer(stage: str):
+    return _Timer(stage) if enabled else NULL_TIMER
+
+def timed(stage: str):
+    # Decorator version of timer(). Works on both plain functions and coroutine functions.
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not enabled: return await fn(*args, **kwargs)
+                with _Timer(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled: return fn(*args, **kwargs)
+            with _Timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class StartupTimer:
+    # How long each step of starting up took, for the breakdown we print once we're ready to serve.
+    # Each step also goes into the startup_<step> histogram, if metrics are on by then.
+    def __init__(self, started: float = None):
+        self.started = time.perf_counter() if started is None else started
+        self.steps = []
+
+    def record(self, step: str, seconds: float):
+        self.steps.append((step, seconds))
+        observe(f"startup_{step}", seconds)
+
+    @contextlib.contextmanager
+    def step(self, step: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(step, time.perf_counter() - start)
+
+    def summary(self) -> str:
+        total = time.perf_counter() - self.started
+        steps = ", ".join(f"{step} {seconds:.2f}s" for step, seconds in self.steps)
+        return f"Ready to serve in {total:.2f}s ({steps}, other {total - sum(seconds for step, seconds in self.steps):.2f}s)"
+
+def render_prometheus() -> str:
+    # The Prometheus text exposition format.
+    lines = [f"# TYPE {METRIC_PREFIX}_stage_seconds histogram"]
+    for stage, histogram in sorted(histograms.items()):
+        with histogram.lock:
+            counts, total, n = list(histogram.counts), histogram.sum, histogram.count
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {n}')
+    for name, value in sorted(counters.items()):
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+        lines.append(f"{METRIC_PREFIX}_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+def summary() -> str:
+    # A human-readable one-line-per-stage version, for the logs.
+    lines = []
+    for stage, histogram in sorted(histograms.items()):
+        if not histogram.count: continue
+        lines.append(f"  {stage}: {histogram.count} calls, mean {histogram.sum / histogram.count * 1000:.1f}ms, "
+                        f"p50 <= {histogram.quantile(0.5) * 1000:g}ms, p99 <= {histogram.quantile(0.99) * 1000:g}ms")
+    lines.extend(f"  {name}: {value}" for name, value in sorted(counters.items()))
+    return "Metrics:\n" + "\n".join(lines) if lines else "Metrics: nothing recorded yet"
+
+async def log_loop(interval: float = 600.0):
+    while True:
+        await asyncio.sleep(interval)
+        print(summary())
+
+async def serve(port: int, host: str = "127.0.0.1"):
+    # Serves render_prometheus() at http://host:port/metrics until cancelled.
+    async def handle(request):
+        return web.Response(text = render_prometheus(), content_type = "text/plain")
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
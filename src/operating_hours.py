@@ -0,0 +1,99 @@
+import functools
+import datetime
+import numpy as np
+
+# A precompiled table of when each service runs at each station, for "is this bus running right now?" checks.
+# DataMall gives us "HHMM" strings (or dashes, whenever it feels like it) for each day type.
+# We turn those into integer minute ranges ONCE per refresh, so that the check itself is just a few comparisons.
+
+# LTA splits the week into weekdays, saturdays, and sundays. Same order as the second axis of OperatingHoursTable.minutes.
+DAY_TYPES = ("WD", "SAT", "SUN")
+MINUTES_PER_DAY = 24 * 60
+# What a service that doesn't run at all gets. Nothing is ever between -1 and -1.
+NOT_OPERATING = (-1, -1)
+
+def day_type_index(weekday: int) -> int:
+    # According to ISO 8601, 1 is a Monday, 2 is a Tuesday, and so on until 7, which is a Sunday.
+    if weekday == 6: return 1
+    if weekday == 7: return 2
+    return 0
+
+# There are only so many distinct bus timings, and we compile ~80k of them per load, so remember the answers.
+@functools.lru_cache(maxsize = 16384)
+def compile_range(first_bus: str, last_bus: str) -> tuple:
+    # Turns DataMall's ("HHMM", "HHMM") into minutes after midnight.
+    # Services that run past midnight get a last bus of more than 1440 minutes, e.g. 0600 to 0030 becomes (360, 1470).
+    try:
+        first = int(first_bus[:2]) * 60 + int(first_bus[2:])
+        last = int(last_bus[:2]) * 60 + int(last_bus[2:])
+    except (ValueError, TypeError):
+        return NOT_OPERATING
+    if last < first: last += MINUTES_PER_DAY
+    return first, last
+
+class OperatingHoursTable:
+    def __init__(self, operation_times: dict):
+        # operation_times is BusStopCode -> ServiceNo -> BusRoutes row, like in bus_operation_info.json.
+        # Every (station, service) pair is one row of `minutes`, and each station's services are one contiguous run of rows.
+        self.slices = {}
+        self.services = []
+        ranges = []
+        for station_code, services in operation_times.items():
+            start = len(self.services)
+            for service_no, svc in services.items():
+                self.services.append(service_no)
+                ranges.append([compile_range(svc[f"{day_type}_FirstBus"], svc[f"{day_type}_LastBus"]) for day_type in DAY_TYPES])
+            self.slices[station_code] = (start, len(self.services))
+        # Shape: (station/service pair, day type, first/last). Minutes never go past 2 * 1440, so int16 does the job.
+        self.minutes = np.array(ranges, dtype = np.int16).reshape(-1, len(DAY_TYPES), 2)
+
+    def with_stations(self, changed_services: dict, compact_threshold: float = 0.25):
+        # Returns a copy of the table with the given stations' services replaced.
+        # changed_services is BusStopCode -> ServiceNo -> BusRoutes row, just like the constructor takes. An empty dict removes the station.
+        # The new rows go on the end, and the old ones are just forgotten about until they make up enough of the table to be worth compacting.
+        table = OperatingHoursTable.__new__(OperatingHoursTable)
+        table.slices = dict(self.slices)
+        table.services = list(self.services)
+        ranges = []
+        for station_code, services in changed_services.items():
+            start = len(table.services)
+            for service_no, svc in services.items():
+                table.services.append(service_no)
+                ranges.append([compile_range(svc[f"{day_type}_FirstBus"], svc[f"{day_type}_LastBus"]) for day_type in DAY_TYPES])
+            table.slices[station_code] = (start, len(table.services))
+        table.minutes = np.concatenate([self.minutes, np.array(ranges, dtype = np.int16).reshape(-1, len(DAY_TYPES), 2)])
+
+        live_rows = sum(end - start for start, end in table.slices.values())
+        if live_rows < len(table.services) * (1 - compact_threshold): table._compact()
+        return table
+
+    def _compact(self):
+        # Drops the rows that no station points at any more. Only ever called on a table nobody else has seen yet.
+        slices = {}
+        keep = []
+        for station_code, (start, end) in self.slices.items():
+            slices[station_code] = (len(keep), len(keep) + end - start)
+            keep.extend(range(start, end))
+        keep = np.array(keep, dtype = np.int64)
+        self.minutes = self.minutes[keep].reshape(-1, len(DAY_TYPES), 2)
+        self.services = [self.services[i] for i in keep.tolist()]
+        self.slices = slices
+
+    def running_mask(self, station_code: str, when: datetime.datetime):
+        # Returns (services at the station, boolean array of whether each one is running at `when`).
+        start, end = self.slices.get(station_code, (0, 0))
+        rows = self.minutes[start:end]
+        minute = when.hour * 60 + when.minute
+        today = day_type_index(when.isoweekday())
+        yesterday = day_type_index((when.isoweekday() - 2) % 7 + 1)
+        # Either it's running on today's schedule, or it's after midnight and yesterday's last bus hasn't come yet.
+        running_today = (rows[:, today, 0] < minute) & (minute < rows[:, today, 1])
+        running_overnight = (rows[:, yesterday, 0] < minute + MINUTES_PER_DAY) & (minute + MINUTES_PER_DAY < rows[:, yesterday, 1])
+        return self.services[start:end], running_today | running_overnight
+
+    def running_services(self, station_code: str, when: datetime.datetime) -> frozenset:
+        services, mask = self.running_mask(station_code, when)
+        return frozenset(service_no for service_no, running in zip(services, mask.tolist()) if running)
+
+    def is_running(self, station_code: str, service_no: str, when: datetime.datetime) -> bool:
+        return service_no in self.running_services(station_code, when)
@@ -0,0 +1,79 @@
+import collections
+import hashlib
+import time
+
+# Remembers what we last sent for each message with a "Refresh" button, so that refreshing can edit the message in place,
+# skip Telegram entirely when nothing changed, and ignore people mashing the button.
+# Long replies get split over several messages (and only the last one has the button), so each record keeps all of their IDs.
+
+def part_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size = 16).hexdigest()
+
+class RefreshRecord:
+    __slots__ = ("message_ids", "digests", "refreshed_at")
+
+    def __init__(self, message_ids: list, digests: list, refreshed_at: float):
+        # The IDs of every part of the reply, in order. The last one is the one with the button.
+        self.message_ids = message_ids
+        self.digests = digests
+        self.refreshed_at = refreshed_at
+
+class RefreshTracker:
+    def __init__(self, debounce: float = 3.0, max_messages: int = 10000, clock = time.monotonic):
+        # Refreshing faster than the arrival cache's TTL just gets the same answer anyway.
+        self.debounce = debounce
+        self.max_messages = max_messages
+        self.clock = clock
+        # (chat ID, ID of the message with the button) -> RefreshRecord. Least recently refreshed first.
+        self.records = collections.OrderedDict()
+        # When each message was last tapped, even the ones we don't have a record for.
+        self.last_tap = collections.OrderedDict()
+        self.debounced = 0
+        self.unchanged = 0
+        self.edited_parts = 0
+        self.skipped_parts = 0
+
+    def _trim(self, entries: collections.OrderedDict):
+        while len(entries) > self.max_messages: entries.popitem(last = False)
+
+    def remember(self, chat_id: int, message_ids: list, parts: list):
+        # Call this after sending (or editing) a reply with a refresh button on its last part.
+        key = (chat_id, message_ids[-1])
+        self.records[key] = RefreshRecord(list(message_ids), [part_digest(part) for part in parts], self.clock())
+        self.records.move_to_end(key)
+        self._trim(self.records)
+
+    def tap(self, chat_id: int, message_id: int) -> bool:
+        # Call this when the button gets tapped. Returns False if it was tapped too recently to bother refreshing again.
+        key = (chat_id, message_id)
+        now = self.clock()
+        last = self.last_tap.get(key)
+        if last is not None and now - last < self.debounce:
+            self.debounced += 1
+            return False
+        self.last_tap[key] = now
+        self.last_tap.move_to_end(key)
+        self._trim(self.last_tap)
+        return True
+
+    def message_ids(self, chat_id: int, message_id: int) -> list:
+        # Every part of the reply the button belongs to. If we don't remember it (e.g. we restarted since), it's just that one message.
+        record = self.records.get((chat_id, message_id))
+        return list(record.message_ids) if record is not None else [message_id]
+
+    def changed_parts(self, chat_id: int, message_id: int, parts: list) -> list:
+        # The indices of the parts that differ from what we last sent. Everything, if we don't know what we last sent.
+        record = self.records.get((chat_id, message_id))
+        if record is None or len(record.digests) != len(parts): return list(range(len(parts)))
+        changed = [i for i, part in enumerate(parts) if part_digest(part) != record.digests[i]]
+        if not changed: self.unchanged += 1
+        self.edited_parts += len(changed)
+        self.skipped_parts += len(parts) - len(changed)
+        return changed
+
+    def forget(self, chat_id: int, message_id: int):
+        self.records.pop((chat_id, message_id), None)
+
+    def stats(self) -> dict:
+        return {"tracked_messages": len(self.records), "debounced": self.debounced, "unchanged": self.unchanged,
+                "edited_parts": self.edited_parts, "skipped_parts": self.skipped_parts}
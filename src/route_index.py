@@ -0,0 +1,118 @@
+import numpy as np
+
+# The order in which each service visits its stops, for route-aware questions like
+# "which stops does service X serve?", "which buses go from stop A to stop B?" and "how far is that along the route?".
+# BusRoutes gives us every (service, direction, stop sequence) row; we keep them as flat arrays, one contiguous run per route,
+# plus an inverted index from each station to every place it shows up in those runs.
+
+class RouteIndexBuilder:
+    # Collects BusRoutes rows as they stream in, then sorts them into a RouteIndex.
+    def __init__(self):
+        self.routes = {}
+
+    def add_rows(self, rows: list):
+        for row in rows:
+            distance = row.get("Distance")
+            self.routes.setdefault((row["ServiceNo"], int(row["Direction"])), []).append(
+                (int(row["StopSequence"]), row["BusStopCode"], float("nan") if distance is None else float(distance)))
+
+    def build(self):
+        services, directions, route_start, stop_stations, stop_distances = [], [], [0], [], []
+        for (service_no, direction), stops in sorted(self.routes.items()):
+            stops.sort()
+            services.append(service_no)
+            directions.append(direction)
+            stop_stations.extend(station for sequence, station, distance in stops)
+            stop_distances.extend(distance for sequence, station, distance in stops)
+            route_start.append(len(stop_stations))
+        return RouteIndex(services, directions, route_start, stop_stations, stop_distances)
+
+class RouteIndex:
+    def __init__(self, services: list, directions, route_start, stop_stations: list, stop_distances):
+        # Route r is (services[r], directions[r]), and its stops are stop_stations[route_start[r]:route_start[r + 1]], in order.
+        self.services = list(services)
+        self.directions = np.asarray(directions, dtype = np.uint8)
+        self.route_start = np.asarray(route_start, dtype = np.int64)
+        self.station_codes = sorted(set(stop_stations))
+        self.station_ids = {code: i for i, code in enumerate(self.station_codes)}
+        self.stop_station = np.array([self.station_ids[code] for code in stop_stations], dtype = np.int32)
+        # Kilometres from the start of the route, as LTA measures it.
+        self.stop_distance = np.asarray(stop_distances, dtype = np.float32)
+        # Which route each stop belongs to.
+        self.stop_route = np.repeat(np.arange(len(self.services), dtype = np.int32), np.diff(self.route_start))
+
+        self.routes_by_service = {}
+        for route, service_no in enumerate(self.services):
+            self.routes_by_service.setdefault(service_no, []).append(route)
+
+        # Inverted index: the positions of station s are station_positions[station_start[s]:station_start[s + 1]].
+        self.station_positions = np.argsort(self.stop_station, kind = "stable").astype(np.int64)
+        self.station_start = np.searchsorted(self.stop_station[self.station_positions], np.arange(len(self.station_codes) + 1))
+
+    def __len__(self):
+        return len(self.services)
+
+    def to_columns(self) -> tuple:
+        # The same arguments the constructor takes, e.g. for writing to a snapshot.
+        return (self.services, self.directions, self.route_start,
+                [self.station_codes[i] for i in self.stop_station.tolist()], self.stop_distance)
+
+    def _positions(self, station_code: str) -> np.ndarray:
+        station_id = self.station_ids.get(station_code)
+        if station_id is None: return self.station_positions[:0]
+        return self.station_positions[self.station_start[station_id]:self.station_start[station_id + 1]]
+
+    def _route(self, service_no: str, direction: int):
+        for route in self.routes_by_service.get(service_no, ()):
+            if self.directions[route] == direction: return route
+        return None
+
+    def directions_of(self, service_no: str) -> list:
+        return [int(self.directions[route]) for route in self.routes_by_service.get(service_no, ())]
+
+    def stops_served(self, service_no: str, direction: int = None) -> list:
+        # Every stop the service makes, in order. Both directions one after the other, unless you pick one.
+        routes = self.routes_by_service.get(service_no, ())
+        if direction is not None: routes = [route for route in routes if self.directions[route] == direction]
+        stops = []
+        for route in routes:
+            stops.extend(self.station_codes[i] for i in self.stop_station[self.route_start[route]:self.route_start[route + 1]].tolist())
+        return stops
+
+    def station_ids_of(self, service_no: str) -> np.ndarray:
+        # The ids (into station_codes) of every stop the service makes, in both directions. Loops and there-and-back routes repeat some.
+        routes = self.routes_by_service.get(service_no, ())
+        if not routes: return self.stop_station[:0]
+        return np.concatenate([self.stop_station[self.route_start[route]:self.route_start[route + 1]] for route in routes])
+
+    def services_at(self, station_code: str) -> set:
+        return {self.services[route] for route in self.stop_route[self._positions(station_code)].tolist()}
+
+    def services_between(self, from_station: str, to_station: str) -> list:
+        # Every service that goes from one stop to the other (in that order), as (service, direction, km, number of stops) tuples.
+        # Shortest ride first. Loop services can visit a stop twice, in which case we take the shortest way.
+        from_positions, to_positions = self._positions(from_station), self._positions(to_station)
+        if not len(from_positions) or not len(to_positions): return []
+        # Every pair of (from, to) positions at once. Both lists are tiny, so this is cheap.
+        same_route = self.stop_route[from_positions][:, None] == self.stop_route[to_positions][None, :]
+        forwards = to_positions[None, :] > from_positions[:, None]
+        i, j = np.nonzero(same_route & forwards)
+
+        best = {}
+        for start, end in zip(from_positions[i].tolist(), to_positions[j].tolist()):
+            route = int(self.stop_route[start])
+            n_stops = end - start
+            if route not in best or n_stops < best[route][1]:
+                best[route] = (float(self.stop_distance[end] - self.stop_distance[start]), n_stops)
+        results = [(self.services[route], int(self.directions[route]), distance, n_stops) for route, (distance, n_stops) in best.items()]
+        return sorted(results, key = lambda result: (result[3] if np.isnan(result[2]) else result[2], result[0]))
+
+    def distance_along_route(self, service_no: str, direction: int, from_station: str, to_station: str):
+        # Kilometres between two stops along one route, or None if the route doesn't go from one to the other.
+        route = self._route(service_no, direction)
+        if route is None: return None
+        for service, route_direction, distance, n_stops in self.services_between(from_station, to_station):
+            if service == service_no and route_direction == direction: return distance
+        return None
+
+EMPTY_ROUTE_INDEX = RouteIndex([], [], [0], [], [])
@@ -1,6 +1,6 @@
 from telebot import asyncio_filters
 from telebot.async_telebot import AsyncTeleBot
-from telebot.asyncio_storage import StateMemoryStorage
+from src.shared_cache import LocalCache, SQLiteCache, SharedStateStorage
 import dotenv
 import os
 import datetime
@@ -10,8 +10,26 @@ import datetime
 dotenv.load_dotenv()
 BOT_TOKEN = os.getenv("BOT_API_TOKEN")
 LTA_TOKEN = os.getenv("LTA_API_TOKEN")
+# Set METRICS=1 to record per-stage timings (see src/metrics.py). They get logged every METRICS_LOG_INTERVAL seconds,
+# and if METRICS_PORT is set, served Prometheus-style at http://127.0.0.1:<METRICS_PORT>/metrics as well.
+METRICS_ENABLED = os.getenv("METRICS") == "1"
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "600"))
+# Set WEBHOOK_URL (the public HTTPS address that forwards to http://WEBHOOK_HOST:WEBHOOK_PORT/telegram) to have Telegram push updates
+# to us instead of us long polling for them (see src/webhook_server.py). WEBHOOK_SECRET makes sure they really are from Telegram.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+# Set ARRIVAL_HISTORY_PATH to a directory to keep a log of every arrival response we fetch (see src/arrival_history.py).
+ARRIVAL_HISTORY_PATH = os.getenv("ARRIVAL_HISTORY_PATH")
+# To run several workers side by side, point SHARED_CACHE_PATH at a SQLite file they all can reach (see src/shared_cache.py).
+# They'll share arrival data and everyone's dialogue state through it. Otherwise all of that just lives in this process.
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH")
 storage_path = f"{os.path.dirname(__file__)}/../storage/"
-bot = AsyncTeleBot(BOT_TOKEN, state_storage = StateMemoryStorage())
+shared_cache = SQLiteCache(SHARED_CACHE_PATH) if SHARED_CACHE_PATH else LocalCache()
+bot = AsyncTeleBot(BOT_TOKEN, state_storage = SharedStateStorage(shared_cache))
 bot.add_custom_filter(asyncio_filters.StateFilter(bot))
 
 sg_timezone = datetime.timezone(datetime.timedelta(hours = 8.0))
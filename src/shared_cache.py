@@ -0,0 +1,208 @@
+from telebot.asyncio_storage.base_storage import StateStorageBase, StateDataContext
+from src import metrics
+import concurrent.futures
+import sqlite3
+import asyncio
+import socket
+import json
+import time
+import os
+
+# Somewhere to keep state that every copy of the bot can see, so that we can run more than one of them.
+# A backend is a key -> string store where entries can expire, plus "leases": a key that only one owner can hold at a time
+# (until they release it, or it expires because they died holding it). Two of them:
+# - LocalCache keeps everything in this process. The default, and all you need with a single worker.
+# - SQLiteCache keeps everything in a SQLite file that every worker on the machine opens.
+# Both are used through the same async methods, so nothing else needs to know which one it got.
+# Timestamps are wall-clock (time.time()), since monotonic clocks don't mean anything to other processes.
+
+# Identifies this process when it holds a lease.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+class LocalCache:
+    # Whether other processes can see what we put in here.
+    shared = False
+
+    def __init__(self, clock = time.time):
+        self.clock = clock
+        # Key -> (value, when it expires, or None if it doesn't)
+        self.entries = {}
+
+    async def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None: return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= self.clock():
+            del self.entries[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        self.entries[key] = (value, None if ttl is None else self.clock() + ttl)
+
+    async def delete(self, key: str):
+        self.entries.pop(key, None)
+
+    async def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        # Takes the lease if nobody (else) holds it. Holding it already just extends it.
+        holder = await self.get(key)
+        if holder is not None and holder != owner: return False
+        await self.set(key, owner, ttl)
+        return True
+
+    async def release_lease(self, key: str, owner: str):
+        if await self.get(key) == owner: await self.delete(key)
+
+    def close(self):
+        pass
+
+SELECT_ENTRY = "SELECT value FROM shared_cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)"
+UPSERT_ENTRY = "INSERT OR REPLACE INTO shared_cache (key, value, expires_at) VALUES (?, ?, ?)"
+DELETE_ENTRY = "DELETE FROM shared_cache WHERE key = ?"
+# Only overwrites the lease if it has expired or we're the ones holding it, so exactly one worker gets a row changed.
+ACQUIRE_LEASE = '''INSERT INTO shared_cache (key, value, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+                    WHERE shared_cache.expires_at <= ? OR shared_cache.value = excluded.value'''
+RELEASE_LEASE = "DELETE FROM shared_cache WHERE key = ? AND value = ?"
+PURGE_EXPIRED = "DELETE FROM shared_cache WHERE expires_at <= ?"
+
+class SQLiteCache:
+    shared = True
+
+    def __init__(self, path: str, clock = time.time, purge_every: int = 1000):
+        self.path = path
+        self.clock = clock
+        # Expired entries are cleared out every purge_every writes, instead of on every read.
+        self.purge_every = purge_every
+        self.writes = 0
+        self._db = None
+        # Like favorites_db, all the SQLite work happens on one thread of our own, so the event loop never waits on the disk.
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "shared_cache")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is not None: return self._db
+        db = sqlite3.connect(self.path, check_same_thread = False, isolation_level = None, cached_statements = 16)
+        # Other workers hold the write lock now and then. Wait for them instead of erroring out.
+        db.execute("PRAGMA busy_timeout = 5000")
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.execute('''CREATE TABLE IF NOT EXISTS shared_cache (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL,
+                        expires_at REAL
+                    ) WITHOUT ROWID''')
+        self._db = db
+        return db
+
+    async def _run(self, fn, *args):
+        def run():
+            with metrics.timer(f"shared_cache{fn.__name__}"):
+                return fn(self._connect(), *args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+    def _get(self, db: sqlite3.Connection, key: str):
+        row = db.execute(SELECT_ENTRY, (key, self.clock())).fetchone()
+        return row[0] if row is not None else None
+
+    def _set(self, db: sqlite3.Connection, key: str, value: str, ttl: float):
+        db.execute(UPSERT_ENTRY, (key, value, None if ttl is None else self.clock() + ttl))
+        self.writes += 1
+        if self.writes % self.purge_every == 0: db.execute(PURGE_EXPIRED, (self.clock(),))
+
+    def _delete(self, db: sqlite3.Connection, key: str):
+        db.execute(DELETE_ENTRY, (key,))
+
+    def _acquire_lease(self, db: sqlite3.Connection, key: str, owner: str, ttl: float) -> bool:
+        now = self.clock()
+        return db.execute(ACQUIRE_LEASE, (key, owner, now + ttl, now)).rowcount == 1
+
+    def _release_lease(self, db: sqlite3.Connection, key: str, owner: str):
+        db.execute(RELEASE_LEASE, (key, owner))
+
+    async def get(self, key: str):
+        return await self._run(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        await self._run(self._set, key, value, ttl)
+
+    async def delete(self, key: str):
+        await self._run(self._delete, key)
+
+    async def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        return await self._run(self._acquire_lease, key, owner, ttl)
+
+    async def release_lease(self, key: str, owner: str):
+        await self._run(self._release_lease, key, owner)
+
+    def close(self):
+        self._executor.shutdown(wait = True)
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+class SharedStateStorage(StateStorageBase):
+    # Keeps telebot's per-user dialogue states (and the data that goes with them) in a backend above,
+    # so that a user can start a conversation with one worker and finish it with another.
+    # Works the same as telebot's StateMemoryStorage otherwise.
+
+    def __init__(self, cache, ttl: float = 86400.0, prefix: str = "telebot", separator: str = ":"):
+        self.cache = cache
+        # Conversations people walk away from get forgotten eventually.
+        self.ttl = ttl
+        self.prefix = prefix
+        self.separator = separator
+
+    def _key(self, chat_id, user_id, business_connection_id = None, message_thread_id = None, bot_id = None) -> str:
+        return self._get_key(chat_id, user_id, self.prefix, self.separator, business_connection_id, message_thread_id, bot_id)
+
+    async def _load(self, key: str):
+        record = await self.cache.get(key)
+        return json.loads(record) if record is not None else None
+
+    async def _store(self, key: str, record: dict):
+        await self.cache.set(key, json.dumps(record), self.ttl)
+
+    async def set_state(self, chat_id, user_id, state, business_connection_id = None, message_thread_id = None, bot_id = None) -> bool:
+        if hasattr(state, "name"): state = state.name
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = await self._load(key) or {"state": state, "data": {}}
+        record["state"] = state
+        await self._store(key, record)
+        return True
+
+    async def get_state(self, chat_id, user_id, business_connection_id = None, message_thread_id = None, bot_id = None):
+        record = await self._load(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+        return record["state"] if record is not None else None
+
+    async def delete_state(self, chat_id, user_id, business_connection_id = None, message_thread_id = None, bot_id = None) -> bool:
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        if await self.cache.get(key) is None: return False
+        await self.cache.delete(key)
+        return True
+
+    async def set_data(self, chat_id, user_id, key, value, business_connection_id = None, message_thread_id = None, bot_id = None) -> bool:
+        state_key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = await self._load(state_key)
+        if record is None: raise RuntimeError(f"SharedStateStorage: key {state_key} does not exist.")
+        record["data"][key] = value
+        await self._store(state_key, record)
+        return True
+
+    async def get_data(self, chat_id, user_id, business_connection_id = None, message_thread_id = None, bot_id = None) -> dict:
+        record = await self._load(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+        return record["data"] if record is not None else {}
+
+    async def reset_data(self, chat_id, user_id, business_connection_id = None, message_thread_id = None, bot_id = None) -> bool:
+        return await self.save(chat_id, user_id, {}, business_connection_id, message_thread_id, bot_id)
+
+    def get_interactive_data(self, chat_id, user_id, business_connection_id = None, message_thread_id = None, bot_id = None):
+        return StateDataContext(self, chat_id = chat_id, user_id = user_id, business_connection_id = business_connection_id,
+                                message_thread_id = message_thread_id, bot_id = bot_id)
+
+    async def save(self, chat_id, user_id, data, business_connection_id = None, message_thread_id = None, bot_id = None) -> bool:
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = await self._load(key)
+        if record is None: return False
+        record["data"] = data
+        await self._store(key, record)
+        return True
@@ -0,0 +1,111 @@
+import numpy as np
+
+# A grid-bucketed spatial index over the bus stations, for "which stations are near me?" queries.
+# Instead of running haversine over all ~5000 stations and sorting the lot, we only look at the grid cells around the caller,
+# do the distance math on NumPy arrays, and only partially sort what we need.
+
+# Same mean earth radius that the haversine package uses, so that the distances match up.
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = EARTH_RADIUS_M * np.pi / 180
+
+def haversine_m(lat: float, long: float, lats: np.ndarray, longs: np.ndarray) -> np.ndarray:
+    # Vectorized haversine distance (in metres) from one point to many.
+    lat_rad, long_rad = np.radians(lat), np.radians(long)
+    lats_rad, longs_rad = np.radians(lats), np.radians(longs)
+    a = np.sin((lats_rad - lat_rad) / 2) ** 2 + np.cos(lat_rad) * np.cos(lats_rad) * np.sin((longs_rad - long_rad) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+class StationSpatialIndex:
+    def __init__(self, bus_stops, cell_size_m: float = 500.0):
+        bus_stops = list(bus_stops)
+        self.codes = [stop["BusStopCode"] for stop in bus_stops]
+        self.names = [stop["Description"] for stop in bus_stops]
+        # BusStopCode -> where that station is in the arrays, for narrowing queries down to a subset of stations.
+        self.positions = {code: i for i, code in enumerate(self.codes)}
+        self.lats = np.array([stop["Latitude"] for stop in bus_stops], dtype = np.float64)
+        self.longs = np.array([stop["Longitude"] for stop in bus_stops], dtype = np.float64)
+
+        if not len(bus_stops):
+            self.lat0 = self.long0 = 0.0
+            self.cell_lat = self.cell_long = 1.0
+            self.n_rows = self.n_cols = 1
+            self.order = np.zeros(0, dtype = np.int64)
+            self.cell_start = np.zeros(2, dtype = np.int64)
+            return
+
+        # Size the cells so that they are at least cell_size_m across everywhere in the dataset.
+        max_abs_lat = float(np.max(np.abs(self.lats)))
+        self.lat0, self.long0 = float(self.lats.min()), float(self.longs.min())
+        self.cell_lat = cell_size_m / METERS_PER_DEGREE
+        self.cell_long = cell_size_m / (METERS_PER_DEGREE * max(np.cos(np.radians(max_abs_lat)), 1e-6))
+        rows = ((self.lats - self.lat0) / self.cell_lat).astype(np.int64)
+        cols = ((self.longs - self.long0) / self.cell_long).astype(np.int64)
+        self.n_rows, self.n_cols = int(rows.max()) + 1, int(cols.max()) + 1
+
+        # CSR-style layout: the stations of cell c are order[cell_start[c]:cell_start[c + 1]].
+        # Since cells are numbered row by row, a run of columns in one row is one contiguous slice.
+        cell_ids = rows * self.n_cols + cols
+        self.order = np.argsort(cell_ids, kind = "stable")
+        self.cell_start = np.searchsorted(cell_ids[self.order], np.arange(self.n_rows * self.n_cols + 1))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _candidates(self, lat: float, long: float, radius_m: float) -> np.ndarray:
+        # Every station within radius_m of (lat, long) is guaranteed to be in here. Some further ones might be too.
+        d_lat = radius_m / METERS_PER_DEGREE
+        cos_lat = max(np.cos(np.radians(min(abs(lat) + d_lat, 90.0))), 1e-6)
+        d_long = radius_m / (METERS_PER_DEGREE * cos_lat)
+
+        row_lo = max(int(np.floor((lat - d_lat - self.lat0) / self.cell_lat)), 0)
+        row_hi = min(int(np.floor((lat + d_lat - self.lat0) / self.cell_lat)), self.n_rows - 1)
+        col_lo = max(int(np.floor((long - d_long - self.long0) / self.cell_long)), 0)
+        col_hi = min(int(np.floor((long + d_long - self.long0) / self.cell_long)), self.n_cols - 1)
+        if row_lo > row_hi or col_lo > col_hi: return self.order[:0]
+
+        slices = [self.order[self.cell_start[row * self.n_cols + col_lo]:self.cell_start[row * self.n_cols + col_hi + 1]]
+                    for row in range(row_lo, row_hi + 1)]
+        return np.concatenate(slices)
+
+    def _select(self, idx: np.ndarray, dists: np.ndarray, k: int = None) -> list:
+        # Partial selection of the k smallest, and then we only sort those.
+        if k is not None and k < len(idx):
+            part = np.argpartition(dists, k - 1)[:k]
+            idx, dists = idx[part], dists[part]
+        ordering = np.argsort(dists, kind = "stable")
+        return [(self.codes[i], self.names[i], float(d)) for i, d in zip(idx[ordering], dists[ordering])]
+
+    def within(self, lat: float, long: float, radius_m: float) -> list:
+        # All stations within radius_m metres, nearest first.
+        idx = self._candidates(lat, long, radius_m)
+        dists = haversine_m(lat, long, self.lats[idx], self.longs[idx])
+        mask = dists <= radius_m
+        return self._select(idx[mask], dists[mask])
+
+    def nearest(self, lat: float, long: float, k: int = 3, radius_m: float = None) -> list:
+        # The k nearest stations as (code, name, distance in metres) tuples, optionally capped at radius_m metres.
+        if k <= 0 or not len(self.codes): return []
+        search_radius = self.cell_lat * METERS_PER_DEGREE
+        while True:
+            if radius_m is not None: search_radius = min(search_radius, radius_m)
+            idx = self._candidates(lat, long, search_radius)
+            dists = haversine_m(lat, long, self.lats[idx], self.longs[idx])
+            mask = dists <= search_radius
+            # Either we found enough stations inside the search circle (so nothing outside it can beat them),
+            # or we're not allowed to look any further.
+            if mask.sum() >= k or (radius_m is not None and search_radius >= radius_m) or len(idx) == len(self.codes):
+                if radius_m is None and mask.sum() < k:
+                    # We've run out of grid: everything is a candidate, so take the best of what's there.
+                    return self._select(idx, dists, k)
+                return self._select(idx[mask], dists[mask], k)
+            search_radius *= 2
+
+    def nearest_among(self, lat: float, long: float, idx: np.ndarray, k: int = 3, radius_m: float = None) -> list:
+        # Like nearest, but only considering the stations at positions idx (e.g. the ones a particular bus stops at).
+        # There are only ever a few hundred of those, so we skip the grid and just measure them all.
+        if k <= 0 or not len(idx): return []
+        dists = haversine_m(lat, long, self.lats[idx], self.longs[idx])
+        if radius_m is not None:
+            mask = dists <= radius_m
+            idx, dists = idx[mask], dists[mask]
+        return self._select(idx, dists, k)
@@ -0,0 +1,63 @@
+# Works out what actually changed in the bus network between two refreshes.
+# The network barely changes from one day to the next, so instead of rebuilding everything every night,
+# we figure out which stations and routes were added, removed or changed, and only touch those.
+
+# The BusStops fields we care about. If none of these change, neither does the station as far as we're concerned.
+STOP_FIELDS = ("Description", "RoadName", "Latitude", "Longitude")
+
+class StaticDiff:
+    __slots__ = ("added_stops", "removed_stops", "changed_stops", "added_routes", "removed_routes", "changed_routes")
+
+    def __init__(self):
+        # Station codes.
+        self.added_stops = set()
+        self.removed_stops = set()
+        self.changed_stops = set()
+        # (BusStopCode, ServiceNo) pairs.
+        self.added_routes = set()
+        self.removed_routes = set()
+        self.changed_routes = set()
+
+    def is_empty(self) -> bool:
+        return not (self.stops_changed() or self.routes_changed())
+
+    def stops_changed(self) -> bool:
+        return bool(self.added_stops or self.removed_stops or self.changed_stops)
+
+    def routes_changed(self) -> bool:
+        return bool(self.added_routes or self.removed_routes or self.changed_routes)
+
+    def affected_stations(self) -> set:
+        # Every station whose list of services (or their timings) is different now.
+        return {station for station, service in self.added_routes | self.removed_routes | self.changed_routes}
+
+    def summary(self) -> str:
+        if self.is_empty(): return "No changes to the bus network."
+        return f"Bus stops: +{len(self.added_stops)} -{len(self.removed_stops)} ~{len(self.changed_stops)}, " \
+                f"routes: +{len(self.added_routes)} -{len(self.removed_routes)} ~{len(self.changed_routes)}"
+
+def stop_key(stop: dict) -> tuple:
+    return tuple(stop.get(field) for field in STOP_FIELDS)
+
+def diff_static_data(old_stations: dict, old_operation_times: dict, new_stations: dict, new_operation_times: dict) -> StaticDiff:
+    # Stations are BusStopCode -> BusStops row, operation times are (BusStopCode, ServiceNo) -> timings tuple,
+    # i.e. the same shapes as StaticNetwork.stations and StaticNetwork.operation_times.
+    diff = StaticDiff()
+
+    for code, stop in new_stations.items():
+        old_stop = old_stations.get(code)
+        if old_stop is None:
+            diff.added_stops.add(code)
+        elif stop_key(old_stop) != stop_key(stop):
+            diff.changed_stops.add(code)
+    diff.removed_stops = old_stations.keys() - new_stations.keys()
+
+    for key, times in new_operation_times.items():
+        old_times = old_operation_times.get(key)
+        if old_times is None:
+            diff.added_routes.add(key)
+        elif old_times != times:
+            diff.changed_routes.add(key)
+    diff.removed_routes = old_operation_times.keys() - new_operation_times.keys()
+
+    return diff
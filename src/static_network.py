@@ -0,0 +1,174 @@
+from src.spatial_index import StationSpatialIndex
+from src.operating_hours import OperatingHoursTable
+from src.station_search import StationSearchIndex
+from src.route_index import RouteIndex, EMPTY_ROUTE_INDEX
+from src import static_snapshot, metrics
+import threading
+import numpy as np
+
+# This file holds a process-wide, in-memory copy of the "static" bus network data (bus stops and bus operation times).
+# We used to re-read and re-parse the JSON files on every single lookup, which adds up FAST when one reply touches dozens of services.
+# Now we load everything once, index it, and swap the whole thing out in one go whenever the data gets refreshed.
+
+# The fields of a BusRoutes row that we actually care about, in the order we store them.
+# A tuple of 6 strings is a LOT smaller than the dict DataMall gives us.
+OPERATION_FIELDS = ("WD_FirstBus", "WD_LastBus", "SAT_FirstBus", "SAT_LastBus", "SUN_FirstBus", "SUN_LastBus")
+
+class StaticNetwork:
+    # An immutable snapshot of the bus network. Never modify one in place: build a new one and swap it in instead.
+    __slots__ = ("stations", "operation_times", "services_by_station", "spatial_index", "search_index", "operating_hours", "route_index",
+                    "route_positions", "stations_by_service", "last_updated")
+
+    def __init__(self, bus_stops: list, operation_times: dict, last_updated: str = None, route_index: RouteIndex = None):
+        # BusStopCode -> the BusStops row for that station.
+        self.stations = {stop["BusStopCode"]: stop for stop in bus_stops}
+        # (BusStopCode, ServiceNo) -> the operation times, laid out as in OPERATION_FIELDS.
+        self.operation_times = {}
+        # BusStopCode -> all the services that stop there.
+        self.services_by_station = {}
+        for station_code, services in operation_times.items():
+            for service_no, svc in services.items():
+                self.operation_times[(station_code, service_no)] = tuple(svc[field] for field in OPERATION_FIELDS)
+            self.services_by_station[station_code] = tuple(services.keys())
+        # For nearest station queries. Built once per refresh, since the stations don't move (hopefully).
+        self.spatial_index = StationSpatialIndex(self.stations.values())
+        # For finding stations by name.
+        self.search_index = StationSearchIndex(self.stations.values())
+        # For "is this bus running right now?" checks.
+        self.operating_hours = OperatingHoursTable(operation_times)
+        # For "which stops does service X serve?" and friends. Only the refresh knows the stop order, so it has to hand this in.
+        self.route_index = route_index if route_index is not None else EMPTY_ROUTE_INDEX
+        self._index_routes()
+        self.last_updated = last_updated
+
+    def apply_diff(self, diff, new_stations: dict, new_operation_times: dict, last_updated: str = None, route_index: RouteIndex = None):
+        # Returns a new network with the changes in a static_diff.StaticDiff applied.
+        # new_stations and new_operation_times are the freshly fetched data, in the same shapes as self.stations and self.operation_times.
+        # Only the affected entries get touched, and the indexes only get rebuilt if what they index actually changed.
+        # The diff doesn't track stop order, so a new route_index just replaces the old one outright.
+        network = StaticNetwork.__new__(StaticNetwork)
+        network.last_updated = last_updated
+        network.route_index = route_index if route_index is not None else self.route_index
+
+        if diff.stops_changed():
+            network.stations = dict(self.stations)
+            for code in diff.removed_stops: del network.stations[code]
+            for code in diff.added_stops | diff.changed_stops: network.stations[code] = new_stations[code]
+            network.spatial_index = StationSpatialIndex(network.stations.values())
+            network.search_index = StationSearchIndex(network.stations.values())
+        else:
+            network.stations = self.stations
+            network.spatial_index = self.spatial_index
+            network.search_index = self.search_index
+
+        if diff.routes_changed():
+            network.operation_times = dict(self.operation_times)
+            for key in diff.removed_routes: del network.operation_times[key]
+            for key in diff.added_routes | diff.changed_routes: network.operation_times[key] = new_operation_times[key]
+
+            affected = diff.affected_stations()
+            changed_services = {station: {} for station in affected}
+            for (station, service_no), times in new_operation_times.items():
+                if station in affected: changed_services[station][service_no] = dict(zip(OPERATION_FIELDS, times))
+            network.services_by_station = dict(self.services_by_station)
+            for station, services in changed_services.items():
+                network.services_by_station[station] = tuple(services.keys())
+            network.operating_hours = self.operating_hours.with_stations(changed_services)
+        else:
+            network.operation_times = self.operation_times
+            network.services_by_station = self.services_by_station
+            network.operating_hours = self.operating_hours
+
+        # Without a route index, the fallback goes by operation_times, so a change there counts too.
+        if diff.stops_changed() or network.route_index is not self.route_index or (not len(network.route_index) and diff.routes_changed()):
+            network._index_routes()
+        else:
+            network.route_positions = self.route_positions
+            network.stations_by_service = self.stations_by_service
+        return network
+
+    def _index_routes(self):
+        # route_index station id -> where that station is in spatial_index (-1 if we don't have it), for "nearest stop with bus X" queries.
+        # Only ever called on a network nobody else has seen yet.
+        positions = self.spatial_index.positions
+        self.route_positions = np.array([positions.get(code, -1) for code in self.route_index.station_codes], dtype = np.int64)
+        # Networks from older snapshots (and the JSON files) don't have a route index until the next refresh.
+        # Until then, ServiceNo -> the spatial_index positions of its stations, straight from operation_times.
+        self.stations_by_service = None
+        if not len(self.route_index):
+            stations_by_service = {}
+            for station_code, service_no in self.operation_times:
+                if station_code in positions: stations_by_service.setdefault(service_no, []).append(positions[station_code])
+            self.stations_by_service = {service_no: np.array(sorted(idx), dtype = np.int64) for service_no, idx in stations_by_service.items()}
+
+    def get_station_name(self, station_code: str):
+        station_info = self.stations.get(station_code)
+        return station_info["Description"] if station_info else None
+
+    def get_services(self, station_code: str) -> tuple:
+        return self.services_by_station.get(station_code, ())
+
+    def nearest_served_by(self, service_no: str, lat: float, long: float, k: int = 3, radius_m: float = None) -> list:
+        # The k nearest stations that service_no stops at, as (code, name, distance in metres) tuples.
+        if self.stations_by_service is not None:
+            idx = self.stations_by_service.get(service_no, self.route_positions[:0])
+        else:
+            idx = self.route_positions[self.route_index.station_ids_of(service_no)]
+            idx = np.unique(idx[idx >= 0])
+        return self.spatial_index.nearest_among(lat, long, idx, k, radius_m)
+
+EMPTY_NETWORK = StaticNetwork([], {})
+
+_network = None
+_network_lock = threading.Lock()
+
+@metrics.timed("static_load")
+def load_from_storage() -> StaticNetwork:
+    try:
+        bus_stops, operation_times, last_updated, route_columns = static_snapshot.read_snapshot()
+    except FileNotFoundError:
+        # No snapshot yet, but we might still have the JSON files from before snapshots were a thing.
+        static_snapshot.convert_from_json()
+        bus_stops, operation_times, last_updated, route_columns = static_snapshot.read_snapshot()
+    # Older snapshots (and the JSON files) never had the stop order. The route index stays empty until the next refresh.
+    route_index = RouteIndex(*route_columns) if route_columns is not None else None
+    return StaticNetwork(bus_stops, operation_times, last_updated, route_index)
+
+def save_to_storage(network: StaticNetwork):
+    static_snapshot.write_snapshot(network.stations.values(), network.operation_times, network.last_updated,
+                                    route_columns = network.route_index.to_columns())
+
+def swap_network(network: StaticNetwork):
+    # Rebinding a single name is atomic, so readers either see the old snapshot or the new one. Never half of each.
+    global _network
+    _network = network
+
+def get_network() -> StaticNetwork:
+    network = _network
+    if network is not None: return network
+
+    with _network_lock:
+        # Someone else might have loaded it while we were waiting.
+        if _network is None:
+            try:
+                swap_network(load_from_storage())
+            except FileNotFoundError:
+                # Nothing on disk yet (i.e. first run), so all we can offer is an empty network until the first refresh lands.
+                return EMPTY_NETWORK
+            except (static_snapshot.SnapshotFormatException, OSError, ValueError, KeyError, IndexError) as e:
+                # A snapshot we can't read (cut short, corrupted, or from a newer version of us) is as good as none.
+                # We stick with the empty network rather than trying to read it again on every lookup, and the next refresh replaces it.
+                print(f"Couldn't load the bus network snapshot, waiting for a refresh instead: {e!r}")
+                swap_network(EMPTY_NETWORK)
+        return _network
+
+async def ensure_network() -> StaticNetwork:
+    # Like get_network, but if we have nothing at all, we go and fetch the data from LTA first.
+    # However many handlers find it missing at once, there's only ever the one refresh, and they all wait on it.
+    network = get_network()
+    if network is EMPTY_NETWORK:
+        # Imported here because lta_api_interface depends on us for the refresh.
+        from src import lta_api_interface
+        await lta_api_interface.coalesced_refresh()
+        network = get_network()
+    return network
@@ -0,0 +1,159 @@
+from src.setup_constants import storage_path
+# static_network imports us too, so we only look OPERATION_FIELDS up when we need it (by then both modules are loaded).
+from src import static_network
+import numpy as np
+import json
+import os
+
+# A compact binary snapshot of the static bus network, so that starting up (or reloading) doesn't mean parsing megabytes of JSON.
+# We only keep the fields we actually use, and store them as column arrays plus one table of all the strings.
+#
+# Layout:
+#   8 bytes     magic (b"WMBSNAP\0")
+#   4 bytes     format version (little-endian uint32)
+#   4 bytes     header length (little-endian uint32)
+#   header      JSON: {"last_updated": ..., "arrays": {name: {"dtype", "count", "offset"}}}
+#   arrays      raw little-endian column data, each starting on an 8 byte boundary. Offsets are from the start of the file.
+#
+# Version 2 added the seq_* arrays (the order each service visits its stops, see route_index.py). Version 1 files are still read, minus those.
+#
+# Everything is read in one go and the columns are just views over that buffer.
+
+SNAPSHOT_MAGIC = b"WMBSNAP\0"
+SNAPSHOT_VERSION = 2
+# The versions we can still read.
+READABLE_VERSIONS = (1, 2)
+SNAPSHOT_PATH = f"{storage_path}static_network.snap"
+
+class SnapshotFormatException(Exception):
+    "The snapshot file is not one we know how to read."
+    pass
+
+class StringTable:
+    # Deduplicates strings, since the same service numbers and bus timings show up thousands of times.
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def add(self, string: str) -> int:
+        idx = self.index.get(string)
+        if idx is None:
+            idx = self.index[string] = len(self.strings)
+            self.strings.append(string)
+        return idx
+
+    def to_arrays(self):
+        # Every string, NUL-separated, as one blob of UTF-8.
+        blob = "\0".join(self.strings).encode("utf-8")
+        return np.frombuffer(blob, dtype = np.uint8), len(self.strings)
+
+def write_snapshot(bus_stops, operation_times: dict, last_updated: str, path: str = SNAPSHOT_PATH, route_columns: tuple = None):
+    # bus_stops is an iterable of BusStops rows. operation_times is (BusStopCode, ServiceNo) -> the 6 timing strings.
+    # route_columns is what route_index.RouteIndex.to_columns() gives, if we have one.
+    strings = StringTable()
+    bus_stops = list(bus_stops)
+    routes = list(operation_times.items())
+    arrays = {
+        "stop_code": np.array([strings.add(stop["BusStopCode"]) for stop in bus_stops], dtype = "<u4"),
+        "stop_description": np.array([strings.add(stop["Description"]) for stop in bus_stops], dtype = "<u4"),
+        "stop_road": np.array([strings.add(stop.get("RoadName", "")) for stop in bus_stops], dtype = "<u4"),
+        "stop_latitude": np.array([stop["Latitude"] for stop in bus_stops], dtype = "<f8"),
+        "stop_longitude": np.array([stop["Longitude"] for stop in bus_stops], dtype = "<f8"),
+        "route_station": np.array([strings.add(station) for (station, service), times in routes], dtype = "<u4"),
+        "route_service": np.array([strings.add(service) for (station, service), times in routes], dtype = "<u4"),
+        "route_times": np.array([[strings.add(time) for time in times] for key, times in routes], dtype = "<u4").reshape(-1, len(static_network.OPERATION_FIELDS))
+    }
+    if route_columns is not None:
+        services, directions, route_start, stop_stations, stop_distances = route_columns
+        arrays["seq_service"] = np.array([strings.add(service) for service in services], dtype = "<u4")
+        arrays["seq_direction"] = np.asarray(directions, dtype = "<u1")
+        arrays["seq_route_start"] = np.asarray(route_start, dtype = "<u4")
+        arrays["seq_station"] = np.array([strings.add(station) for station in stop_stations], dtype = "<u4")
+        arrays["seq_distance"] = np.asarray(stop_distances, dtype = "<f4")
+    arrays["strings"], string_count = strings.to_arrays()
+
+    # Work out where everything goes. The header's length depends on the offsets, so we iterate until it settles.
+    layout = {}
+    header_length = 0
+    while True:
+        offset = align(len(SNAPSHOT_MAGIC) + 8 + header_length)
+        for name, array in arrays.items():
+            layout[name] = {"dtype": array.dtype.str, "count": int(array.size), "offset": offset}
+            offset = align(offset + array.nbytes)
+        header = json.dumps({"last_updated": last_updated, "string_count": string_count, "arrays": layout}).encode("utf-8")
+        if len(header) == header_length: break
+        header_length = len(header)
+
+    # Written to a temporary file and then swapped in, so that nobody ever reads half a snapshot.
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(np.array([SNAPSHOT_VERSION, header_length], dtype = "<u4").tobytes())
+        f.write(header)
+        for name, array in arrays.items():
+            f.write(b"\0" * (layout[name]["offset"] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(f"{path}.tmp", path)
+
+def align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def read_snapshot(path: str = SNAPSHOT_PATH):
+    # Returns (bus_stops, operation_times, last_updated, route_columns), with the first two in the same shapes as
+    # bus_station_info.json and bus_operation_info.json. route_columns is None if the snapshot doesn't have any.
+    with open(path, "rb") as f:
+        buf = f.read()
+    if buf[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise SnapshotFormatException(f"{path} is not a snapshot")
+    version, header_length = np.frombuffer(buf, dtype = "<u4", count = 2, offset = len(SNAPSHOT_MAGIC))
+    if version not in READABLE_VERSIONS:
+        raise SnapshotFormatException(f"{path} is snapshot version {version}, we only read versions {READABLE_VERSIONS}")
+    header_start = len(SNAPSHOT_MAGIC) + 8
+    header = json.loads(buf[header_start:header_start + header_length].decode("utf-8"))
+    arrays = {name: np.frombuffer(buf, dtype = spec["dtype"], count = spec["count"], offset = spec["offset"])
+                for name, spec in header["arrays"].items()}
+
+    strings = arrays["strings"].tobytes().decode("utf-8").split("\0") if header["string_count"] else []
+
+    bus_stops = [{
+        "BusStopCode": strings[code],
+        "Description": strings[description],
+        "RoadName": strings[road],
+        "Latitude": lat,
+        "Longitude": long
+    } for code, description, road, lat, long in zip(arrays["stop_code"].tolist(), arrays["stop_description"].tolist(),
+                                                    arrays["stop_road"].tolist(), arrays["stop_latitude"].tolist(),
+                                                    arrays["stop_longitude"].tolist())]
+
+    operation_times = {}
+    route_times = arrays["route_times"].reshape(-1, len(static_network.OPERATION_FIELDS)).tolist()
+    for station, service, times in zip(arrays["route_station"].tolist(), arrays["route_service"].tolist(), route_times):
+        row = {field: strings[time] for field, time in zip(static_network.OPERATION_FIELDS, times)}
+        row["ServiceNo"] = strings[service]
+        row["BusStopCode"] = strings[station]
+        operation_times.setdefault(strings[station], {})[strings[service]] = row
+
+    route_columns = None
+    if "seq_service" in arrays:
+        route_columns = ([strings[service] for service in arrays["seq_service"].tolist()], arrays["seq_direction"],
+                            arrays["seq_route_start"], [strings[station] for station in arrays["seq_station"].tolist()],
+                            arrays["seq_distance"])
+
+    return bus_stops, operation_times, header["last_updated"], route_columns
+
+def convert_from_json(station_json_path: str = f"{storage_path}bus_station_info.json",
+                        operation_json_path: str = f"{storage_path}bus_operation_info.json",
+                        path: str = SNAPSHOT_PATH):
+    # Turns the old bus_station_info.json and bus_operation_info.json into a snapshot.
+    with open(station_json_path, "r") as f:
+        bus_station_dict = json.loads(f.read())
+    with open(operation_json_path, "r") as f:
+        bus_operation_dict = json.loads(f.read())
+    operation_times = {(station, service): tuple(svc[field] for field in static_network.OPERATION_FIELDS)
+                        for station, services in bus_operation_dict["operation_times"].items()
+                        for service, svc in services.items()}
+    write_snapshot(bus_station_dict["bus_stops"], operation_times, bus_operation_dict.get("last_updated"), path)
+
+if __name__ == "__main__":
+    # `python3 -m src.static_snapshot` converts the JSON files in storage/ into a snapshot.
+    convert_from_json()
+    print(f"Wrote {SNAPSHOT_PATH}")
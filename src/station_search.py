@@ -0,0 +1,65 @@
+import re
+import numpy as np
+
+# A trigram index over the bus stop names (Description) and road names, so that people can find a stop by typing
+# something like "opp bedok int" instead of having to know its 5-digit code.
+# Every stop gets broken up into 3-letter chunks, and a query matches the stops that share the most chunks with it.
+# Typos only break a few chunks, so "clemnti" still finds Clementi.
+
+NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+
+def normalize(text: str) -> str:
+    return NON_ALPHANUMERIC.sub(" ", text.lower()).strip()
+
+def trigrams(text: str) -> set:
+    # Padded with spaces, so that the start and end of each word count for something.
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class StationSearchIndex:
+    def __init__(self, bus_stops, candidates: int = 50):
+        bus_stops = list(bus_stops)
+        self.candidates = candidates
+        self.codes = [stop["BusStopCode"] for stop in bus_stops]
+        self.names = [stop["Description"] for stop in bus_stops]
+        self.roads = [stop.get("RoadName", "") for stop in bus_stops]
+        self.normalized_names = [normalize(name) for name in self.names]
+        self.normalized_roads = [normalize(road) for road in self.roads]
+
+        # Trigram -> array of the stops that have it.
+        postings = {}
+        doc_sizes = []
+        for i, (name, road) in enumerate(zip(self.normalized_names, self.normalized_roads)):
+            grams = trigrams(name) | trigrams(road)
+            doc_sizes.append(len(grams))
+            for gram in grams: postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.array(stops, dtype = np.int32) for gram, stops in postings.items()}
+        self.doc_sizes = np.array(doc_sizes, dtype = np.float32)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def search(self, query: str, k: int = 5) -> list:
+        # Returns up to k (code, name, road name, score) tuples, best match first. Scores are between 0 and ~1.5.
+        query = normalize(query)
+        if not query or not len(self.codes): return []
+        query_grams = trigrams(query)
+        hits = [self.postings[gram] for gram in query_grams if gram in self.postings]
+        if not hits: return []
+
+        # How many of the query's trigrams each stop has, scored by how much of both the query and the stop overlap.
+        shared = np.bincount(np.concatenate(hits), minlength = len(self.codes)).astype(np.float32)
+        scores = shared / (len(query_grams) + self.doc_sizes - shared)
+
+        # Only bother with the fiddly string checks for the best few.
+        n = min(self.candidates, int(np.count_nonzero(shared)))
+        top = np.argpartition(-scores, n - 1)[:n]
+        results = []
+        for i in top.tolist():
+            score = float(scores[i])
+            name, road = self.normalized_names[i], self.normalized_roads[i]
+            if name.startswith(query): score += 0.5
+            elif query in name or query in road: score += 0.25
+            results.append((score, i))
+        results.sort(key = lambda result: (-result[0], self.names[result[1]]))
+        return [(self.codes[i], self.names[i], self.roads[i], score) for score, i in results[:k]]
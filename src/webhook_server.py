@@ -0,0 +1,127 @@
+from telebot import types
+from aiohttp import web
+from src import metrics
+import collections
+import asyncio
+import time
+
+# An alternative to long polling: Telegram POSTs each update to us, and a fixed pool of workers handles them.
+# - Updates from the same chat are handled one at a time, in the order they came in. Different chats don't wait on each other
+#   (short of every worker being busy).
+# - If too much is queued up (overall, or from one chat), we answer 503 and Telegram delivers the update again a little later,
+#   instead of it piling up behind everything else.
+# Usage: `await WebhookServer(bot).serve("https://example.com/telegram")`, with something in front of us to terminate TLS.
+
+WEBHOOK_PATH = "/telegram"
+
+def chat_key(update: types.Update):
+    # What an update needs to stay in order with. Usually the chat it came from.
+    for message in (update.message, update.edited_message, update.callback_query and update.callback_query.message):
+        if message: return message.chat.id
+    for query in (update.callback_query, update.inline_query, update.chosen_inline_result):
+        if query: return query.from_user.id
+    # Nothing to keep it in order with, so it gets a queue all to itself.
+    return ("update", update.update_id)
+
+class WebhookServer:
+    def __init__(self, bot, host: str = "127.0.0.1", port: int = 8443, path: str = WEBHOOK_PATH, secret_token: str = None,
+                    workers: int = 16, max_pending: int = 1024, max_pending_per_chat: int = 8, log_interval: float = 600.0):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.path = path
+        # Telegram sends this back in a header with every update, so that nobody else can feed us updates.
+        self.secret_token = secret_token
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_chat = max_pending_per_chat
+        self.log_interval = log_interval
+
+        # Chat -> its updates that haven't been picked up yet, as (update, when it came in).
+        # A chat stays in here while one of its updates is being handled, even if nothing else is queued, so nobody else picks it up.
+        self.chats = {}
+        # Chats with updates waiting and nobody working on them. Each chat is in here at most once.
+        self.ready = asyncio.Queue()
+        self.pending = 0
+        self.accepted = 0
+        self.shed = 0
+        self.handled = 0
+        self.failed = 0
+        self.worker_tasks = []
+
+    def accept(self, update: types.Update) -> bool:
+        # Queues the update up. Returns False (and doesn't queue it) if there's too much queued up already.
+        key = chat_key(update)
+        queue = self.chats.get(key)
+        if self.pending >= self.max_pending or (queue is not None and len(queue) >= self.max_pending_per_chat):
+            self.shed += 1
+            metrics.count("webhook_shed")
+            return False
+        self.pending += 1
+        self.accepted += 1
+        if queue is None:
+            self.chats[key] = collections.deque([(update, time.perf_counter())])
+            self.ready.put_nowait(key)
+        else:
+            queue.append((update, time.perf_counter()))
+        return True
+
+    async def _work(self):
+        while True:
+            key = await self.ready.get()
+            queue = self.chats[key]
+            update, received = queue.popleft()
+            metrics.observe("webhook_queue", time.perf_counter() - received)
+            try:
+                await self.bot.process_new_updates([update])
+                self.handled += 1
+            except Exception as e:
+                self.failed += 1
+                print(str(e))
+            finally:
+                self.pending -= 1
+                # Back of the line for this chat, so that one busy chat can't keep a worker to itself.
+                if queue: self.ready.put_nowait(key)
+                else: del self.chats[key]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token is not None and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret_token:
+            return web.Response(status = 401)
+        try:
+            update = types.Update.de_json(await request.json())
+        except ValueError:
+            return web.Response(status = 400)
+        if not self.accept(update):
+            return web.Response(status = 503, headers = {"Retry-After": "1"})
+        return web.Response()
+
+    def start_workers(self):
+        self.worker_tasks = [asyncio.get_running_loop().create_task(self._work()) for i in range(self.workers)]
+
+    async def stop_workers(self):
+        for task in self.worker_tasks: task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions = True)
+        self.worker_tasks = []
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "pending_chats": len(self.chats), "accepted": self.accepted, "shed": self.shed,
+                "handled": self.handled, "failed": self.failed}
+
+    async def serve(self, url: str = None):
+        # Serves until cancelled. If url is given, Telegram gets told to send updates there first.
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        self.start_workers()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+            if url is not None:
+                await self.bot.set_webhook(url, secret_token = self.secret_token, max_connections = self.workers,
+                                            allowed_updates = ["message", "callback_query", "inline_query"])
+            while True:
+                await asyncio.sleep(self.log_interval)
+                print(f"Webhook server: {self.stats()}")
+        finally:
+            await runner.cleanup()
+            await self.stop_workers()
@@ -1 +1,5 @@
-# To run tests, do `python3 -m unittest discover -p "test_*.py"`
\ No newline at end of file
+# To run tests, do `python3 -m unittest discover -p "test_*.py"`
+import os
+
+# Importing src builds the Telegram bot object, which wants a well-formed token even though the tests never talk to Telegram.
+os.environ.setdefault("BOT_API_TOKEN", "0:offline-tests")
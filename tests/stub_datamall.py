@@ -0,0 +1,34 @@
+from aiohttp import web
+
+# A tiny stand-in for LTA DataMall that runs on localhost, so that we can test our HTTP layer without an API key.
+# Set `handlers[endpoint]` to a function taking the aiohttp request and returning either a dict (sent as JSON) or a web.Response.
+
+class StubDataMall:
+    def __init__(self):
+        self.handlers = {}
+        self.request_log = []
+        self.runner = None
+        self.base_url = None
+
+    async def _dispatch(self, request: web.Request):
+        endpoint = request.match_info["endpoint"]
+        self.request_log.append((endpoint, dict(request.query)))
+        if endpoint not in self.handlers: return web.Response(status = 404)
+        result = self.handlers[endpoint](request)
+        if hasattr(result, "__await__"): result = await result
+        if isinstance(result, web.StreamResponse): return result
+        return web.json_response(result)
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/ltaodataservice/{endpoint}", self._dispatch)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/ltaodataservice/"
+        return self.base_url
+
+    async def stop(self):
+        if self.runner is not None: await self.runner.cleanup()
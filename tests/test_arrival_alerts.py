@@ -0,0 +1,144 @@
+from src.arrival_alerts import AlertScheduler, AlertStore, TooManyAlertsException
+from src.setup_constants import sg_timezone
+from src.shared_cache import LocalCache
+from src import favorites_db
+import unittest
+import tempfile
+import asyncio
+import datetime
+import os
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+class TestArrivalAlerts(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.clock = FakeClock()
+        # Station -> service -> seconds until the next bus, as of now.
+        self.etas = {}
+        self.fetches = []
+        self.notified = []
+        self.scheduler = AlertScheduler(self.fetch, self.notify, min_interval = 15, max_interval = 120, ttl = 3600, max_per_user = 2,
+                                        clock = self.clock)
+
+    async def fetch(self, station: str) -> dict:
+        self.fetches.append(station)
+        services = []
+        for service, eta in self.etas.get(station, {}).items():
+            arrival = datetime.datetime.fromtimestamp(self.clock() + eta, tz = sg_timezone)
+            services.append({"ServiceNo": service, "NextBus": {"EstimatedArrival": arrival.isoformat(), "Type": "SD", "Load": "SEA"}})
+        return {"BusStopCode": station, "Services": services}
+
+    async def notify(self, alert, bus):
+        self.notified.append((alert.user_id, alert.service, bus is not None))
+
+    async def advance(self, seconds: float):
+        # Moves time (and the buses) on, and polls whatever is due by then.
+        self.clock.now += seconds
+        for etas in self.etas.values():
+            for service in etas: etas[service] -= seconds
+        return await self.scheduler.poll_due()
+
+    async def test_one_poll_per_station(self):
+        self.etas["01012"] = {"12": 1200, "14": 1200}
+        for user_id in range(1, 11): await self.scheduler.add(user_id, user_id, "01012", "12" if user_id % 2 else "14", 3)
+        self.assertEqual(await self.scheduler.poll_due(), 1)
+        self.assertEqual(self.fetches, ["01012"])
+        self.assertEqual(self.scheduler.stats()["stations"], 1)
+
+    async def test_cadence_adapts_and_fires(self):
+        self.etas["01012"] = {"12": 1200}
+        await self.scheduler.add(1, 1, "01012", "12", 3)
+        await self.scheduler.poll_due()
+        # 17 minutes to spare, so not for a while.
+        self.assertEqual(self.scheduler.next_poll["01012"], self.clock() + 120)
+        await self.advance(120)
+        # The bus caught up a bit.
+        self.etas["01012"]["12"] = 320
+        await self.advance(120)
+        # Only 20 seconds to spare now.
+        self.assertEqual(self.scheduler.next_poll["01012"], self.clock() + 15)
+        await self.advance(15)
+        self.assertEqual(self.notified, [])
+        await self.advance(15)
+        self.assertEqual(self.notified, [(1, "12", True)])
+        self.assertEqual(self.scheduler.alerts_for(1), [])
+        self.assertNotIn("01012", self.scheduler.next_poll)
+
+    async def test_expiry(self):
+        await self.scheduler.add(1, 1, "01012", "12", 3)
+        await self.scheduler.poll_due()
+        # No bus is coming, so we just check back every so often.
+        self.assertEqual(self.scheduler.next_poll["01012"], self.clock() + 120)
+        for i in range(30): await self.advance(120)
+        self.assertEqual(self.notified, [(1, "12", False)])
+        self.assertEqual(self.scheduler.stats()["expired"], 1)
+
+    async def test_limits_and_cancel(self):
+        await self.scheduler.add(1, 1, "01012", "12", 3)
+        await self.scheduler.add(1, 1, "01013", "12", 3)
+        # Replacing an alert doesn't count as another one.
+        await self.scheduler.add(1, 1, "01013", "12", 5)
+        with self.assertRaises(TooManyAlertsException):
+            await self.scheduler.add(1, 1, "01019", "12", 3)
+        self.assertTrue(await self.scheduler.cancel(1, "01012", "12"))
+        self.assertFalse(await self.scheduler.cancel(1, "01012", "12"))
+        self.assertEqual([(alert.station, alert.minutes) for alert in self.scheduler.alerts_for(1)], [("01013", 5)])
+        self.assertEqual(await self.scheduler.poll_due(), 1)
+        self.assertEqual(self.fetches, ["01013"])
+
+    async def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            favorites_db.start_db(os.path.join(tmpdir, "favorites.db"))
+            try:
+                self.scheduler.store = AlertStore()
+                self.etas["01012"] = {"12": 100}
+                await self.scheduler.add(1, 1, "01012", "12", 3)
+                await self.scheduler.add(2, 2, "01013", "14", 3)
+                await self.scheduler.poll_due()
+                self.assertEqual(self.notified, [(1, "12", True)])
+
+                restarted = AlertScheduler(self.fetch, self.notify, AlertStore(), clock = self.clock)
+                await restarted.load()
+                self.assertEqual([(alert.user_id, alert.station, alert.service) for alert in restarted.alerts_for(2)], [(2, "01013", "14")])
+                self.assertEqual(restarted.alerts_for(1), [])
+                self.assertEqual(await restarted.poll_due(), 1)
+            finally:
+                favorites_db.close_db()
+
+    async def test_multiple_workers(self):
+        # Two workers sharing the one database and cache, each with their own scheduler.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            favorites_db.start_db(os.path.join(tmpdir, "favorites.db"))
+            try:
+                shared = LocalCache()
+                workers = [AlertScheduler(self.fetch, self.notify, AlertStore(), clock = self.clock, shared = shared, worker_id = worker_id)
+                            for worker_id in ("a", "b")]
+                for worker in workers: await worker.load()
+                self.etas["01012"] = {"12": 1200, "14": 100}
+                await workers[0].add(1, 1, "01012", "12", 3)
+                await workers[0].add(2, 2, "01012", "14", 3)
+                # Both added through worker a, but worker b knows about them too.
+                self.assertEqual([alert.service for alert in await workers[1].list_alerts(1)], ["12"])
+                for worker in workers: await worker.sync()
+                await asyncio.gather(*(worker.poll_due() for worker in workers))
+                # Bus 14 is close enough, but only one of them says so.
+                self.assertEqual(self.notified, [(2, "14", True)])
+                self.assertEqual(sum(worker.stats()["claims_lost"] for worker in workers), 1)
+
+                # Cancelled through worker b, so worker a mustn't fire it either.
+                self.assertTrue(await workers[1].cancel(1, "01012", "12"))
+                self.etas["01012"]["12"] = 100
+                self.clock.now += 120
+                await asyncio.gather(*(worker.poll_due() for worker in workers))
+                self.assertEqual(self.notified, [(2, "14", True)])
+                self.assertEqual(workers[0].alerts_for(1), [])
+            finally:
+                favorites_db.close_db()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+from src.setup_constants import sg_timezone
+from src.arrival_cache import ArrivalCache
+import unittest
+import tempfile
+import datetime
+import asyncio
+import json
+import os
+
+class TestArrivalCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.calls = []
+        self.fail = False
+
+    async def fetch(self, station: str) -> dict:
+        self.calls.append(station)
+        await asyncio.sleep(0.01)
+        if self.fail: raise ConnectionError("DataMall is down")
+        return {"BusStopCode": station, "Services": [], "last_updated": datetime.datetime.now(tz = sg_timezone).isoformat()}
+
+    async def test_concurrent_requests_are_coalesced(self):
+        cache = ArrivalCache(self.fetch)
+        results = await asyncio.gather(*(cache.get("01012") for i in range(10)))
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["coalesced"], 9)
+
+    async def test_ttl(self):
+        cache = ArrivalCache(self.fetch, ttl = 0.05)
+        await cache.get("01012")
+        await cache.get("01012")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        await asyncio.sleep(0.06)
+        await cache.get("01012")
+        self.assertEqual(len(self.calls), 2)
+
+    async def test_lru_eviction(self):
+        cache = ArrivalCache(self.fetch, max_entries = 2)
+        await cache.get("1")
+        await cache.get("2")
+        await cache.get("1")
+        await cache.get("3")
+        self.assertEqual(list(cache.entries.keys()), ["1", "3"])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    async def test_serves_stale_on_failure(self):
+        cache = ArrivalCache(self.fetch, ttl = 0)
+        first = await cache.get("01012")
+        self.fail = True
+        self.assertIs(await cache.get("01012"), first)
+        self.assertEqual(cache.stats()["stale_served"], 1)
+        with self.assertRaises(ConnectionError):
+            await cache.get("99999")
+
+    async def test_persistence(self):
+        with tempfile.TemporaryDirectory() as persist_path:
+            cache = ArrivalCache(self.fetch, persist_path = persist_path, persist_interval = 0.01)
+            await cache.get("01012")
+            await asyncio.sleep(0.05)
+            warm = ArrivalCache(self.fetch, persist_path = persist_path)
+            warm.load_persisted()
+            self.assertIsNotNone(warm.peek("01012"))
+
+    async def test_warm_window(self):
+        with tempfile.TemporaryDirectory() as persist_path:
+            now = datetime.datetime.now(tz = sg_timezone)
+            for station, age in (("01011", 2), ("01012", 30), ("01013", 300)):
+                with open(os.path.join(persist_path, f"{station}.json"), "w") as f:
+                    f.write(json.dumps({"BusStopCode": station, "Services": [], "last_updated": (now - datetime.timedelta(seconds = age)).isoformat()}))
+            warm = ArrivalCache(self.fetch, ttl = 10, persist_path = persist_path, warm_window = 60)
+            warm.load_persisted()
+            # Still within the ttl, so it's fresh for the rest of it.
+            self.assertIsNotNone(warm.peek("01011"))
+            self.assertLess(warm.time_to_live("01011"), 9)
+            # Older than the ttl, so it isn't fresh, but it's still recent enough to fall back on if DataMall is down.
+            self.assertIn("01012", warm.entries)
+            self.assertIsNone(warm.peek("01012"))
+            self.fail = True
+            self.assertEqual((await warm.get("01012"))["BusStopCode"], "01012")
+            self.assertEqual(warm.stats()["stale_served"], 1)
+            self.assertNotIn("01013", warm.entries)
@@ -0,0 +1,110 @@
+from src.arrival_history import ArrivalHistoryRecorder, read_history, history_files, history_path, LOADS, TYPES
+from src.setup_constants import sg_timezone
+from src import history_stats
+import numpy as np
+import unittest
+import tempfile
+import datetime
+import os
+
+def arrival_response(station: str, fetched_at: float, etas: dict) -> dict:
+    # etas is service -> the estimated arrival times (unix seconds) of its next buses.
+    return {"BusStopCode": station, "Services": [{
+        "ServiceNo": service,
+        **{key: {"EstimatedArrival": datetime.datetime.fromtimestamp(eta, tz = sg_timezone).isoformat(), "Load": "SDA", "Type": "DD"}
+            for key, eta in zip(("NextBus", "NextBus2", "NextBus3"), service_etas)}
+    } for service, service_etas in etas.items()]}
+
+class TestArrivalHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # 23:59:30 Singapore time, so that the recording runs past midnight.
+        self.start = datetime.datetime(2024, 1, 31, 23, 59, 30, tzinfo = sg_timezone).timestamp()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def record(self, responses: list):
+        # responses are (fetched_at, response) pairs.
+        recorder = ArrivalHistoryRecorder(self.tmpdir.name, flush_rows = 4)
+        recorder.start()
+        for fetched_at, response in responses: recorder.record(response, fetched_at)
+        recorder.close()
+        return recorder
+
+    def test_round_trip(self):
+        responses = [(self.start + 20 * i, arrival_response("01012", self.start + 20 * i, {"12": [self.start + 600, self.start + 1200], "14e": [self.start + 300]}))
+                        for i in range(4)]
+        recorder = self.record(responses)
+        self.assertEqual(recorder.stats()["rows_written"], 12)
+        # Rotated at midnight.
+        self.assertEqual([os.path.basename(path) for path in history_files(self.tmpdir.name)], ["arrivals-2024-01-31.wmbh", "arrivals-2024-02-01.wmbh"])
+
+        history = read_history(history_files(self.tmpdir.name))
+        self.assertEqual(len(history), 12)
+        self.assertEqual(sorted(history.services), ["12", "14e"])
+        twelve = np.array([history.services[service] == "12" for service in history.service])
+        np.testing.assert_array_equal(history.fetched_at[twelve & (history.slot == 0)], [self.start + 20 * i for i in range(4)])
+        np.testing.assert_allclose(history.eta[twelve & (history.slot == 1)], self.start + 1200)
+        self.assertTrue(np.all(history.station == 1012))
+        self.assertTrue(np.all(history.load == LOADS.index("SDA")))
+        self.assertTrue(np.all(history.type == TYPES.index("DD")))
+
+    def test_ignores_cut_off_blocks(self):
+        self.record([(self.start - 60, arrival_response("01012", self.start - 60, {"12": [self.start]}))] * 2)
+        path = history_path(self.tmpdir.name, datetime.date(2024, 1, 31))
+        with open(path, "ab") as f:
+            f.write(b"WMBH\x01\x00\x00\x00\x10\x00")
+        self.assertEqual(len(read_history([path])), 2)
+
+    def test_appends_after_cut_off_block(self):
+        response = arrival_response("01012", self.start - 60, {"12": [self.start]})
+        self.record([(self.start - 60, response)] * 4)
+        path = history_path(self.tmpdir.name, datetime.date(2024, 1, 31))
+        # Lose the end of the last block, as if we crashed halfway through writing it.
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 5)
+        self.assertEqual(len(read_history([path])), 0)
+        # Then a restart, and some more.
+        recorder = self.record([(self.start - 30, response)] * 4)
+        self.assertGreater(recorder.stats()["trimmed_bytes"], 0)
+        history = read_history([path])
+        self.assertEqual(len(history), 4)
+        self.assertEqual(sorted(set(history.fetched_at.tolist())), [self.start - 30])
+
+class TestHistoryStats(unittest.TestCase):
+    def test_drift_and_headways(self):
+        # Bus 12 comes every 10 minutes like clockwork, and LTA always says it's 10% further away than it is.
+        # We look every 30 seconds for 2 hours.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            start = 1_700_000_000.0
+            responses = []
+            for i in range(240):
+                now = start + 30 * i
+                arrivals = [start + 600 * k for k in range(1, 20) if start + 600 * k > now][:3]
+                responses.append((now, arrival_response("01012", now, {"12": [now + 1.1 * (arrival - now) for arrival in arrivals]})))
+            recorder = ArrivalHistoryRecorder(tmpdir, flush_rows = 1000)
+            recorder.start()
+            for fetched_at, response in responses: recorder.record(response, fetched_at)
+            recorder.close()
+            history = read_history(history_files(tmpdir))
+
+        tracked = history_stats.track_buses(history)
+        # One bus every 10 minutes, and we were looking when each of them came.
+        self.assertEqual(len(tracked.arrival), 12)
+        self.assertEqual(int(tracked.observed.sum()), 12)
+
+        drift = history_stats.eta_drift(history, "service", tracked)
+        # The further ahead the estimate, the further off it is, and always on the late side.
+        self.assertTrue(np.all(drift["bias"] >= 0))
+        self.assertTrue(np.all(np.diff(drift["mae"]) > 0))
+        self.assertEqual(drift["horizon"].tolist(), [0, 1, 2, 3])
+
+        gaps = history_stats.headways(history, "both", tracked)
+        self.assertEqual(history_stats.describe_key(int(gaps["key"][0]), "both", history.services), "01012 12")
+        self.assertEqual(int(gaps["count"][0]), 11)
+        self.assertAlmostEqual(float(gaps["mean"][0]), 600, delta = 30)
+        self.assertLess(float(gaps["cv"][0]), 0.05)
+
+if __name__ == "__main__":
+    unittest.main()
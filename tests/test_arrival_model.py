@@ -0,0 +1,39 @@
+from src.setup_constants import sg_timezone, bus_types, bus_load
+import src.arrival_model as test_subject
+import unittest
+import datetime
+
+class TestArrivalModel(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2023, 1, 2, 12, 0, tzinfo = sg_timezone)
+        def next_bus(seconds: int, bus_type: str, load: str, feature: str = ""):
+            return {"EstimatedArrival": (self.now + datetime.timedelta(seconds = seconds)).isoformat(), "Type": bus_type, "Load": load, "Feature": feature}
+        self.payload = {
+            "BusStopCode": "01012",
+            "Services": [
+                {"ServiceNo": "12", "NextBus": next_bus(-30, "SD", "SEA"), "NextBus2": next_bus(125, "DD", "SDA", "WAB"), "NextBus3": {"EstimatedArrival": ""}},
+                {"ServiceNo": "2", "NextBus": next_bus(300, "BD", "LSD"), "NextBus2": {"EstimatedArrival": ""}, "NextBus3": {"EstimatedArrival": ""}}
+            ]
+        }
+        self.arrivals = test_subject.StationArrivals.from_datamall(self.payload)
+
+    def test_model(self):
+        self.assertEqual(list(self.arrivals.services.keys()), ["12", "2"])
+        self.assertEqual(len(self.arrivals.services["12"].next_buses), 2)
+        self.assertEqual(self.arrivals.services["2"].next_buses[0].minutes_away(self.now), 5)
+
+    def test_render_html(self):
+        result = test_subject.render_html(self.arrivals, "Hotel Grand Pacific", ["12", "2", "7"], {"2", "12"}, self.now)
+        self.assertEqual(result, "<b>Hotel Grand Pacific (01012)</b>\n"
+                            f"<b>Bus 2</b>\n{bus_types['BD']} -- 5 min {bus_load['LSD']}\n\n"
+                            f"<b>Bus 7</b>\nCurrently not operational.\n\n"
+                            f"<b>Bus 12</b>\n{bus_types['SD']} -- Arriving Soon {bus_load['SEA']}\n{bus_types['DD']} -- 2 min {bus_load['SDA']}♿\n\n")
+
+    def test_render_text(self):
+        result = test_subject.render_text(self.arrivals, "Hotel Grand Pacific", ["12", "2"], {"12"}, self.now)
+        self.assertEqual(result, "Hotel Grand Pacific (01012)\n2: -\n12: 0, 2 min\n")
+
+    def test_to_json_dict(self):
+        result = test_subject.to_json_dict(self.arrivals, "Hotel Grand Pacific", ["12", "2"], {"12", "2"}, self.now)
+        self.assertEqual([service["service_no"] for service in result["services"]], ["2", "12"])
+        self.assertTrue(result["services"][1]["next_buses"][1]["wheelchair_accessible"])
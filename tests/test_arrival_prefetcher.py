@@ -0,0 +1,32 @@
+from src.arrival_cache import ArrivalCache
+from src.arrival_prefetcher import ArrivalPrefetcher
+import unittest
+
+class TestArrivalPrefetcher(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.calls = []
+        async def fetch(station: str):
+            self.calls.append(station)
+            return {"BusStopCode": station, "Services": []}
+        async def favorite_counts():
+            return {"01013": 3}
+        self.cache = ArrivalCache(fetch, ttl = 10)
+        self.prefetcher = ArrivalPrefetcher(self.cache, favorite_counts, top_n = 2, interval = 5, budget_per_minute = 60)
+
+    async def test_prefetches_hot_stations(self):
+        for i in range(5): self.prefetcher.record_request("01012")
+        self.prefetcher.record_request("01019")
+        self.assertEqual(await self.prefetcher.prefetch_once(), 2)
+        self.assertEqual(sorted(self.calls), ["01012", "01013"])
+
+        # Both are fresh now, so there's nothing to do until they're about to expire.
+        self.assertEqual(await self.prefetcher.prefetch_once(), 0)
+        await self.cache.get("01012")
+        self.assertEqual(self.prefetcher.stats()["prefetch_hit_rate"], 1.0)
+
+    async def test_budget(self):
+        self.prefetcher.top_n = 50
+        for i in range(20): self.prefetcher.record_request(f"{i:05d}")
+        # 60 calls a minute, every 5 seconds, is 5 calls a round.
+        self.assertEqual(await self.prefetcher.prefetch_once(), 5)
+        self.assertGreater(self.prefetcher.stats()["over_budget"], 0)
@@ -0,0 +1,64 @@
+from src.datamall_client import DataMallClient, DataMallException, TokenBucket
+from tests.stub_datamall import StubDataMall
+from aiohttp import web
+import unittest
+import asyncio
+import time
+
+class TestDataMallClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.stub = StubDataMall()
+        base_url = await self.stub.start()
+        self.client = DataMallClient({"AccountKey": "test"}, base_url = base_url, backoff = 0.01, rate_limit = 1000, burst = 1000)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.stub.stop()
+
+    async def test_get_passes_params(self):
+        self.stub.handlers["BusArrivalv2"] = lambda request: {"BusStopCode": request.query["BusStopCode"], "Services": []}
+        resp = await self.client.get("BusArrivalv2", {"BusStopCode": "01012"})
+        self.assertEqual(resp["BusStopCode"], "01012")
+
+    async def test_retries_server_errors(self):
+        attempts = []
+        def flaky(request):
+            attempts.append(1)
+            if len(attempts) < 3: return web.Response(status = 503)
+            return {"value": []}
+        self.stub.handlers["BusStops"] = flaky
+        self.assertEqual(await self.client.get("BusStops"), {"value": []})
+        self.assertEqual(len(attempts), 3)
+
+    async def test_gives_up(self):
+        self.stub.handlers["BusStops"] = lambda request: web.Response(status = 500)
+        with self.assertRaises(DataMallException):
+            await self.client.get("BusStops")
+        self.assertEqual(len(self.stub.request_log), self.client.max_retries + 1)
+
+    async def test_no_retry_on_client_error(self):
+        self.stub.handlers["BusStops"] = lambda request: web.Response(status = 401)
+        with self.assertRaises(DataMallException):
+            await self.client.get("BusStops")
+        self.assertEqual(len(self.stub.request_log), 1)
+
+    async def test_bounded_concurrency(self):
+        in_flight = [0, 0]
+        async def slow(request):
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+            await asyncio.sleep(0.02)
+            in_flight[0] -= 1
+            return {"value": []}
+        self.stub.handlers["BusRoutes"] = slow
+        self.client.max_concurrency = 3
+        await asyncio.gather(*(self.client.get("BusRoutes") for i in range(12)))
+        self.assertLessEqual(in_flight[1], 3)
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def test_rate_is_respected(self):
+        bucket = TokenBucket(rate = 100, capacity = 5)
+        start = time.monotonic()
+        for i in range(15): await bucket.acquire()
+        # 5 come free from the burst, the other 10 need ~0.1s to trickle in.
+        self.assertGreaterEqual(time.monotonic() - start, 0.08)
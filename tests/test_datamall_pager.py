@@ -0,0 +1,45 @@
+from src.datamall_pager import fetch_pages
+from src.datamall_client import DataMallException
+import unittest
+import asyncio
+import random
+
+class TestFetchPages(unittest.IsolatedAsyncioTestCase):
+    def make_fetcher(self, total_rows: int, page_size: int = 10):
+        self.requested = []
+        self.in_flight = [0, 0]
+
+        async def fetch_page(skip: int):
+            self.requested.append(skip)
+            self.in_flight[0] += 1
+            self.in_flight[1] = max(self.in_flight)
+            # Jumble the completion order up a bit.
+            await asyncio.sleep(random.random() / 100)
+            self.in_flight[0] -= 1
+            return {"value": list(range(skip, min(skip + page_size, total_rows)))}
+        return fetch_page
+
+    async def test_rows_arrive_in_order(self):
+        rows = []
+        report = await fetch_pages("Test", self.make_fetcher(95), rows.extend, page_size = 10, window = 4)
+        self.assertEqual(rows, list(range(95)))
+        self.assertEqual(report.rows, 95)
+        self.assertLessEqual(self.in_flight[1], 4)
+        self.assertEqual([page.skip for page in report.pages], sorted(page.skip for page in report.pages))
+
+    async def test_empty_dataset(self):
+        rows = []
+        report = await fetch_pages("Test", self.make_fetcher(0), rows.extend, page_size = 10, window = 4)
+        self.assertEqual(rows, [])
+        self.assertIn(0, self.requested)
+
+    async def test_stops_at_first_empty_page(self):
+        await fetch_pages("Test", self.make_fetcher(100), lambda rows: None, page_size = 10, window = 3)
+        # We should never get more than a window's worth of pages past the end.
+        self.assertLessEqual(max(self.requested), 100 + 10 * 2)
+
+    async def test_bad_page_raises(self):
+        async def fetch_page(skip: int):
+            return {"odata.error": "nope"}
+        with self.assertRaises(DataMallException):
+            await fetch_pages("Test", fetch_page, lambda rows: None)
@@ -0,0 +1,60 @@
+from src import favorites_db as test_subject
+from src import static_network
+from unittest import mock
+import unittest
+import tempfile
+import sqlite3
+import os
+
+class TestFavoritesDB(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "favorites.db")
+        network = static_network.StaticNetwork([{"BusStopCode": code, "Description": f"Stop {code}", "Latitude": 1.3, "Longitude": 103.8}
+                                                    for code in ("01012", "01013", "01019")], {})
+        self.network_patch = mock.patch.object(static_network, "_network", network)
+        self.network_patch.start()
+
+    async def asyncTearDown(self):
+        test_subject.close_db()
+        self.network_patch.stop()
+        self.tmpdir.cleanup()
+
+    async def test_add_get_delete(self):
+        test_subject.start_db(self.db_path)
+        with self.assertRaises(test_subject.NoFavoriteStationsException):
+            await test_subject.check_favorites(1)
+        self.assertEqual(await test_subject.add_favorite(1, "01019"), "Stop 01019")
+        await test_subject.add_favorite(1, "01012")
+        await test_subject.add_favorite(1, "01012")
+        await test_subject.add_favorite(2, "01013")
+        self.assertEqual(await test_subject.get_favorites(1), ["01012", "01019"])
+        self.assertEqual(await test_subject.delete_favorite(1, "01012"), "Stop 01012")
+        self.assertEqual(await test_subject.get_favorites(1), ["01019"])
+        self.assertEqual(await test_subject.get_favorites(2), ["01013"])
+        with self.assertRaises(test_subject.NoFavoriteStationsException):
+            await test_subject.delete_favorite(3, "01012")
+        # Not one of theirs, and not a station at all.
+        with self.assertRaises(test_subject.FavoriteNotFoundException):
+            await test_subject.delete_favorite(1, "01013")
+        with self.assertRaises(test_subject.BusStationNotExistsException):
+            await test_subject.delete_favorite(1, "99999")
+        self.assertEqual(await test_subject.get_favorites(2), ["01013"])
+
+    async def test_unknown_station(self):
+        test_subject.start_db(self.db_path)
+        with self.assertRaises(test_subject.BusStationNotExistsException):
+            await test_subject.add_favorite(1, "99999")
+
+    async def test_migrates_legacy_table(self):
+        db = sqlite3.connect(self.db_path)
+        db.execute("CREATE TABLE favorite (id, station_list)")
+        db.execute("INSERT INTO favorite VALUES (?, ?)", (1, "01012,01013"))
+        db.execute("INSERT INTO favorite VALUES (?, ?)", (2, ""))
+        db.commit()
+        db.close()
+
+        test_subject.start_db(self.db_path)
+        self.assertEqual(await test_subject.get_favorites(1), ["01012", "01013"])
+        with self.assertRaises(test_subject.NoFavoriteStationsException):
+            await test_subject.get_favorites(2)
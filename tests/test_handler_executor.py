@@ -0,0 +1,73 @@
+from src.handler_executor import HandlerExecutor, ExecutorOverloadedException
+import unittest
+import threading
+import asyncio
+import time
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+class FakeUpdate:
+    def __init__(self, user_id: int, text: str):
+        self.from_user = FakeUser(user_id)
+        self.text = text
+
+class TestHandlerExecutor(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.executor = HandlerExecutor(max_workers = 2, max_pending = 8, max_pending_per_user = 3)
+        self.handled = []
+
+    async def asyncTearDown(self):
+        self.executor.close()
+
+    async def handler(self, update):
+        # Later updates finish faster, so anything out of order would show.
+        await asyncio.sleep(0.03 / (len(self.handled) + 1))
+        self.handled.append((update.from_user.id, update.text))
+
+    async def test_per_user_ordering(self):
+        wrapped = self.executor.per_user()(self.handler)
+        await asyncio.gather(*(wrapped(FakeUpdate(1, str(i))) for i in range(3)))
+        self.assertEqual([text for user_id, text in self.handled], ["0", "1", "2"])
+        self.assertEqual(self.executor.stats()["pending"], 0)
+        self.assertEqual(self.executor.user_locks, {})
+
+    async def test_users_run_concurrently(self):
+        async def slow(update):
+            await asyncio.sleep(0.05)
+        wrapped = self.executor.per_user()(slow)
+        start = time.perf_counter()
+        await asyncio.gather(*(wrapped(FakeUpdate(user_id, "hi")) for user_id in range(5)))
+        self.assertLess(time.perf_counter() - start, 0.2)
+
+    async def test_backpressure(self):
+        overloaded = []
+        async def on_overload(update):
+            overloaded.append(update.text)
+        wrapped = self.executor.per_user(on_overload = on_overload)(self.handler)
+        await asyncio.gather(*(wrapped(FakeUpdate(1, str(i))) for i in range(5)))
+        self.assertEqual(len(self.handled), 3)
+        self.assertEqual(overloaded, ["3", "4"])
+        self.assertEqual(self.executor.stats()["rejected"], 2)
+
+        with self.assertRaises(ExecutorOverloadedException):
+            await asyncio.gather(*(self.executor.run_for_user(user_id, self.handler, FakeUpdate(user_id, "hi")) for user_id in range(10)))
+
+    async def test_run_blocking_is_bounded(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+        def work(i: int):
+            with lock:
+                running.append(i)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock: running.remove(i)
+            return i * 2
+        results = await asyncio.gather(*(self.executor.run_blocking(work, i) for i in range(6)))
+        self.assertEqual(results, [0, 2, 4, 6, 8, 10])
+        self.assertLessEqual(max(peak), 2)
+        stats = self.executor.stats()
+        self.assertEqual(stats["pool_run_latency"]["count"], 6)
+        self.assertEqual(stats["waiting_for_pool"], 0)
@@ -0,0 +1,84 @@
+from src import lta_api_interface as test_subject, static_network
+from src.setup_constants import sg_timezone
+from src.route_index import RouteIndexBuilder
+from unittest import mock
+import unittest
+import datetime
+import asyncio
+
+class StopLoop(Exception):
+    pass
+
+def make_network(last_updated: str) -> static_network.StaticNetwork:
+    # Nothing in it but the one route, since a network without a route index always needs refreshing.
+    route_builder = RouteIndexBuilder()
+    route_builder.add_rows([{"ServiceNo": "12", "Direction": 1, "StopSequence": 1, "BusStopCode": "01012"}])
+    return static_network.StaticNetwork([], {}, last_updated, route_builder.build())
+
+class TestStaticRefresh(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.previous = static_network._network
+        static_network.swap_network(static_network.EMPTY_NETWORK)
+        self.refreshes = 0
+        # Whether each refresh (in order) should fail.
+        self.failures = []
+
+    async def asyncTearDown(self):
+        static_network.swap_network(self.previous)
+
+    async def fake_refresh(self):
+        self.refreshes += 1
+        await asyncio.sleep(0.01)
+        if self.failures and self.failures.pop(0): raise ConnectionError("DataMall is down")
+        static_network.swap_network(make_network(datetime.datetime.now(tz = sg_timezone).isoformat()))
+
+    async def test_concurrent_misses_refresh_once(self):
+        with mock.patch.object(test_subject, "refresh_static_data", self.fake_refresh):
+            networks = await asyncio.gather(*(static_network.ensure_network() for i in range(20)))
+        self.assertEqual(self.refreshes, 1)
+        self.assertTrue(all(network is networks[0] for network in networks))
+        self.assertIsNot(networks[0], static_network.EMPTY_NETWORK)
+
+    async def test_backoff(self):
+        sleeps = []
+        async def sleep(seconds: float):
+            sleeps.append(seconds)
+            # Stop once we're back to waiting for midnight.
+            if len(sleeps) > 4: raise StopLoop
+        self.failures = [True, True, True, False]
+        with mock.patch.object(test_subject, "refresh_static_data", self.fake_refresh), self.assertRaises(StopLoop):
+            await test_subject.query_static_data(jitter = 0, min_backoff = 60, max_backoff = 100, sleep = sleep)
+        # Straight away (there was nothing to serve), then backing off, then tomorrow.
+        self.assertEqual(sleeps[:4], [0, 60, 100, 100])
+        self.assertAlmostEqual(sleeps[4], test_subject.seconds_until_midnight(), delta = 5)
+        self.assertEqual(self.refreshes, 4)
+
+    async def test_fresh_snapshot_waits_for_midnight(self):
+        sleeps = []
+        async def sleep(seconds: float):
+            sleeps.append(seconds)
+            raise StopLoop
+        static_network.swap_network(make_network(datetime.datetime.now(tz = sg_timezone).isoformat()))
+        with mock.patch.object(test_subject, "refresh_static_data", self.fake_refresh), self.assertRaises(StopLoop):
+            await test_subject.query_static_data(jitter = 0, sleep = sleep)
+        self.assertAlmostEqual(sleeps[0], test_subject.seconds_until_midnight(), delta = 5)
+        self.assertEqual(self.refreshes, 0)
+
+class TestSchedule(unittest.TestCase):
+    def test_seconds_until_midnight(self):
+        # 23:00 in London is already 07:00 the next day in Singapore.
+        london = datetime.timezone(datetime.timedelta(hours = 0))
+        self.assertEqual(test_subject.seconds_until_midnight(datetime.datetime(2024, 1, 31, 23, 0, tzinfo = london)), 17 * 3600)
+        self.assertEqual(test_subject.seconds_until_midnight(datetime.datetime(2024, 1, 31, 23, 59, 30, tzinfo = sg_timezone)), 30)
+
+    def test_is_stale(self):
+        now = datetime.datetime(2024, 2, 1, 0, 30, tzinfo = sg_timezone)
+        yesterday = make_network("2024-01-31T23:59:00+08:00")
+        today = make_network("2024-02-01T00:10:00+08:00")
+        self.assertTrue(test_subject.is_stale(yesterday, now))
+        self.assertFalse(test_subject.is_stale(today, now))
+        self.assertTrue(test_subject.is_stale(static_network.EMPTY_NETWORK, now))
+        self.assertTrue(test_subject.is_stale(static_network.StaticNetwork([], {}, "2024-02-01T00:10:00+08:00"), now))
+
+if __name__ == "__main__":
+    unittest.main()
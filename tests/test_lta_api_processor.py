@@ -1,12 +1,31 @@
 from src.setup_constants import sg_timezone, bus_types, bus_load
+from src.arrival_cache import ArrivalCache
 import src.lta_api_processor as test_subject
+import src.lta_api_utils as utils
+from src import static_network
+from unittest import mock
 import unittest
 import datetime
+import asyncio
 
 class TestParsing(unittest.TestCase):
     # Unit test the parser.
+    def setUp(self):
+        # A network where service 1 runs from an hour ago to an hour from now, whatever time the test runs at.
+        now = datetime.datetime.now(tz = sg_timezone)
+        first_bus, last_bus = (now - datetime.timedelta(hours = 1)).strftime("%H%M"), (now + datetime.timedelta(hours = 1)).strftime("%H%M")
+        times = {f"{day_type}_{which}": time for day_type in ("WD", "SAT", "SUN") for which, time in (("FirstBus", first_bus), ("LastBus", last_bus))}
+        self.previous_network = static_network.get_network()
+        static_network.swap_network(static_network.StaticNetwork(
+            [{"BusStopCode": "01012", "Description": "Hotel Grand Pacific", "RoadName": "Victoria St", "Latitude": 1.2966, "Longitude": 103.8525}],
+            {"01012": {"1": {"ServiceNo": "1", "BusStopCode": "01012", **times}, "2": {"ServiceNo": "2", "BusStopCode": "01012", **times}}}))
+
+    def tearDown(self):
+        static_network.swap_network(self.previous_network)
+
     def test_parse_arrival_data(self):
         dummy = {
+            "BusStopCode": "01012",
             "Services": [
                 {
                     "ServiceNo": "1",
@@ -28,9 +47,37 @@ class TestParsing(unittest.TestCase):
                 }
             ]
         }
-        self.assertEqual(test_subject.parse_arrival_data(dummy), f"<b>Bus No. 1</b>\n{bus_types['SD']} in 1 min {bus_load['SEA']}\n{bus_types['DD']} in 2 min {bus_load['SDA']}\n{bus_types['BD']} in 3 min {bus_load['LSD']}\n\n")
+        self.assertEqual(test_subject.parse_arrival_data(dummy, ("1", "2"), "1"),
+                            f"<b>Hotel Grand Pacific (01012)</b>\n<b>Bus 1</b>\n"
+                            f"{bus_types['SD']} -- 1 min {bus_load['SEA']}\n{bus_types['DD']} -- 2 min {bus_load['SDA']}\n{bus_types['BD']} -- 3 min {bus_load['LSD']}\n\n")
+        # Every service at the station, including the one with nothing coming.
+        self.assertTrue(test_subject.parse_arrival_data(dummy, ("1", "2"), "-1").endswith("<b>Bus 2</b>\nCurrently not operational.\n\n"))
+        # Services that don't stop here get nothing at all.
+        self.assertIsNone(test_subject.parse_arrival_data(dummy, ("1", "2"), "7"))
 
 class TestComputations(unittest.TestCase):
     # Basic unit test for auxiliary computations done.
     def test_bus_arrival_is_int(self):
-        self.assertIsInstance(test_subject.bus_est_arrival_min(datetime.datetime.now(tz = sg_timezone)), int)
\ No newline at end of file
+        self.assertIsInstance(utils.bus_est_arrival_min(datetime.datetime.now(tz = sg_timezone)), int)
+
+class TestBatchArrivals(unittest.IsolatedAsyncioTestCase):
+    async def test_query_arrivals_batch(self):
+        calls = []
+        async def fetch(station: str):
+            calls.append(station)
+            await asyncio.sleep(0.01)
+            if station == "00000": raise ConnectionError("No such station")
+            return {"BusStopCode": station, "Services": []}
+
+        with mock.patch.object(test_subject, "arrival_cache", ArrivalCache(fetch)):
+            results = await test_subject.query_arrivals_batch(["01012", "00000", "01013", "01012"], max_concurrency = 2)
+        self.assertEqual([result["BusStopCode"] for result in (results[0], results[2], results[3])], ["01012", "01013", "01012"])
+        self.assertIsInstance(results[1], ConnectionError)
+        self.assertEqual(sorted(calls), ["00000", "01012", "01013"])
+
+    async def test_nothing_nearby(self):
+        async def nearest(*args, **kwargs): return []
+        with mock.patch.object(static_network, "ensure_network", mock.AsyncMock()), \
+                mock.patch.object(test_subject, "query_nearest_bus_stations", nearest):
+            self.assertEqual(await test_subject.display_nearest_bus_stations(1.3, 103.8), "Sorry, I couldn't find any bus stations near you :<")
+            self.assertIn("bus 12 stops at", await test_subject.display_nearest_bus_stations(1.3, 103.8, "12"))
@@ -0,0 +1,65 @@
+from src import metrics as test_subject
+import unittest
+import asyncio
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        test_subject.reset()
+        test_subject.enable()
+
+    def tearDown(self):
+        test_subject.disable()
+        test_subject.reset()
+
+    def test_timer_and_counter(self):
+        with test_subject.timer("render"): pass
+        with self.assertRaises(ValueError):
+            with test_subject.timer("render"): raise ValueError()
+        test_subject.count("arrival_fetch_errors", 2)
+        self.assertEqual(test_subject.histograms["render"].count, 2)
+        self.assertEqual(test_subject.counters, {"render_errors": 1, "arrival_fetch_errors": 2})
+
+    def test_timed_sync_and_async(self):
+        @test_subject.timed("sync_stage")
+        def add(a, b): return a + b
+        @test_subject.timed("async_stage")
+        async def add_later(a, b): return a + b
+        self.assertEqual(add(1, 2), 3)
+        self.assertEqual(asyncio.run(add_later(1, 2)), 3)
+        self.assertEqual(test_subject.histograms["sync_stage"].count, 1)
+        self.assertEqual(test_subject.histograms["async_stage"].count, 1)
+
+    def test_disabled_records_nothing(self):
+        test_subject.disable()
+        @test_subject.timed("render")
+        def noop(): pass
+        noop()
+        with test_subject.timer("cache_lookup"): pass
+        test_subject.count("arrival_fetch_errors")
+        self.assertIs(test_subject.timer("cache_lookup"), test_subject.NULL_TIMER)
+        self.assertEqual((test_subject.histograms, test_subject.counters), ({}, {}))
+
+    def test_histogram_buckets(self):
+        for seconds in (0.0001, 0.003, 0.003, 20.0):
+            test_subject.observe("datamall_request", seconds)
+        histogram = test_subject.histograms["datamall_request"]
+        self.assertEqual(histogram.quantile(0.5), 0.005)
+        self.assertEqual(histogram.quantile(1.0), float("inf"))
+
+    def test_startup_timer(self):
+        startup = test_subject.StartupTimer()
+        startup.record("imports", 0.5)
+        with startup.step("alerts"): pass
+        self.assertEqual([step for step, seconds in startup.steps], ["imports", "alerts"])
+        self.assertEqual(test_subject.histograms["startup_imports"].count, 1)
+        self.assertRegex(startup.summary(), r"^Ready to serve in [\d.]+s \(imports 0\.50s, alerts 0\.00s, other -?[\d.]+s\)$")
+
+    def test_prometheus_text(self):
+        test_subject.observe("sqlite_get_favorites", 0.002)
+        test_subject.count("arrival_fetch_errors")
+        text = test_subject.render_prometheus()
+        self.assertIn('wheremybus_stage_seconds_bucket{stage="sqlite_get_favorites",le="0.0025"} 1', text)
+        self.assertIn('wheremybus_stage_seconds_bucket{stage="sqlite_get_favorites",le="+Inf"} 1', text)
+        self.assertIn('wheremybus_stage_seconds_count{stage="sqlite_get_favorites"} 1', text)
+        self.assertIn("wheremybus_arrival_fetch_errors_total 1", text)
+        self.assertIn("sqlite_get_favorites: 1 calls", test_subject.summary())
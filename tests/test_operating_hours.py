@@ -0,0 +1,39 @@
+from src.operating_hours import OperatingHoursTable, compile_range, NOT_OPERATING
+import unittest
+import datetime
+
+def make_route(wd: tuple, sat: tuple = ("-", "-"), sun: tuple = ("-", "-")):
+    return {"WD_FirstBus": wd[0], "WD_LastBus": wd[1], "SAT_FirstBus": sat[0], "SAT_LastBus": sat[1], "SUN_FirstBus": sun[0], "SUN_LastBus": sun[1]}
+
+class TestOperatingHours(unittest.TestCase):
+    def setUp(self):
+        self.table = OperatingHoursTable({
+            "01012": {
+                "2": make_route(("0530", "2330"), ("0530", "2330")),
+                "12": make_route(("0600", "0030"), ("0600", "0030"), ("0600", "0030")),
+                "NR1": make_route(("-", "-"), ("2330", "0200"))
+            },
+            "01013": {}
+        })
+        # 2 January 2023 is a Monday.
+        self.monday = datetime.datetime(2023, 1, 2)
+
+    def test_compile_range(self):
+        self.assertEqual(compile_range("0530", "2330"), (330, 1410))
+        self.assertEqual(compile_range("0600", "0030"), (360, 1470))
+        self.assertEqual(compile_range("-", "-"), NOT_OPERATING)
+
+    def test_daytime(self):
+        self.assertEqual(self.table.running_services("01012", self.monday.replace(hour = 12)), {"2", "12"})
+
+    def test_after_midnight_uses_yesterdays_schedule(self):
+        # Monday 0015 is still Sunday night for service 12, and service 2 doesn't run on Sundays.
+        self.assertEqual(self.table.running_services("01012", self.monday.replace(minute = 15)), {"12"})
+        # Sunday 0100 is Saturday night, when NR1 runs.
+        sunday = self.monday - datetime.timedelta(days = 1)
+        self.assertEqual(self.table.running_services("01012", sunday.replace(hour = 1)), {"NR1"})
+
+    def test_unknown_station(self):
+        self.assertEqual(self.table.running_services("01013", self.monday), frozenset())
+        self.assertEqual(self.table.running_services("99999", self.monday), frozenset())
+        self.assertFalse(self.table.is_running("01012", "999", self.monday))
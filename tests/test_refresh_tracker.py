@@ -0,0 +1,53 @@
+from src.refresh_tracker import RefreshTracker
+import unittest
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+class TestRefreshTracker(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tracker = RefreshTracker(debounce = 3.0, max_messages = 3, clock = self.clock)
+
+    def test_debounce(self):
+        self.assertTrue(self.tracker.tap(1, 10))
+        self.clock.now += 1
+        self.assertFalse(self.tracker.tap(1, 10))
+        # Other messages and other chats aren't held up.
+        self.assertTrue(self.tracker.tap(1, 11))
+        self.assertTrue(self.tracker.tap(2, 10))
+        self.clock.now += 3
+        self.assertTrue(self.tracker.tap(1, 10))
+        self.assertEqual(self.tracker.stats()["debounced"], 1)
+
+    def test_unknown_message(self):
+        # e.g. sent before a restart. All we know about is the message with the button.
+        self.assertEqual(self.tracker.message_ids(1, 10), [10])
+        self.assertEqual(self.tracker.changed_parts(1, 10, ["a"]), [0])
+
+    def test_changed_parts(self):
+        self.tracker.remember(1, [8, 9, 10], ["a", "b", "c"])
+        # Keyed by the last part, which is the one with the button.
+        self.assertEqual(self.tracker.message_ids(1, 10), [8, 9, 10])
+        self.assertEqual(self.tracker.changed_parts(1, 10, ["a", "b", "c"]), [])
+        self.assertEqual(self.tracker.changed_parts(1, 10, ["a", "B", "c"]), [1])
+        # A different number of parts can't be lined up with the old ones.
+        self.assertEqual(self.tracker.changed_parts(1, 10, ["a", "b"]), [0, 1])
+
+        self.tracker.forget(1, 10)
+        self.assertEqual(self.tracker.message_ids(1, 10), [10])
+
+    def test_trimming(self):
+        for message_id in range(5): self.tracker.remember(1, [message_id], ["a"])
+        self.assertEqual(list(self.tracker.records), [(1, 2), (1, 3), (1, 4)])
+        # Refreshing one moves it to the back of the line.
+        self.tracker.remember(1, [2], ["b"])
+        self.tracker.remember(1, [5], ["a"])
+        self.assertEqual(list(self.tracker.records), [(1, 4), (1, 2), (1, 5)])
+
+if __name__ == "__main__":
+    unittest.main()
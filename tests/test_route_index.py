@@ -0,0 +1,76 @@
+from src import route_index as test_subject
+import unittest
+import math
+
+def make_row(service_no: str, direction: int, sequence: int, station: str, distance: float):
+    return {"ServiceNo": service_no, "Operator": "SBST", "Direction": direction, "StopSequence": sequence,
+            "BusStopCode": station, "Distance": distance}
+
+class TestRouteIndex(unittest.TestCase):
+    def setUp(self):
+        builder = test_subject.RouteIndexBuilder()
+        # Out of order on purpose, since that's how the pages can arrive.
+        builder.add_rows([
+            make_row("12", 1, 2, "01013", 0.6),
+            make_row("12", 1, 1, "01012", 0.0),
+            make_row("12", 1, 3, "01019", 1.4),
+            make_row("12", 2, 1, "01019", 0.0),
+            make_row("12", 2, 2, "01012", 1.5),
+        ])
+        builder.add_rows([
+            make_row("2", 1, 1, "01013", 0.0),
+            make_row("2", 1, 2, "01019", 0.5),
+            # A loop service, which visits 01013 twice.
+            make_row("225G", 1, 1, "01013", 0.0),
+            make_row("225G", 1, 2, "01019", 0.9),
+            make_row("225G", 1, 3, "01029", 2.0),
+            make_row("225G", 1, 4, "01013", 3.1),
+        ])
+        self.index = builder.build()
+
+    def test_stops_served(self):
+        self.assertEqual(self.index.stops_served("12", 1), ["01012", "01013", "01019"])
+        self.assertEqual(self.index.stops_served("12"), ["01012", "01013", "01019", "01019", "01012"])
+        self.assertEqual(self.index.stops_served("999"), [])
+        self.assertEqual(self.index.directions_of("12"), [1, 2])
+
+    def test_station_ids_of(self):
+        self.assertEqual(sorted({self.index.station_codes[i] for i in self.index.station_ids_of("12").tolist()}), ["01012", "01013", "01019"])
+        self.assertEqual(len(self.index.station_ids_of("999")), 0)
+
+    def test_services_at(self):
+        self.assertEqual(self.index.services_at("01013"), {"12", "2", "225G"})
+        self.assertEqual(self.index.services_at("99999"), set())
+
+    def test_services_between(self):
+        results = self.index.services_between("01013", "01019")
+        self.assertEqual([(service, direction, n_stops) for service, direction, distance, n_stops in results],
+                            [("2", 1, 1), ("12", 1, 1), ("225G", 1, 1)])
+        self.assertAlmostEqual(results[1][2], 0.8, places = 5)
+        # Only 12's second direction goes this way.
+        self.assertEqual([result[:2] for result in self.index.services_between("01019", "01012")], [("12", 2)])
+        self.assertEqual(self.index.services_between("01012", "99999"), [])
+
+    def test_loop_service(self):
+        # 01029 -> 01013 only works by going around the end of the loop.
+        self.assertEqual(self.index.services_between("01029", "01013"), [("225G", 1, self.index.services_between("01029", "01013")[0][2], 1)])
+        self.assertAlmostEqual(self.index.distance_along_route("225G", 1, "01029", "01013"), 1.1, places = 5)
+
+    def test_distance_along_route(self):
+        self.assertAlmostEqual(self.index.distance_along_route("12", 1, "01012", "01019"), 1.4, places = 5)
+        self.assertIsNone(self.index.distance_along_route("12", 1, "01019", "01012"))
+        self.assertIsNone(self.index.distance_along_route("12", 3, "01012", "01019"))
+
+    def test_missing_distance(self):
+        builder = test_subject.RouteIndexBuilder()
+        builder.add_rows([make_row("7", 1, 1, "01012", None), make_row("7", 1, 2, "01013", None)])
+        self.assertTrue(math.isnan(builder.build().distance_along_route("7", 1, "01012", "01013")))
+
+    def test_round_trip_columns(self):
+        index = test_subject.RouteIndex(*self.index.to_columns())
+        self.assertEqual(index.stops_served("225G"), self.index.stops_served("225G"))
+        self.assertEqual(index.services_between("01013", "01019"), self.index.services_between("01013", "01019"))
+
+    def test_empty(self):
+        self.assertEqual(len(test_subject.EMPTY_ROUTE_INDEX), 0)
+        self.assertEqual(test_subject.EMPTY_ROUTE_INDEX.services_between("01012", "01013"), [])
@@ -0,0 +1,110 @@
+from src.shared_cache import LocalCache, SQLiteCache, SharedStateStorage
+from src.arrival_cache import ArrivalCache
+import unittest
+import tempfile
+import asyncio
+import os
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+class BackendTests:
+    # Run against both backends, since the point is that they behave the same.
+    def make_cache(self, clock):
+        raise NotImplementedError
+
+    async def asyncSetUp(self):
+        self.clock = FakeClock()
+        self.cache = self.make_cache(self.clock)
+
+    async def asyncTearDown(self):
+        self.cache.close()
+
+    async def test_get_set_delete(self):
+        self.assertIsNone(await self.cache.get("a"))
+        await self.cache.set("a", "1")
+        await self.cache.set("b", "2", ttl = 10)
+        self.assertEqual(await self.cache.get("a"), "1")
+        self.assertEqual(await self.cache.get("b"), "2")
+        self.clock.now += 10
+        self.assertEqual(await self.cache.get("a"), "1")
+        self.assertIsNone(await self.cache.get("b"))
+        await self.cache.delete("a")
+        self.assertIsNone(await self.cache.get("a"))
+
+    async def test_leases(self):
+        self.assertTrue(await self.cache.acquire_lease("lease", "worker 1", 5))
+        self.assertFalse(await self.cache.acquire_lease("lease", "worker 2", 5))
+        self.assertTrue(await self.cache.acquire_lease("lease", "worker 1", 5))
+        # Only the holder can release it.
+        await self.cache.release_lease("lease", "worker 2")
+        self.assertFalse(await self.cache.acquire_lease("lease", "worker 2", 5))
+        await self.cache.release_lease("lease", "worker 1")
+        self.assertTrue(await self.cache.acquire_lease("lease", "worker 2", 5))
+        # Holders that never come back lose it eventually.
+        self.clock.now += 5
+        self.assertTrue(await self.cache.acquire_lease("lease", "worker 1", 5))
+
+    async def test_state_storage(self):
+        storage = SharedStateStorage(self.cache)
+        self.assertIsNone(await storage.get_state(1, 2))
+        with self.assertRaises(RuntimeError):
+            await storage.set_data(1, 2, "station", "01012")
+        await storage.set_state(1, 2, "ArrivalCommandStates:station")
+        await storage.set_data(1, 2, "station", "01012")
+        async with storage.get_interactive_data(1, 2) as data:
+            data["bus"] = "12"
+        self.assertEqual(await storage.get_state(1, 2), "ArrivalCommandStates:station")
+        self.assertEqual(await storage.get_data(1, 2), {"station": "01012", "bus": "12"})
+        # Other users don't see it.
+        self.assertEqual(await storage.get_data(1, 3), {})
+        self.assertTrue(await storage.delete_state(1, 2))
+        self.assertFalse(await storage.delete_state(1, 2))
+        self.assertIsNone(await storage.get_state(1, 2))
+
+class TestLocalCache(BackendTests, unittest.IsolatedAsyncioTestCase):
+    def make_cache(self, clock):
+        return LocalCache(clock = clock)
+
+class TestSQLiteCache(BackendTests, unittest.IsolatedAsyncioTestCase):
+    def make_cache(self, clock):
+        self.directory = tempfile.TemporaryDirectory()
+        return SQLiteCache(os.path.join(self.directory.name, "shared.db"), clock = clock)
+
+    async def asyncTearDown(self):
+        await super().asyncTearDown()
+        self.directory.cleanup()
+
+class TestSharedArrivals(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.calls = []
+
+    async def asyncTearDown(self):
+        self.directory.cleanup()
+
+    async def fetch(self, station: str) -> dict:
+        self.calls.append(station)
+        await asyncio.sleep(0.05)
+        return {"BusStopCode": station, "Services": []}
+
+    async def test_workers_share_one_fetch(self):
+        # Two workers, each with their own connection to the same file.
+        path = os.path.join(self.directory.name, "shared.db")
+        backends = [SQLiteCache(path), SQLiteCache(path)]
+        workers = [ArrivalCache(self.fetch, shared = backend, worker_id = f"worker {i}", lease_poll_interval = 0.01)
+                    for i, backend in enumerate(backends)]
+        try:
+            results = await asyncio.gather(*(worker.get("01012") for worker in workers for i in range(5)))
+            self.assertEqual(self.calls, ["01012"])
+            self.assertTrue(all(result == results[0] for result in results))
+            self.assertEqual(sum(worker.stats()["shared_hits"] + worker.stats()["shared_waits"] for worker in workers), 1)
+        finally:
+            for backend in backends: backend.close()
+
+if __name__ == "__main__":
+    unittest.main()
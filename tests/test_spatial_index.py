@@ -0,0 +1,35 @@
+from src.spatial_index import StationSpatialIndex
+from haversine import haversine, Unit
+import unittest
+import random
+
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(42)
+        self.bus_stops = [{"BusStopCode": f"{i:05d}", "Description": f"Stop {i}",
+                            "Latitude": rng.uniform(1.24, 1.47), "Longitude": rng.uniform(103.62, 104.03)} for i in range(2000)]
+        self.index = StationSpatialIndex(self.bus_stops)
+        self.locations = [(rng.uniform(1.2, 1.5), rng.uniform(103.6, 104.1)) for i in range(50)]
+
+    def brute_force(self, lat: float, long: float):
+        return sorted((haversine((lat, long), (stop["Latitude"], stop["Longitude"]), unit = Unit.METERS), stop["BusStopCode"]) for stop in self.bus_stops)
+
+    def test_nearest_matches_brute_force(self):
+        for lat, long in self.locations:
+            expected = [code for dist, code in self.brute_force(lat, long)[:5]]
+            self.assertEqual([code for code, name, dist in self.index.nearest(lat, long, 5)], expected)
+
+    def test_within_matches_brute_force(self):
+        for lat, long in self.locations:
+            expected = [code for dist, code in self.brute_force(lat, long) if dist <= 800]
+            self.assertEqual([code for code, name, dist in self.index.within(lat, long, 800)], expected)
+
+    def test_nearest_respects_radius(self):
+        lat, long = self.locations[0]
+        for code, name, dist in self.index.nearest(lat, long, 50, radius_m = 300):
+            self.assertLessEqual(dist, 300)
+
+    def test_far_away_and_empty(self):
+        self.assertEqual(len(self.index.nearest(0.0, 0.0, 3)), 3)
+        self.assertEqual(self.index.nearest(0.0, 0.0, 3, radius_m = 1000), [])
+        self.assertEqual(StationSpatialIndex([]).nearest(1.3, 103.8, 3), [])
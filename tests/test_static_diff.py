@@ -0,0 +1,69 @@
+from src.static_network import StaticNetwork, OPERATION_FIELDS
+from src.static_diff import diff_static_data
+from src.route_index import RouteIndexBuilder
+import unittest
+import datetime
+
+def make_stop(code: str, description: str, lat: float = 1.3, long: float = 103.8):
+    return {"BusStopCode": code, "Description": description, "RoadName": "Victoria St", "Latitude": lat, "Longitude": long}
+
+def make_route(first_bus: str, last_bus: str):
+    return dict(zip(OPERATION_FIELDS, (first_bus, last_bus) * 3))
+
+def make_network(bus_stops: list, operation_times: dict) -> StaticNetwork:
+    # Every service stops at the stations in the order they're listed.
+    route_builder = RouteIndexBuilder()
+    route_builder.add_rows([{"ServiceNo": service_no, "Direction": 1, "StopSequence": sequence, "BusStopCode": station}
+                            for sequence, (station, services) in enumerate(operation_times.items()) for service_no in services])
+    return StaticNetwork(bus_stops, operation_times, route_index = route_builder.build())
+
+class TestStaticDiff(unittest.TestCase):
+    def setUp(self):
+        self.old = make_network([make_stop("01012", "Hotel Grand Pacific"), make_stop("01013", "St. Joseph's Ch"), make_stop("01019", "Bras Basah Cplx")],
+                                {"01012": {"2": make_route("0530", "2330"), "12": make_route("0600", "0030")},
+                                 "01013": {"12": make_route("0601", "0031")},
+                                 "01019": {"7": make_route("0500", "2300")}})
+        new = make_network([make_stop("01012", "Hotel Grand Pacific"), make_stop("01013", "St Joseph's Church"), make_stop("01029", "Opp Natl Lib", 1.29, 103.85)],
+                                {"01012": {"2": make_route("0530", "2345"), "12": make_route("0600", "0030")},
+                                 "01013": {"12": make_route("0601", "0031"), "133": make_route("0600", "2300")},
+                                 "01029": {"7": make_route("0500", "2300")}})
+        self.new = new
+        self.diff = diff_static_data(self.old.stations, self.old.operation_times, new.stations, new.operation_times)
+
+    def test_diff(self):
+        self.assertEqual(self.diff.added_stops, {"01029"})
+        self.assertEqual(self.diff.removed_stops, {"01019"})
+        self.assertEqual(self.diff.changed_stops, {"01013"})
+        self.assertEqual(self.diff.added_routes, {("01013", "133"), ("01029", "7")})
+        self.assertEqual(self.diff.removed_routes, {("01019", "7")})
+        self.assertEqual(self.diff.changed_routes, {("01012", "2")})
+        self.assertEqual(self.diff.affected_stations(), {"01012", "01013", "01019", "01029"})
+
+    def test_apply_diff_matches_full_rebuild(self):
+        patched = self.old.apply_diff(self.diff, self.new.stations, self.new.operation_times, route_index = self.new.route_index)
+        self.assertEqual(patched.stations, self.new.stations)
+        self.assertEqual(patched.operation_times, self.new.operation_times)
+        self.assertEqual({station: set(services) for station, services in patched.services_by_station.items() if services},
+                            {station: set(services) for station, services in self.new.services_by_station.items() if services})
+        self.assertEqual(patched.spatial_index.nearest(1.29, 103.85, 1)[0][0], "01029")
+
+        when = datetime.datetime(2023, 1, 2, 23, 40)
+        for station in ("01012", "01013", "01019", "01029"):
+            self.assertEqual(patched.operating_hours.running_services(station, when), self.new.operating_hours.running_services(station, when))
+        for service_no in ("2", "7", "12", "133"):
+            self.assertEqual(patched.nearest_served_by(service_no, 1.29, 103.85, 5), self.new.nearest_served_by(service_no, 1.29, 103.85, 5))
+
+    def test_empty_diff_reuses_everything(self):
+        same = diff_static_data(self.old.stations, self.old.operation_times, self.old.stations, self.old.operation_times)
+        self.assertTrue(same.is_empty())
+        patched = self.old.apply_diff(same, {}, {})
+        self.assertIs(patched.operating_hours, self.old.operating_hours)
+        self.assertIs(patched.spatial_index, self.old.spatial_index)
+        self.assertIs(patched.route_positions, self.old.route_positions)
+
+    def test_compaction(self):
+        table = self.old.operating_hours
+        for i in range(10):
+            table = table.with_stations({"01012": {"2": make_route("0530", f"23{i}0")}})
+        self.assertLess(len(table.services), 10)
+        self.assertTrue(table.is_running("01012", "2", datetime.datetime(2023, 1, 2, 23, 45)))
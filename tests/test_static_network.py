@@ -0,0 +1,88 @@
+import src.static_network as test_subject
+from src.route_index import RouteIndexBuilder
+from src import static_snapshot
+from unittest import mock
+import contextlib
+import functools
+import tempfile
+import unittest
+import json
+import io
+import os
+
+def make_route(station: str, service: str, first_bus: str = "0500", last_bus: str = "2330", sequence: int = 1):
+    return {
+        "ServiceNo": service,
+        "Direction": 1,
+        "StopSequence": sequence,
+        "BusStopCode": station,
+        "WD_FirstBus": first_bus, "WD_LastBus": last_bus,
+        "SAT_FirstBus": first_bus, "SAT_LastBus": last_bus,
+        "SUN_FirstBus": "-", "SUN_LastBus": "-"
+    }
+
+class TestStaticNetwork(unittest.TestCase):
+    def setUp(self):
+        bus_stops = [
+            {"BusStopCode": "01012", "Description": "Hotel Grand Pacific", "RoadName": "Victoria St", "Latitude": 1.2966, "Longitude": 103.8525},
+            {"BusStopCode": "01013", "Description": "St. Joseph's Ch", "RoadName": "Victoria St", "Latitude": 1.2977, "Longitude": 103.8532}
+        ]
+        operation_times = {
+            "01012": {"2": make_route("01012", "2"), "12": make_route("01012", "12", "0600", "0030")},
+            "01013": {}
+        }
+        self.operation_times = operation_times
+        route_builder = RouteIndexBuilder()
+        route_builder.add_rows([route for services in operation_times.values() for route in services.values()])
+        self.network = test_subject.StaticNetwork(bus_stops, operation_times, "2023-01-01T00:00:00+08:00", route_builder.build())
+
+    def test_station_lookup(self):
+        self.assertEqual(self.network.get_station_name("01012"), "Hotel Grand Pacific")
+        self.assertIsNone(self.network.get_station_name("99999"))
+
+    def test_services(self):
+        self.assertEqual(self.network.get_services("01012"), ("2", "12"))
+        self.assertEqual(self.network.get_services("01013"), ())
+
+    def test_nearest_served_by(self):
+        # 01013 is closer, but no buses stop there.
+        self.assertEqual([code for code, name, dist in self.network.nearest_served_by("12", 1.2978, 103.8533)], ["01012"])
+        self.assertEqual(self.network.nearest_served_by("12", 1.2978, 103.8533, radius_m = 50), [])
+        self.assertEqual(self.network.nearest_served_by("999", 1.2978, 103.8533), [])
+
+    def test_nearest_served_by_from_json(self):
+        # Converted from the old JSON files, so there's no route index (yet). We go by the operation times until there is.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            station_path, operation_path = os.path.join(tmpdir, "bus_station_info.json"), os.path.join(tmpdir, "bus_operation_info.json")
+            path = os.path.join(tmpdir, "static_network.snap")
+            with open(station_path, "w") as f:
+                f.write(json.dumps({"bus_stops": list(self.network.stations.values())}))
+            with open(operation_path, "w") as f:
+                f.write(json.dumps({"operation_times": self.operation_times, "last_updated": self.network.last_updated}))
+            static_snapshot.convert_from_json(station_path, operation_path, path)
+            with mock.patch.object(static_snapshot, "read_snapshot", functools.partial(static_snapshot.read_snapshot, path)):
+                network = test_subject.load_from_storage()
+        self.assertEqual(len(network.route_index), 0)
+        self.assertEqual([code for code, name, dist in network.nearest_served_by("12", 1.2978, 103.8533)], ["01012"])
+        self.assertEqual(network.nearest_served_by("999", 1.2978, 103.8533), [])
+
+    def test_unreadable_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "static_network.snap")
+            static_snapshot.write_snapshot(self.network.stations.values(), self.network.operation_times, self.network.last_updated, path)
+            with open(path, "rb") as f:
+                snapshot = f.read()
+            # Garbage, cut off halfway, and from some future version of us.
+            for contents in (b"definitely not a snapshot", snapshot[:len(snapshot) // 2], snapshot[:8] + b"\xff" + snapshot[9:]):
+                with open(path, "wb") as f:
+                    f.write(contents)
+                test_subject.swap_network(None)
+                with mock.patch.object(static_snapshot, "read_snapshot", functools.partial(static_snapshot.read_snapshot, path)), \
+                        contextlib.redirect_stdout(io.StringIO()):
+                    self.assertIs(test_subject.get_network(), test_subject.EMPTY_NETWORK)
+        test_subject.swap_network(None)
+
+    def test_swap(self):
+        test_subject.swap_network(self.network)
+        self.assertIs(test_subject.get_network(), self.network)
+        test_subject.swap_network(None)
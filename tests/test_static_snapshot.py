@@ -0,0 +1,65 @@
+from src import static_snapshot as test_subject
+from src import static_network
+import unittest
+import tempfile
+import json
+import os
+
+class TestStaticSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "static_network.snap")
+        self.bus_stops = [
+            {"BusStopCode": "01012", "Description": "Hotel Grand Pacific", "RoadName": "Victoria St", "Latitude": 1.29684825487647, "Longitude": 103.85253591654006},
+            {"BusStopCode": "01013", "Description": "St. Joseph’s Ch", "RoadName": "Victoria St", "Latitude": 1.29770970610083, "Longitude": 103.8532247463225}
+        ]
+        self.operation_times = {
+            ("01012", "2"): ("0530", "2330", "0530", "2330", "-", "-"),
+            ("01012", "12"): ("0600", "0030", "0600", "0030", "0600", "0030"),
+            ("01013", "12"): ("0601", "0031", "0601", "0031", "0601", "0031")
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        test_subject.write_snapshot(self.bus_stops, self.operation_times, "2023-01-01T00:00:00+08:00", self.path)
+        bus_stops, operation_times, last_updated, route_columns = test_subject.read_snapshot(self.path)
+        self.assertEqual(bus_stops, self.bus_stops)
+        self.assertIsNone(route_columns)
+        self.assertEqual(last_updated, "2023-01-01T00:00:00+08:00")
+        self.assertEqual(list(operation_times["01012"].keys()), ["2", "12"])
+        self.assertEqual(operation_times["01013"]["12"]["SUN_LastBus"], "0031")
+        self.assertEqual(operation_times["01012"]["2"]["BusStopCode"], "01012")
+
+    def test_empty(self):
+        test_subject.write_snapshot([], {}, None, self.path)
+        self.assertEqual(test_subject.read_snapshot(self.path), ([], {}, None, None))
+
+    def test_route_columns(self):
+        route_columns = (["12", "12"], [1, 2], [0, 2, 3], ["01012", "01013", "01013"], [0.0, 0.6, 0.0])
+        test_subject.write_snapshot(self.bus_stops, self.operation_times, None, self.path, route_columns = route_columns)
+        services, directions, route_start, stop_stations, stop_distances = test_subject.read_snapshot(self.path)[3]
+        self.assertEqual(services, ["12", "12"])
+        self.assertEqual(directions.tolist(), [1, 2])
+        self.assertEqual(route_start.tolist(), [0, 2, 3])
+        self.assertEqual(stop_stations, ["01012", "01013", "01013"])
+        self.assertAlmostEqual(float(stop_distances[1]), 0.6, places = 5)
+
+    def test_rejects_other_files(self):
+        with open(self.path, "wb") as f: f.write(b"{}")
+        with self.assertRaises(test_subject.SnapshotFormatException):
+            test_subject.read_snapshot(self.path)
+
+    def test_convert_from_json(self):
+        station_path = os.path.join(self.tmpdir.name, "bus_station_info.json")
+        operation_path = os.path.join(self.tmpdir.name, "bus_operation_info.json")
+        with open(station_path, "w") as f:
+            f.write(json.dumps({"bus_stops": self.bus_stops}))
+        with open(operation_path, "w") as f:
+            f.write(json.dumps({"operation_times": {"01012": {"2": dict(zip(static_network.OPERATION_FIELDS, self.operation_times[("01012", "2")]), ServiceNo = "2", Direction = 1)}},
+                                "last_updated": "2023-01-01T00:00:00+08:00"}))
+        test_subject.convert_from_json(station_path, operation_path, self.path)
+        bus_stops, operation_times, last_updated, route_columns = test_subject.read_snapshot(self.path)
+        self.assertEqual(operation_times["01012"]["2"]["WD_FirstBus"], "0530")
+        self.assertNotIn("Direction", operation_times["01012"]["2"])
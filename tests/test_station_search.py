@@ -0,0 +1,25 @@
+from src.station_search import StationSearchIndex
+import unittest
+
+class TestStationSearch(unittest.TestCase):
+    def setUp(self):
+        self.index = StationSearchIndex([
+            {"BusStopCode": "84009", "Description": "Bedok Int", "RoadName": "Bedok Nth Dr"},
+            {"BusStopCode": "84031", "Description": "Opp Bedok Int", "RoadName": "Bedok Nth Rd"},
+            {"BusStopCode": "17009", "Description": "Clementi Int", "RoadName": "Clementi Ave 3"},
+            {"BusStopCode": "01012", "Description": "Hotel Grand Pacific", "RoadName": "Victoria St"}
+        ])
+
+    def test_prefix_ranks_first(self):
+        self.assertEqual([code for code, name, road, score in self.index.search("bedok int", 2)], ["84009", "84031"])
+
+    def test_typo(self):
+        self.assertEqual(self.index.search("clemnti")[0][0], "17009")
+
+    def test_road_name(self):
+        self.assertEqual(self.index.search("victoria st")[0][0], "01012")
+
+    def test_no_match(self):
+        self.assertEqual(self.index.search("zzzz"), [])
+        self.assertEqual(self.index.search("  "), [])
+        self.assertEqual(StationSearchIndex([]).search("bedok"), [])
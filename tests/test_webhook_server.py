@@ -0,0 +1,81 @@
+from src.webhook_server import WebhookServer, chat_key
+from telebot import types
+import unittest
+import asyncio
+import aiohttp
+import socket
+
+def text_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {"message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": chat_id, "type": "private"}, "from": {"id": chat_id, "is_bot": False, "first_name": "User"}}}
+
+class FakeBot:
+    def __init__(self):
+        self.handled = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def process_new_updates(self, updates: list):
+        await self.release.wait()
+        for update in updates:
+            # Later updates finish faster, so anything out of order would show.
+            await asyncio.sleep(0.02 / update.update_id)
+            self.handled.append((update.message.chat.id, update.message.text))
+
+class TestWebhookServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.bot = FakeBot()
+
+    def test_chat_key(self):
+        self.assertEqual(chat_key(types.Update.de_json(text_update(1, 42, "hi"))), 42)
+        self.assertEqual(chat_key(types.Update.de_json({"update_id": 7})), ("update", 7))
+
+    async def test_per_chat_ordering(self):
+        server = WebhookServer(self.bot, workers = 4)
+        server.start_workers()
+        try:
+            for i in range(1, 7): self.assertTrue(server.accept(types.Update.de_json(text_update(i, i % 2, str(i)))))
+            while server.pending: await asyncio.sleep(0.01)
+        finally:
+            await server.stop_workers()
+        self.assertEqual([text for chat, text in self.bot.handled if chat == 0], ["2", "4", "6"])
+        self.assertEqual([text for chat, text in self.bot.handled if chat == 1], ["1", "3", "5"])
+        self.assertEqual(server.stats()["pending_chats"], 0)
+
+    async def test_sheds_load(self):
+        server = WebhookServer(self.bot, max_pending = 3, max_pending_per_chat = 2)
+        self.assertTrue(server.accept(types.Update.de_json(text_update(1, 1, "a"))))
+        self.assertTrue(server.accept(types.Update.de_json(text_update(2, 1, "b"))))
+        self.assertFalse(server.accept(types.Update.de_json(text_update(3, 1, "c"))))
+        self.assertTrue(server.accept(types.Update.de_json(text_update(4, 2, "d"))))
+        self.assertFalse(server.accept(types.Update.de_json(text_update(5, 3, "e"))))
+        self.assertEqual(server.stats()["shed"], 2)
+
+    async def test_http(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        server = WebhookServer(self.bot, port = port, secret_token = "secret", max_pending = 1)
+        self.bot.release.clear()
+        serving = asyncio.create_task(server.serve())
+        await asyncio.sleep(0.1)
+        url = f"http://127.0.0.1:{port}/telegram"
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, json = text_update(1, 1, "a")) as response:
+                    self.assertEqual(response.status, 401)
+                headers = {"X-Telegram-Bot-Api-Secret-Token": "secret"}
+                async with session.post(url, json = text_update(1, 1, "a"), headers = headers) as response:
+                    self.assertEqual(response.status, 200)
+                # The first one is still being handled, so there's no room for this one yet.
+                async with session.post(url, json = text_update(2, 2, "b"), headers = headers) as response:
+                    self.assertEqual(response.status, 503)
+                self.bot.release.set()
+                while server.pending: await asyncio.sleep(0.01)
+        finally:
+            serving.cancel()
+            await asyncio.gather(serving, return_exceptions = True)
+        self.assertEqual(self.bot.handled, [(1, "a")])
+
+if __name__ == "__main__":
+    unittest.main()